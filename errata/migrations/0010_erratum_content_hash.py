@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('errata', '0009_backfill_cached_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ErrataFeed',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('checksum', models.CharField(blank=True, max_length=255, null=True)),
+                ('timestamp', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Errata Feed',
+                'verbose_name_plural': 'Errata Feeds',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='erratum',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
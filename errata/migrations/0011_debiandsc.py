@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('errata', '0010_erratum_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DebianDSC',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('version', models.CharField(max_length=255)),
+                ('url', models.URLField(max_length=765)),
+                ('package_list', models.JSONField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Debian DSC',
+                'verbose_name_plural': 'Debian DSCs',
+                'ordering': ['source', 'version'],
+                'unique_together': {('source', 'version')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('errata', '0011_debiandsc'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='erratafeed',
+            name='etag',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='erratafeed',
+            name='last_advisory_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='erratafeed',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('errata', '0012_errata_feed_conditional_fetch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='erratum',
+            name='package_matches',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 04:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('errata', '0013_erratum_package_matches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='erratafeed',
+            name='last_full_fetch',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
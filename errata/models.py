@@ -14,8 +14,6 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
-import json
-
 from django.db import IntegrityError, models
 from django.urls import reverse
 
@@ -24,10 +22,46 @@ from packages.models import Package, PackageUpdate
 from packages.utils import find_evr, get_matching_packages_q
 from security.models import CVE, Reference
 from security.utils import get_or_create_cve, get_or_create_reference
-from util import get_url
+from util import get_url, load_json
 from util.logging import error_message
 
 
+class ErrataFeed(models.Model):
+
+    name = models.CharField(max_length=255, unique=True)
+    checksum = models.CharField(max_length=255, blank=True, null=True)
+    etag = models.CharField(max_length=255, blank=True, null=True)
+    last_modified = models.CharField(max_length=255, blank=True, null=True)
+    last_advisory_date = models.DateTimeField(blank=True, null=True)
+    last_full_fetch = models.DateTimeField(blank=True, null=True)
+    timestamp = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Errata Feed'
+        verbose_name_plural = 'Errata Feeds'
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class DebianDSC(models.Model):
+
+    source = models.CharField(max_length=255)
+    version = models.CharField(max_length=255)
+    url = models.URLField(max_length=765)
+    package_list = models.JSONField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Debian DSC'
+        verbose_name_plural = 'Debian DSCs'
+        unique_together = ['source', 'version']
+        ordering = ['source', 'version']
+
+    def __str__(self):
+        return f'{self.source} {self.version}'
+
+
 class Erratum(models.Model):
 
     name = models.CharField(max_length=255, unique=True)
@@ -45,6 +79,8 @@ class Erratum(models.Model):
     osreleases_count = models.PositiveIntegerField(default=0)
     cves_count = models.PositiveIntegerField(default=0)
     references_count = models.PositiveIntegerField(default=0)
+    content_hash = models.CharField(max_length=64, blank=True, null=True)
+    package_matches = models.JSONField(blank=True, null=True)
 
     objects = ErratumManager()
 
@@ -100,7 +136,7 @@ class Erratum(models.Model):
             return None
         if res.status_code == 404:
             return None
-        return json.loads(res.content)
+        return load_json(res.content)
 
     def parse_osv_dev_data(self, osv_dev_json):
         from django.db.models import Q
@@ -0,0 +1,406 @@
+# Copyright 2026 Marcus Furlong <furlongm@gmail.com>
+#
+# This file is part of Patchman.
+#
+# Patchman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 only.
+#
+# Patchman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchman. If not, see <http://www.gnu.org/licenses/>
+
+from django.db import transaction
+
+from errata.models import Erratum
+from errata.utils import (
+    record_errata_packages, update_errata_counts, update_erratum,
+)
+from modules.models import Module
+from modules.utils import get_matching_module_ids
+from operatingsystems.models import OSRelease
+from packages.models import Package, PackageString
+from packages.utils import (
+    get_matching_package_ids, get_or_create_by_name, get_or_create_packages,
+)
+from security.utils import get_or_create_cves, get_or_create_references
+from util import get_setting_of_type, tz_aware_datetime
+from util.logging import error_message, info_message
+
+
+class ErratumRecord:
+    """ A normalised erratum produced by an errata source, written to the
+        database by an ErratumSink. Packages can be PackageStrings, or
+        existing Package objects matched from the database, which are kept
+        by id. Packages whose architecture is not known are kept as (name,
+        epoch, version, release, packagetype) tuples and modules as (name,
+        stream, version, context, arch) tuples. These matches are stored
+        with the erratum and resolved against existing packages and modules
+        whenever errata are updated, so that packages and modules that
+        appear later are still linked.
+    """
+
+    def __init__(self, name, e_type, issue_date, synopsis, content_hash=None):
+        self.name = name
+        self.e_type = e_type
+        self.issue_date = issue_date
+        self.synopsis = synopsis
+        self.content_hash = content_hash
+        self.cve_ids = set()
+        self.references = set()
+        self.osrelease_names = set()
+        self.fixed_packages = set()
+        self.fixed_package_ids = set()
+        self.fixed_package_matches = set()
+        self.fixed_module_matches = set()
+        self.affected_packages = set()
+        self.affected_package_ids = set()
+        self.affected_package_matches = set()
+        self.module_packages = {}
+        self.module_package_matches = {}
+
+    def __str__(self):
+        return self.name
+
+    def add_cve(self, cve_id):
+        if not cve_id.startswith('CVE') or not cve_id.split('-')[1].isdigit():
+            error_message(text=f'Not a CVE ID: {cve_id}')
+            return
+        self.cve_ids.add(cve_id)
+
+    def add_reference(self, ref_type, url):
+        self.references.add((ref_type, url))
+
+    def add_osrelease(self, osrelease_name):
+        self.osrelease_names.add(osrelease_name)
+
+    def add_fixed_packages(self, packages):
+        add_record_packages(packages, self.fixed_packages, self.fixed_package_ids)
+
+    def add_fixed_package_match(self, name, epoch, version, release, packagetype):
+        self.fixed_package_matches.add((name, epoch, version, release, packagetype))
+
+    def add_fixed_module_match(self, name, stream, version, context, arch):
+        self.fixed_module_matches.add((name, stream, version, context, arch))
+
+    def add_affected_packages(self, packages):
+        add_record_packages(packages, self.affected_packages, self.affected_package_ids)
+
+    def add_affected_package_match(self, name, epoch, version, release, packagetype):
+        self.affected_package_matches.add((name, epoch, version, release, packagetype))
+
+    def add_module_packages(self, module_id, packages):
+        self.module_packages.setdefault(module_id, set()).update(packages)
+
+    def add_module_package_match(self, name, stream, version, context, arch, packages):
+        key = (name, stream, version, context, arch)
+        self.module_package_matches.setdefault(key, set()).update(packages)
+
+    def get_package_matches(self):
+        """ Returns the package and module matches of the record in the form
+            they are stored with the erratum, or None if there are none
+        """
+        module_packages = []
+        for module, packages in self.module_package_matches.items():
+            for p in packages:
+                module_packages.append([list(module), [p.name, p.epoch, p.version, p.release, p.arch, p.packagetype]])
+        matches = {
+            'fixed': sorted(list(m) for m in self.fixed_package_matches),
+            'affected': sorted(list(m) for m in self.affected_package_matches),
+            'fixed_modules': sorted(list(m) for m in self.fixed_module_matches),
+            'module_packages': sorted(module_packages),
+        }
+        if not any(matches.values()):
+            return None
+        return matches
+
+    def merge(self, other):
+        """ Merge the related objects of another record for the same erratum
+            into this one, the later details take precedence
+        """
+        self.e_type = other.e_type
+        self.issue_date = other.issue_date
+        self.synopsis = other.synopsis
+        self.content_hash = other.content_hash or self.content_hash
+        self.cve_ids.update(other.cve_ids)
+        self.references.update(other.references)
+        self.osrelease_names.update(other.osrelease_names)
+        self.fixed_packages.update(other.fixed_packages)
+        self.fixed_package_ids.update(other.fixed_package_ids)
+        self.fixed_package_matches.update(other.fixed_package_matches)
+        self.fixed_module_matches.update(other.fixed_module_matches)
+        self.affected_packages.update(other.affected_packages)
+        self.affected_package_ids.update(other.affected_package_ids)
+        self.affected_package_matches.update(other.affected_package_matches)
+        for module_id, packages in other.module_packages.items():
+            self.add_module_packages(module_id, packages)
+        for module, packages in other.module_package_matches.items():
+            self.add_module_package_match(*module, packages)
+
+
+def add_record_packages(packages, strpackages, package_ids):
+    """ Split packages into PackageStrings and the ids of Package objects
+    """
+    for package in packages:
+        if package is None:
+            continue
+        if isinstance(package, Package):
+            package_ids.add(package.id)
+        else:
+            strpackages.add(package)
+
+
+def get_errata_batch_size():
+    """ Returns the number of errata to write to the database at once
+    """
+    return get_setting_of_type(
+        setting_name='ERRATA_BATCH_SIZE',
+        setting_type=int,
+        default=1000,
+    )
+
+
+class ErratumSink:
+    """ Collects ErratumRecords from errata sources and writes them to the
+        database in batches, with one round of lookups per related model
+        and bulk inserts into the through tables. Use as a context manager
+        so that the last batch is written:
+
+            with ErratumSink() as sink:
+                for advisory in advisories:
+                    sink.add(process_advisory(advisory))
+
+        content_hashes maps erratum names to the content hashes of their
+        advisories, which are stored with the errata for change detection.
+        Records with an empty content hash are incomplete and are counted in
+        incomplete, so that sources can retry them.
+    """
+
+    def __init__(self, batch_size=None, content_hashes=None):
+        self.batch_size = batch_size or get_errata_batch_size()
+        self.content_hashes = content_hashes or {}
+        self.records = {}
+        self.incomplete = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, record):
+        """ Add a record, records for the same erratum are merged. Sources
+            return None for advisories that they skip, which are ignored.
+        """
+        if record is None:
+            return
+        if record.content_hash == '':
+            self.incomplete += 1
+        if record.content_hash is None:
+            record.content_hash = self.content_hashes.get(record.name)
+        if record.name in self.records:
+            self.records[record.name].merge(record)
+        else:
+            self.records[record.name] = record
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Write all pending records to the database
+        """
+        records = list(self.records.values())
+        self.records = {}
+        if records:
+            with transaction.atomic():
+                write_errata(records)
+
+
+def write_errata(records):
+    """ Write a batch of ErratumRecords and their related objects to the
+        database. Returns a dict mapping erratum names to Erratum ids
+    """
+    erratum_ids = upsert_errata(records)
+    cve_ids = get_or_create_cves(set().union(*(r.cve_ids for r in records)))
+    reference_ids = get_or_create_references(set().union(*(r.references for r in records)))
+    osrelease_ids = get_or_create_by_name(OSRelease, set().union(*(r.osrelease_names for r in records)))
+    strpackages = set()
+    for record in records:
+        strpackages.update(record.fixed_packages, record.affected_packages, *record.module_packages.values())
+    package_ids = get_or_create_packages(strpackages)
+
+    fixed_packages = []
+    affected_packages = []
+    osreleases = []
+    cves = []
+    references = []
+    module_packages = []
+    for record in records:
+        e_id = erratum_ids[record.name]
+        fixed_ids = record.fixed_package_ids.union(package_ids[p] for p in record.fixed_packages if p in package_ids)
+        record_errata_packages(fixed_ids)
+        for package_id in fixed_ids:
+            fixed_packages.append(Erratum.fixed_packages.through(erratum_id=e_id, package_id=package_id))
+        affected_ids = record.affected_package_ids.union(
+            package_ids[p] for p in record.affected_packages if p in package_ids)
+        record_errata_packages(affected_ids)
+        for package_id in affected_ids:
+            affected_packages.append(Erratum.affected_packages.through(erratum_id=e_id, package_id=package_id))
+        for osrelease_name in record.osrelease_names:
+            osreleases.append(Erratum.osreleases.through(erratum_id=e_id, osrelease_id=osrelease_ids[osrelease_name]))
+        for cve_id in record.cve_ids:
+            cves.append(Erratum.cves.through(erratum_id=e_id, cve_id=cve_ids[cve_id]))
+        for reference in record.references:
+            if reference in reference_ids:
+                references.append(Erratum.references.through(erratum_id=e_id, reference_id=reference_ids[reference]))
+        for module_id, packages in record.module_packages.items():
+            for package in packages:
+                if package in package_ids:
+                    module_packages.append(
+                        Module.packages.through(module_id=module_id, package_id=package_ids[package]))
+    for through_objects in [fixed_packages, affected_packages, osreleases, cves, references, module_packages]:
+        if through_objects:
+            type(through_objects[0]).objects.bulk_create(through_objects, ignore_conflicts=True, batch_size=1000)
+    package_matches = {erratum_ids[r.name]: r.get_package_matches() for r in records}
+    link_package_matches({e_id: matches for e_id, matches in package_matches.items() if matches})
+    update_errata_counts(erratum_ids.values())
+    return erratum_ids
+
+
+def upsert_errata(records):
+    """ Create new Erratum objects and update existing ones for a batch of
+        records. Returns a dict mapping erratum names to Erratum ids
+    """
+    names = [record.name for record in records]
+    existing = {}
+    for i in range(0, len(names), 1000):
+        for e in Erratum.objects.filter(name__in=names[i:i + 1000]):
+            existing[e.name] = e
+    new_errata = []
+    updated_errata = []
+    for record in records:
+        e = existing.get(record.name)
+        if e is None:
+            new_errata.append(Erratum(
+                name=record.name,
+                e_type=record.e_type,
+                issue_date=tz_aware_datetime(record.issue_date),
+                synopsis=record.synopsis,
+                content_hash=record.content_hash,
+                package_matches=record.get_package_matches(),
+            ))
+            continue
+        updated = update_erratum(e, record.e_type, record.issue_date, record.synopsis)
+        if record.content_hash and e.content_hash != record.content_hash:
+            e.content_hash = record.content_hash
+            updated = True
+        package_matches = record.get_package_matches()
+        if e.package_matches != package_matches:
+            e.package_matches = package_matches
+            updated = True
+        if updated:
+            updated_errata.append(e)
+    if updated_errata:
+        fields = ['e_type', 'issue_date', 'synopsis', 'content_hash', 'package_matches']
+        Erratum.objects.bulk_update(updated_errata, fields, batch_size=1000)
+    erratum_ids = {name: e.id for name, e in existing.items()}
+    if new_errata:
+        Erratum.objects.bulk_create(new_errata, ignore_conflicts=True, batch_size=1000)
+        new_names = [e.name for e in new_errata]
+        for i in range(0, len(new_names), 1000):
+            erratum_ids.update(Erratum.objects.filter(name__in=new_names[i:i + 1000]).values_list('name', 'id'))
+    return erratum_ids
+
+
+def link_package_matches(package_matches):
+    """ Takes a dict mapping Erratum ids to their stored package matches, and
+        links the existing packages and modules that match them. Returns the
+        set of ids of errata that gained fixed or affected packages
+    """
+    fixed_keys = set()
+    affected_keys = set()
+    module_keys = set()
+    strpackages = set()
+    for matches in package_matches.values():
+        fixed_keys.update(tuple(m) for m in matches.get('fixed', []))
+        affected_keys.update(tuple(m) for m in matches.get('affected', []))
+        module_keys.update(tuple(m) for m in matches.get('fixed_modules', []))
+        for module, package in matches.get('module_packages', []):
+            module_keys.add(tuple(module))
+            strpackages.add(get_match_packagestring(package))
+    package_ids = get_matching_package_ids(fixed_keys | affected_keys)
+    module_ids = get_matching_module_ids(module_keys)
+    strpackage_ids = get_or_create_packages(strpackages)
+    all_module_ids = set().union(*module_ids.values())
+    module_package_ids = {}
+    for i in range(0, len(all_module_ids), 1000):
+        modules = Module.packages.through.objects.filter(module_id__in=list(all_module_ids)[i:i + 1000])
+        for module_id, package_id in modules.values_list('module_id', 'package_id'):
+            module_package_ids.setdefault(module_id, set()).add(package_id)
+
+    fixed_packages = set()
+    affected_packages = set()
+    module_packages = set()
+    for e_id, matches in package_matches.items():
+        for m in matches.get('fixed', []):
+            fixed_packages.update((e_id, p_id) for p_id in package_ids.get(tuple(m), ()))
+        for m in matches.get('affected', []):
+            affected_packages.update((e_id, p_id) for p_id in package_ids.get(tuple(m), ()))
+        for m in matches.get('fixed_modules', []):
+            for module_id in module_ids.get(tuple(m), ()):
+                fixed_packages.update((e_id, p_id) for p_id in module_package_ids.get(module_id, ()))
+        for module, package in matches.get('module_packages', []):
+            package_id = strpackage_ids.get(get_match_packagestring(package))
+            if package_id:
+                module_packages.update((m_id, package_id) for m_id in module_ids.get(tuple(module), ()))
+
+    module_packages.difference_update(
+        (m_id, p_id) for m_id, p_ids in module_package_ids.items() for p_id in p_ids)
+    if module_packages:
+        Module.packages.through.objects.bulk_create(
+            [Module.packages.through(module_id=m_id, package_id=p_id) for m_id, p_id in module_packages],
+            ignore_conflicts=True, batch_size=1000)
+    linked_erratum_ids = set()
+    for field, pairs in [('fixed_packages', fixed_packages), ('affected_packages', affected_packages)]:
+        through = getattr(Erratum, field).through
+        erratum_ids = list({e_id for e_id, _ in pairs})
+        for i in range(0, len(erratum_ids), 1000):
+            existing = through.objects.filter(erratum_id__in=erratum_ids[i:i + 1000])
+            pairs.difference_update(existing.values_list('erratum_id', 'package_id'))
+        if pairs:
+            through.objects.bulk_create(
+                [through(erratum_id=e_id, package_id=p_id) for e_id, p_id in pairs],
+                ignore_conflicts=True, batch_size=1000)
+            linked_erratum_ids.update(e_id for e_id, _ in pairs)
+            record_errata_packages(p_id for _, p_id in pairs)
+    return linked_erratum_ids
+
+
+def get_match_packagestring(package):
+    """ Returns a PackageString for a package stored in package matches
+    """
+    name, epoch, version, release, arch, packagetype = package
+    return PackageString(
+        name=name, epoch=epoch, version=version, release=release, arch=arch, packagetype=packagetype)
+
+
+def resolve_errata_package_matches(batch_size=1000):
+    """ Link the existing packages and modules that match the stored package
+        matches of all errata. This runs after every errata update, as the
+        advisories of unchanged errata are skipped, but packages and modules
+        matching them may have appeared since they were last processed.
+    """
+    erratum_ids = list(Erratum.objects.filter(package_matches__isnull=False).values_list('id', flat=True))
+    linked_erratum_ids = set()
+    for i in range(0, len(erratum_ids), batch_size):
+        errata = Erratum.objects.filter(id__in=erratum_ids[i:i + batch_size])
+        with transaction.atomic():
+            linked = link_package_matches(dict(errata.values_list('id', 'package_matches')))
+            update_errata_counts(linked)
+        linked_erratum_ids.update(linked)
+    if linked_erratum_ids:
+        info_message(text=f'Linked newly matching Packages to {len(linked_erratum_ids)} Errata')
@@ -14,25 +14,28 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
-import json
 
-from errata.utils import get_or_create_erratum
-from modules.utils import get_matching_modules
-from operatingsystems.utils import (
-    get_or_create_osrelease, normalize_el_osrelease,
+from errata.sink import ErratumRecord, ErratumSink
+from errata.utils import (
+    errata_feed_has_changed, get_changed_errata, get_content_hash,
+    get_errata_feed_headers, set_errata_feed_checksum,
 )
-from packages.models import Package
-from packages.utils import get_or_create_package, parse_package_string
+from operatingsystems.utils import normalize_el_osrelease
+from packages.models import Package, PackageString
+from packages.utils import parse_package_string
 from patchman.signals import pbar_start, pbar_update
-from util import fetch_content, get_setting_of_type, get_url, run_concurrently
-from util.logging import clear_forked_pbar
+from util import (
+    fetch_content, get_setting_of_type, get_url, load_json, run_concurrently,
+)
+from util.logging import clear_forked_pbar, info_message
 
 
-def update_alma_errata(concurrent_processing=True, max_workers=25):
+def update_alma_errata(concurrent_processing=True, max_workers=25, force=False):
     """ Update Alma Linux advisories from errata.almalinux.org:
            https://errata.almalinux.org/8/errata.full.json
            https://errata.almalinux.org/9/errata.full.json
-        and process advisories
+        and process new or changed advisories. The errata are only fetched
+        if they have been modified since they were last processed
     """
     default_alma_releases = [8, 9]
     alma_releases = get_setting_of_type(
@@ -41,48 +44,71 @@ def update_alma_errata(concurrent_processing=True, max_workers=25):
         default=default_alma_releases,
     )
     for release in alma_releases:
-        advisories = fetch_alma_advisories(release)
-        process_alma_errata(release, advisories, concurrent_processing, max_workers)
+        feed_name = f'alma-{release}'
+        res = fetch_alma_errata(release, get_errata_feed_headers(feed_name, force))
+        if res is not None and res.status_code == 304:
+            info_message(text=f'Alma {release} Errata have not been modified, skipping Errata processing')
+            continue
+        advisories = parse_alma_advisories(fetch_content(res, f'Fetching Alma {release} Errata'))
+        if advisories is None:
+            continue
+        feed_checksum = get_content_hash(advisories)
+        if errata_feed_has_changed(feed_name, feed_checksum, force):
+            content_hashes = {a.get('id'): get_content_hash([release, a]) for a in advisories}
+            changed = get_changed_errata(content_hashes, force)
+            advisories = [a for a in advisories if a.get('id') in changed]
+            process_alma_errata(release, advisories, concurrent_processing, max_workers, content_hashes)
+        set_errata_feed_checksum(feed_name, feed_checksum, res)
+
+
+def fetch_alma_errata(release, headers=None):
+    """ Fetch the Alma Linux errata for a release, conditional headers can be
+        passed to only fetch them if they have been modified
+    """
+    alma_errata_url = f'https://errata.almalinux.org/{release}/errata.full.json'
+    request_headers = {'Accept': 'application/json', 'Cache-Control': 'no-cache, no-tranform'}
+    request_headers.update(headers or {})
+    return get_url(alma_errata_url, headers=request_headers)
 
 
-def fetch_alma_advisories(release):
-    """ Fetch Alma Linux advisories
+def parse_alma_advisories(data):
+    """ Parse Alma Linux advisories
     """
-    alma_errata_url = f'https://errata.almalinux.org/{release}/errata.full.json'
-    headers = {'Accept': 'application/json', 'Cache-Control': 'no-cache, no-tranform'}
-    res = get_url(alma_errata_url, headers=headers)
-    data = fetch_content(res, f'Fetching Alma {release} Errata')
-    advisories = json.loads(data).get('data')
-    return advisories
+    if not data:
+        return
+    return load_json(data).get('data')
 
 
-def process_alma_errata(release, advisories, concurrent_processing, max_workers=25):
+def process_alma_errata(release, advisories, concurrent_processing, max_workers=25, content_hashes=None):
     """ Process Alma Linux Errata
     """
     if concurrent_processing:
-        process_alma_errata_concurrently(release, advisories, max_workers)
+        process_alma_errata_concurrently(release, advisories, max_workers, content_hashes)
     else:
-        process_alma_errata_serially(release, advisories)
+        process_alma_errata_serially(release, advisories, content_hashes)
 
 
-def process_alma_errata_serially(release, advisories):
+def process_alma_errata_serially(release, advisories, content_hashes=None):
     """ Process Alma Linux Errata serially
     """
     elen = len(advisories)
     pbar_start.send(sender=None, ptext=f'Processing {elen} Alma {release} Errata', plen=elen)
-    for i, advisory in enumerate(advisories):
-        process_alma_erratum(release, advisory)
-        pbar_update.send(sender=None, index=i + 1)
+    with ErratumSink(content_hashes=content_hashes) as sink:
+        for i, advisory in enumerate(advisories):
+            sink.add(process_alma_erratum(release, advisory))
+            pbar_update.send(sender=None, index=i + 1)
 
 
-def process_alma_errata_concurrently(release, advisories, max_workers=25):
+def process_alma_errata_concurrently(release, advisories, max_workers=25, content_hashes=None):
     """ Process Alma Linux Errata concurrently
     """
     elen = len(advisories)
     pbar_start.send(sender=None, ptext=f'Processing {elen} Alma {release} Errata', plen=elen)
     args = [(release, advisory) for advisory in advisories]
-    for i, _ in enumerate(run_concurrently(process_alma_erratum_wrapper, args, max_workers)):
-        pbar_update.send(sender=None, index=i + 1)
+    with ErratumSink(content_hashes=content_hashes) as sink:
+        for i, record in enumerate(run_concurrently(process_alma_erratum_wrapper, args, max_workers)):
+            sink.add(record)
+            pbar_update.send(sender=None, index=i + 1)
 
 
 def process_alma_erratum_wrapper(args):
@@ -92,12 +118,13 @@ def process_alma_erratum_wrapper(args):
 
 def process_alma_erratum(release, advisory):
     """ Process a single Alma Linux Erratum
+        Returns an ErratumRecord
     """
     erratum_name = advisory.get('id')
     issue_date = advisory.get('issued_date')
     synopsis = advisory.get('title')
     e_type = advisory.get('type')
-    e, created = get_or_create_erratum(
+    e = ErratumRecord(
         name=erratum_name,
         e_type=e_type,
         issue_date=issue_date,
@@ -107,14 +134,13 @@ def process_alma_erratum(release, advisory):
     add_alma_erratum_references(e, advisory)
     add_alma_erratum_packages(e, advisory)
     add_alma_erratum_modules(e, advisory)
+    return e
 
 
 def add_alma_erratum_osreleases(e, release):
     """ Update OS Release for Alma Linux errata
     """
-    osrelease_name = normalize_el_osrelease(f'Alma Linux {release}')
-    osrelease = get_or_create_osrelease(name=osrelease_name)
-    e.osreleases.add(osrelease)
+    e.add_osrelease(normalize_el_osrelease(f'Alma Linux {release}'))
 
 
 def add_alma_erratum_references(e, advisory):
@@ -142,16 +168,22 @@ def add_alma_erratum_packages(e, advisory):
         package_name = package.get('filename')
         if package_name:
             name, epoch, ver, rel, dist, arch = parse_package_string(package_name)
-            p_type = Package.RPM
-            fixed_package = get_or_create_package(name, epoch, ver, rel, arch, p_type)
+            fixed_package = PackageString(
+                name=name.lower(),
+                epoch=epoch,
+                version=ver,
+                release=rel,
+                arch=arch,
+                packagetype=Package.RPM,
+            )
             fixed_packages.add(fixed_package)
     e.add_fixed_packages(fixed_packages)
 
 
 def add_alma_erratum_modules(e, advisory):
-    """ Parse and add modules for Alma Linux errata
+    """ Parse and add modules for Alma Linux errata, the packages of
+        matching modules are fixed packages
     """
-    fixed_packages = set()
     modules = advisory.get('modules')
     for module in modules:
         name = module.get('name')
@@ -159,8 +191,4 @@ def add_alma_erratum_modules(e, advisory):
         context = module.get('context')
         stream = module.get('stream')
         version = module.get('version')
-        matching_modules = get_matching_modules(name, stream, version, context, arch)
-        for match in matching_modules.prefetch_related('packages'):
-            for fixed_package in match.packages.all():
-                fixed_packages.add(fixed_package)
-    e.add_fixed_packages(fixed_packages)
+        e.add_fixed_module_match(name, stream, str(version), context, arch)
@@ -15,27 +15,37 @@
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
 import concurrent.futures
-import json
 
-from errata.utils import get_or_create_erratum
-from operatingsystems.utils import get_or_create_osrelease
-from packages.models import Package
-from packages.utils import (
-    find_evr, get_matching_packages, get_or_create_package,
+from errata.sink import ErratumRecord, ErratumSink
+from errata.utils import (
+    errata_feed_has_changed, get_changed_errata, get_content_hash,
+    set_errata_feed_checksum,
 )
+from operatingsystems.utils import get_or_create_osrelease
+from packages.models import Package, PackageString
+from packages.utils import find_evr
 from patchman.signals import pbar_start, pbar_update
-from util import fetch_content, get_url
+from util import fetch_content, get_url, load_json
 from util.logging import clear_forked_pbar, error_message
 
 
-def update_arch_errata(concurrent_processing=False, max_workers=25):
+def update_arch_errata(concurrent_processing=False, max_workers=25, force=False):
     """ Update Arch Linux Errata from the following sources:
         https://security.archlinux.org/advisories.json
+        Only new or changed advisories are processed
     """
     add_arch_linux_osrelease()
     advisories = fetch_arch_errata()
-    if advisories:
-        parse_arch_errata(advisories, concurrent_processing, max_workers)
+    if not advisories:
+        return
+    feed_checksum = get_content_hash(advisories)
+    if not errata_feed_has_changed('arch', feed_checksum, force):
+        return
+    content_hashes = {a.get('name'): get_content_hash(a) for a in advisories}
+    changed = get_changed_errata(content_hashes, force)
+    advisories = [a for a in advisories if a.get('name') in changed]
+    parse_arch_errata(advisories, concurrent_processing, max_workers, content_hashes)
+    set_errata_feed_checksum('arch', feed_checksum)
 
 
 def fetch_arch_errata():
@@ -46,45 +56,47 @@ def fetch_arch_errata():
     advisories = fetch_content(res, 'Fetching Arch Advisories')
     if advisories is None:
         return None
-    return json.loads(advisories)
+    return load_json(advisories)
 
 
-def parse_arch_errata(advisories, concurrent_processing, max_workers=25):
+def parse_arch_errata(advisories, concurrent_processing, max_workers=25, content_hashes=None):
     """ Parse Arch Linux Errata Advisories
     """
     if concurrent_processing:
-        parse_arch_errata_concurrently(advisories, max_workers)
+        parse_arch_errata_concurrently(advisories, max_workers, content_hashes)
     else:
-        parse_arch_errata_serially(advisories)
+        parse_arch_errata_serially(advisories, content_hashes)
 
 
-def parse_arch_errata_serially(advisories):
+def parse_arch_errata_serially(advisories, content_hashes=None):
     """ Parse Arch Linux Errata Advisories serially
     """
-    osrelease = get_or_create_osrelease(name='Arch Linux')
     elen = len(advisories)
     pbar_start.send(sender=None, ptext=f'Processing {elen} Arch Advisories', plen=elen)
-    for i, advisory in enumerate(advisories):
-        process_arch_erratum(advisory, osrelease)
-        pbar_update.send(sender=None, index=i + 1)
+    with ErratumSink(content_hashes=content_hashes) as sink:
+        for i, advisory in enumerate(advisories):
+            sink.add(process_arch_erratum(advisory))
+            pbar_update.send(sender=None, index=i + 1)
 
 
-def parse_arch_errata_concurrently(advisories, max_workers=25):
+def parse_arch_errata_concurrently(advisories, max_workers=25, content_hashes=None):
     """ Parse Arch Linux Errata Advisories concurrently
     """
-    osrelease = get_or_create_osrelease(name='Arch Linux')
     elen = len(advisories)
     pbar_start.send(sender=None, ptext=f'Processing {elen} Arch Advisories', plen=elen)
     i = 0
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_arch_erratum, advisory, osrelease) for advisory in advisories]
-        for future in concurrent.futures.as_completed(futures):
-            i += 1
-            pbar_update.send(sender=None, index=i + 1)
+    with ErratumSink(content_hashes=content_hashes) as sink:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(process_arch_erratum, advisory) for advisory in advisories]
+            for future in concurrent.futures.as_completed(futures):
+                sink.add(future.result())
+                i += 1
+                pbar_update.send(sender=None, index=i + 1)
 
 
-def process_arch_erratum(advisory, osrelease):
+def process_arch_erratum(advisory):
     """ Process a single Arch Linux Erratum
+        Returns an ErratumRecord
     """
     clear_forked_pbar()
     try:
@@ -93,15 +105,16 @@ def process_arch_erratum(advisory, osrelease):
         package = advisory.get('package')
         issue_type = advisory.get('type')
         synopsis = f'{package} - {issue_type}'
-        e, created = get_or_create_erratum(
+        e = ErratumRecord(
             name=name,
             e_type='security',
             issue_date=issue_date,
             synopsis=synopsis,
         )
-        e.osreleases.add(osrelease)
+        e.add_osrelease('Arch Linux')
         add_arch_erratum_references(e, advisory)
         add_arch_erratum_packages(e, advisory)
+        return e
     except Exception as exc:
         error_message(text=exc)
 
@@ -158,12 +171,11 @@ def add_arch_erratum_packages(e, advisory):
     if res is None:
         return
     data = res.content
-    group = json.loads(data)
+    group = load_json(data)
     packages = group.get('packages')
 
     affected = group.get('affected')
-    affected_packages = find_arch_affected_packages(affected, packages)
-    e.add_affected_packages(affected_packages)
+    add_arch_affected_package_matches(e, affected, packages)
 
     fixed = group.get('fixed')
     fixed_packages = find_arch_fixed_packages(fixed, packages)
@@ -173,19 +185,14 @@ def add_arch_erratum_packages(e, advisory):
     add_arch_erratum_group_cves(e, group)
 
 
-def find_arch_affected_packages(affected, packages):
-    """ Find Arch Linux Erratum Affected Packages
-        This checks existing packages for matches and does not
+def add_arch_affected_package_matches(e, affected, packages):
+    """ Add Arch Linux Erratum Affected Packages
+        These are matched against existing packages and do not
         require an architecture
     """
-    package_type = Package.ARCH
     epoch, version, release = find_evr(affected)
-    affected_packages = set()
     for package in packages:
-        matching_packages = get_matching_packages(package, epoch, version, release, package_type)
-        for match in matching_packages:
-            affected_packages.add(match)
-    return affected_packages
+        e.add_affected_package_match(package, epoch, version, release, Package.ARCH)
 
 
 def find_arch_fixed_packages(fixed, packages):
@@ -196,13 +203,13 @@ def find_arch_fixed_packages(fixed, packages):
     epoch, version, release = find_evr(fixed)
     fixed_packages = set()
     for package in packages:
-        fixed_package = get_or_create_package(
-            name=package,
+        fixed_package = PackageString(
+            name=package.lower(),
             epoch=epoch,
             version=version,
             release=release,
             arch='x86_64',
-            p_type=package_type
+            packagetype=package_type,
         )
         fixed_packages.add(fixed_package)
     return fixed_packages
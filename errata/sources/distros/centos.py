@@ -18,19 +18,28 @@ import re
 
 from defusedxml import ElementTree
 
-from operatingsystems.utils import get_or_create_osrelease
-from packages.models import Package
-from packages.utils import get_or_create_package, parse_package_string
+from errata.sink import ErratumRecord, ErratumSink
+from errata.utils import (
+    errata_feed_has_changed, get_changed_errata, get_content_hash,
+    set_errata_feed_checksum,
+)
+from packages.models import Package, PackageString
+from packages.utils import parse_package_string
 from patchman.signals import pbar_start, pbar_update
-from util import bunzip2, fetch_content, get_setting_of_type, get_sha1, get_url
+from util import (
+    fetch_content, get_setting_of_type, get_sha1, get_url, open_extracted,
+)
 from util.logging import error_message
 
 
-def update_centos_errata():
+def update_centos_errata(force=False):
     """ Update CentOS errata from https://cefs.steve-meier.de/
+        Errata are only parsed if the published checksum has changed
     """
     data = fetch_centos_errata_checksum()
     expected_checksum = parse_centos_errata_checksum(data)
+    if not errata_feed_has_changed('centos', expected_checksum, force):
+        return
     data = fetch_centos_errata()
     actual_checksum = get_sha1(data)
     if actual_checksum != expected_checksum:
@@ -39,7 +48,9 @@ def update_centos_errata():
         error_message(text=e)
     else:
         if data:
-            parse_centos_errata(bunzip2(data))
+            with open_extracted(data, 'bz2') as reader:
+                parse_centos_errata(reader.read(), force)
+            set_errata_feed_checksum('centos', expected_checksum)
 
 
 def fetch_centos_errata_checksum():
@@ -64,28 +75,35 @@ def parse_centos_errata_checksum(data):
             return line.split()[0]
 
 
-def parse_centos_errata(data):
+def parse_centos_errata(data, force=False):
     """ Parse CentOS errata from https://cefs.steve-meier.de/
+        Only new or changed errata are processed
     """
     result = ElementTree.XML(data)
-    errata_xml = result.findall('*')
+    errata_xml = []
+    for child in result.findall('*'):
+        releases = get_centos_erratum_releases(child.findall('os_release'))
+        if accepted_centos_release(releases):
+            errata_xml.append(child)
+    content_hashes = {c.tag.replace('--', ':'): get_content_hash(ElementTree.tostring(c)) for c in errata_xml}
+    changed = get_changed_errata(content_hashes, force)
+    errata_xml = [c for c in errata_xml if c.tag.replace('--', ':') in changed]
     elen = len(errata_xml)
     pbar_start.send(sender=None, ptext=f'Processing {elen} CentOS Errata', plen=elen)
-    for i, child in enumerate(errata_xml):
-        pbar_update.send(sender=None, index=i + 1)
-        releases = get_centos_erratum_releases(child.findall('os_release'))
-        if not accepted_centos_release(releases):
-            continue
-        e = parse_centos_errata_tag(child.tag, child.attrib)
-        if e is not None:
-            parse_centos_errata_children(e, child.iter())
+    with ErratumSink(content_hashes=content_hashes) as sink:
+        for i, child in enumerate(errata_xml):
+            pbar_update.send(sender=None, index=i + 1)
+            e = parse_centos_errata_tag(child.tag, child.attrib)
+            if e is not None:
+                parse_centos_errata_children(e, child.iter())
+                sink.add(e)
 
 
 def parse_centos_errata_tag(name, attribs):
     """ Parse all tags that contain errata. If the erratum already exists,
         we assume that it already has all refs, packages, releases and arches.
+        Returns an ErratumRecord
     """
-    from errata.utils import get_or_create_erratum
     e = None
     if name.startswith('CE'):
         issue_date = attribs['issue_date']
@@ -97,7 +115,7 @@ def parse_centos_errata_tag(name, attribs):
             e_type = 'security'
         elif name.startswith('CEEA'):
             e_type = 'enhancement'
-        e, created = get_or_create_erratum(
+        e = ErratumRecord(
             name=name.replace('--', ':'),
             e_type=e_type,
             issue_date=issue_date,
@@ -124,17 +142,21 @@ def parse_centos_errata_children(e, children):
             pass
         elif c.tag == 'os_release':
             if accepted_centos_release([c.text]):
-                osrelease_name = normalize_el_osrelease(f'CentOS {c.text}')
-                osrelease = get_or_create_osrelease(name=osrelease_name)
-                e.osreleases.add(osrelease)
+                e.add_osrelease(normalize_el_osrelease(f'CentOS {c.text}'))
         elif c.tag == 'packages':
             name, epoch, ver, rel, dist, arch = parse_package_string(c.text)
             match = re.match(r'.*el([0-9]+).*', rel)
             if match:
                 release = match.group(1)
                 if accepted_centos_release([release]):
-                    p_type = Package.RPM
-                    fixed_package = get_or_create_package(name, epoch, ver, rel, arch, p_type)
+                    fixed_package = PackageString(
+                        name=name.lower(),
+                        epoch=epoch,
+                        version=ver,
+                        release=rel,
+                        arch=arch,
+                        packagetype=Package.RPM,
+                    )
                     fixed_packages.add(fixed_package)
     e.add_fixed_packages(fixed_packages)
 
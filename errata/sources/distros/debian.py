@@ -20,36 +20,64 @@ from datetime import datetime
 from io import StringIO
 
 from debian.deb822 import Dsc
-
-from errata.utils import get_or_create_erratum
+from django.db import transaction
+from django.db.models import Q
+
+from errata.models import DebianDSC, ErrataFeed
+from errata.sink import ErratumRecord, ErratumSink
+from errata.utils import (
+    errata_feed_has_changed, get_changed_errata, get_content_hash,
+    set_errata_feed_checksum,
+)
 from operatingsystems.models import OSRelease
 from operatingsystems.utils import get_or_create_osrelease
-from packages.models import Package
-from packages.utils import find_evr, get_or_create_package
+from packages.models import Package, PackageString
+from packages.utils import find_evr
 from patchman.signals import pbar_start, pbar_update
 from util import (
-    extract, fetch_concurrently, fetch_content, get_setting_of_type, get_url,
-    run_concurrently,
+    fetch_concurrently, fetch_content, get_setting_of_type, get_url,
+    open_extracted, run_concurrently,
+)
+from util.logging import (
+    clear_forked_pbar, error_message, info_message, warning_message,
 )
-from util.logging import clear_forked_pbar, error_message, warning_message
 
 DSCs = {}
 
 
-def update_debian_errata(concurrent_processing=True, max_workers=25):
+def update_debian_errata(concurrent_processing=True, max_workers=25, force=False):
     """ Update Debian errata using:
           https://salsa.debian.org/security-tracker-team/security-tracker/raw/master/data/DSA/list
           https://salsa.debian.org/security-tracker-team/security-tracker/raw/master/data/DSA/list
+        DSC files are only fetched for new or changed errata, and only if
+        their package lists have not been stored before
     """
     codenames = retrieve_debian_codenames()
     create_debian_os_releases(codenames)
     dsas = fetch_debian_dsa_advisories()
     dlas = fetch_debian_dla_advisories()
     advisories = dsas + dlas
-    fetch_dscs_from_debian_package_file_maps()
     accepted_codenames = get_accepted_debian_codenames()
-    errata = parse_debian_errata(advisories, accepted_codenames, concurrent_processing, max_workers)
-    create_debian_errata(errata, accepted_codenames, concurrent_processing, max_workers)
+    feed_checksum = get_content_hash([advisories, accepted_codenames])
+    if not errata_feed_has_changed('debian', feed_checksum, force):
+        return
+    errata = parse_debian_errata(advisories, accepted_codenames)
+    content_hashes = {e.get('name'): get_content_hash([e, accepted_codenames]) for e in errata}
+    changed = get_changed_errata(content_hashes, force)
+    errata = [e for e in errata if e.get('name') in changed]
+    incomplete = 0
+    if errata:
+        dsc_fetches = get_debian_dsc_fetches(errata, accepted_codenames)
+        load_debian_dsc_package_lists(dsc_fetches, concurrent_processing, max_workers, force)
+        incomplete = create_debian_errata(errata, accepted_codenames, concurrent_processing, max_workers,
+                                          content_hashes)
+    else:
+        info_message(text='No new or changed Debian Errata found')
+    if incomplete:
+        # the feed has to be processed again for the incomplete errata to be retried
+        warning_message(text=f'{incomplete} Debian Errata are missing packages and will be retried')
+    else:
+        set_errata_feed_checksum('debian', feed_checksum)
 
 
 def fetch_debian_dsa_advisories():
@@ -70,25 +98,37 @@ def fetch_debian_dla_advisories():
     return data.decode()
 
 
-def fetch_dscs_from_debian_package_file_maps():
-    """ Fetch the current Debian package file maps
+def update_debian_package_file_maps(force=False):
+    """ Fetch the current Debian package file maps and store the DSC file
+        URLs they contain. A file map is only parsed if it has changed since
+        it was last parsed.
     """
     repos = ['debian', 'debian-security']
     for repo in repos:
         file_map_url = f'https://deb.debian.org/{repo}/indices/package-file.map.bz2'
         res = get_url(file_map_url)
         data = fetch_content(res, f'Fetching `{repo}` package file map')
-        file_map_data = extract(data, file_map_url).decode()
-        parse_debian_package_file_map(file_map_data, repo)
+        if not data:
+            continue
+        feed_name = f'debian-file-map-{repo}'
+        checksum = get_content_hash(data)
+        if not force and ErrataFeed.objects.filter(name=feed_name, checksum=checksum).exists():
+            continue
+        with open_extracted(data, file_map_url) as reader:
+            file_map_data = reader.read().decode()
+        store_debian_dsc_urls(parse_debian_package_file_map(file_map_data, repo))
+        set_errata_feed_checksum(feed_name, checksum)
 
 
 def parse_debian_package_file_map(data, repo):
     """ Parse the a Debian package file map
+        Returns a dict mapping (source package, version) tuples to DSC URLs
         Format:
             Path: ./pool/updates/main/3/389-ds-base/389-ds-base_1.4.0.21-1+deb10u1.dsc
             Source: 389-ds-base
             Source-Version: 1.4.0.21-1+deb10u1
     """
+    dsc_urls = {}
     parsing_dsc = False
     for line in data.splitlines():
         if line.startswith('Path:'):
@@ -102,22 +142,39 @@ def parse_debian_package_file_map(data, repo):
             source = line.split(' ')[1]
         elif line.startswith('Source-Version:') and parsing_dsc:
             version = line.split(' ')[1]
-            if not DSCs.get(source):
-                DSCs[source] = {}
-            if not DSCs[source].get(version):
-                DSCs[source][version] = {}
-            DSCs[source][version] = {'url': url}
+            dsc_urls[(source, version)] = url
             parsing_dsc = False
+    return dsc_urls
 
 
-def parse_debian_errata(advisories, accepted_codenames, concurrent_processing=True, max_workers=25):
+def store_debian_dsc_urls(dsc_urls):
+    """ Create DebianDSCs for new source package versions and update the URLs
+        of existing ones. Cached package lists are kept.
+    """
+    existing = {}
+    for dsc_id, source, version, url in DebianDSC.objects.values_list('id', 'source', 'version', 'url'):
+        existing[(source, version)] = (dsc_id, url)
+    new_dscs = []
+    updated_dscs = []
+    for (source, version), url in dsc_urls.items():
+        if (source, version) not in existing:
+            new_dscs.append(DebianDSC(source=source, version=version, url=url))
+            continue
+        dsc_id, existing_url = existing[(source, version)]
+        if existing_url != url:
+            updated_dscs.append(DebianDSC(id=dsc_id, url=url))
+    with transaction.atomic():
+        DebianDSC.objects.bulk_create(new_dscs, ignore_conflicts=True, batch_size=1000)
+        DebianDSC.objects.bulk_update(updated_dscs, ['url'], batch_size=1000)
+
+
+def parse_debian_errata(advisories, accepted_codenames):
     """ Parse Debian DSA/DLA files for security advisories
     """
     distro_pattern = re.compile(r'^\t\[(.+?)\] - .*')
     title_pattern = re.compile(r'^\[(.+?)\] (.+?) (.+?)[ ]+[-]+ (.*)')
     distro_package_pattern = re.compile(r'^\t\[(.+?)\] - (.+?) (.*)')
     errata = []
-    dsc_fetches = []
     e = {'packages': {}, 'cve_ids': [], 'releases': []}
     for line in advisories.splitlines():
         if line.startswith('['):
@@ -140,26 +197,37 @@ def parse_debian_errata(advisories, accepted_codenames, concurrent_processing=Tr
                 if pkg_match and pkg_match.group(1) in accepted_codenames:
                     source_package = pkg_match.group(2)
                     source_version = pkg_match.group(3)
-                    dsc_fetches.append((source_package, source_version))
                     e['packages'][release].append((source_package, source_version))
                 else:
                     e['packages'][release].append(None)
     # add the last one
     errata = add_errata_by_codename(errata, e, accepted_codenames)
-    fetch_debian_dsc_package_lists(dsc_fetches, concurrent_processing, max_workers)
     return errata
 
 
 def add_errata_by_codename(errata, e, accepted_codenames):
-    """ Get errata by codename and add to errata
+    """ Add an erratum to errata if it affects any accepted codename
     """
     if e:
         for release in e.get('releases'):
             if release in accepted_codenames:
                 errata.append(e)
+                break
     return errata
 
 
+def get_debian_dsc_fetches(errata, accepted_codenames):
+    """ Returns the (source package, version) tuples of the DSC files needed
+        to find the packages fixed by errata
+    """
+    dsc_fetches = set()
+    for e in errata:
+        for codename, packages in e.get('packages').items():
+            if codename in accepted_codenames:
+                dsc_fetches.update(package for package in packages if package)
+    return list(dsc_fetches)
+
+
 def parse_debian_erratum_advisory(e, match):
     """ Parse the initial details for an erratum in a DSA/DLA file
         Returns the updated dictionary
@@ -174,33 +242,42 @@ def parse_debian_erratum_advisory(e, match):
     return e
 
 
-def create_debian_errata(errata, accepted_codenames, concurrent_processing, max_workers=25):
+def create_debian_errata(errata, accepted_codenames, concurrent_processing, max_workers=25, content_hashes=None):
     """ Create Debian Errata
+        Returns the number of errata that are missing packages
     """
+    osrelease_names = get_debian_osrelease_names(accepted_codenames)
     if concurrent_processing:
-        create_debian_errata_concurrently(errata, accepted_codenames, max_workers)
+        return create_debian_errata_concurrently(errata, osrelease_names, max_workers, content_hashes)
     else:
-        create_debian_errata_serially(errata, accepted_codenames)
+        return create_debian_errata_serially(errata, osrelease_names, content_hashes)
 
 
-def create_debian_errata_serially(errata, accepted_codenames):
+def create_debian_errata_serially(errata, osrelease_names, content_hashes=None):
     """ Create Debian Errata Serially
+        Returns the number of errata that are missing packages
     """
     elen = len(errata)
     pbar_start.send(sender=None, ptext=f'Processing {elen} Debian Errata', plen=elen)
-    for i, erratum in enumerate(errata):
-        process_debian_erratum(erratum, accepted_codenames)
-        pbar_update.send(sender=None, index=i + 1)
+    with ErratumSink(content_hashes=content_hashes) as sink:
+        for i, erratum in enumerate(errata):
+            sink.add(process_debian_erratum(erratum, osrelease_names))
+            pbar_update.send(sender=None, index=i + 1)
+    return sink.incomplete
 
 
-def create_debian_errata_concurrently(errata, accepted_codenames, max_workers=25):
+def create_debian_errata_concurrently(errata, osrelease_names, max_workers=25, content_hashes=None):
     """ Create Debian Errata concurrently
+        Returns the number of errata that are missing packages
     """
     elen = len(errata)
     pbar_start.send(sender=None, ptext=f'Processing {elen} Debian Errata', plen=elen)
-    args = [(erratum, accepted_codenames) for erratum in errata]
-    for i, _ in enumerate(run_concurrently(process_debian_erratum_wrapper, args, max_workers)):
-        pbar_update.send(sender=None, index=i + 1)
+    args = [(erratum, osrelease_names) for erratum in errata]
+    with ErratumSink(content_hashes=content_hashes) as sink:
+        for i, record in enumerate(run_concurrently(process_debian_erratum_wrapper, args, max_workers)):
+            sink.add(record)
+            pbar_update.send(sender=None, index=i + 1)
+    return sink.incomplete
 
 
 def process_debian_erratum_wrapper(args):
@@ -208,12 +285,14 @@ def process_debian_erratum_wrapper(args):
     return process_debian_erratum(*args)
 
 
-def process_debian_erratum(erratum, accepted_codenames):
+def process_debian_erratum(erratum, osrelease_names):
     """ Process a single Debian Erratum
+        osrelease_names maps accepted codenames to OSRelease names
+        Returns an ErratumRecord
     """
     try:
         erratum_name = erratum.get('name')
-        e, created = get_or_create_erratum(
+        e = ErratumRecord(
             name=erratum_name,
             e_type='security',
             issue_date=erratum.get('issue_date'),
@@ -223,57 +302,104 @@ def process_debian_erratum(erratum, accepted_codenames):
         for cve_id in erratum.get('cve_ids'):
             e.add_cve(cve_id)
         for codename, packages in erratum.get('packages').items():
-            if codename not in accepted_codenames:
+            if codename not in osrelease_names:
                 continue
-            osrelease = OSRelease.objects.get(codename=codename)
-            e.osreleases.add(osrelease)
+            e.add_osrelease(osrelease_names[codename])
             for package in packages:
-                process_debian_erratum_fixed_packages(e, package)
+                if not process_debian_erratum_fixed_packages(e, package):
+                    # do not store the content hash so the erratum is retried next time
+                    e.content_hash = ''
+        return e
     except Exception as exc:
         error_message(text=exc)
 
 
-def fetch_debian_dsc_package_lists(dsc_fetches, concurrent_processing=True, max_workers=25):
-    """ Fetch DSC package lists with a progress bar
+def get_debian_osrelease_names(accepted_codenames):
+    """ Returns a dict mapping accepted Debian codenames to OSRelease names
+    """
+    osreleases = OSRelease.objects.filter(codename__in=accepted_codenames)
+    return dict(osreleases.values_list('codename', 'name'))
+
+
+def load_debian_dsc_package_lists(dsc_fetches, concurrent_processing=True, max_workers=25, force=False):
+    """ Load the package lists of the DSC files needed for errata into DSCs
+        Package lists do not change for a given source package version, so
+        they are stored and only the DSC files of unseen versions are fetched.
+        The package file maps are only fetched when a DSC file is not known.
+    """
+    dscs = get_debian_dscs(dsc_fetches)
+    if len(dscs) < len(dsc_fetches):
+        update_debian_package_file_maps(force)
+        dscs = get_debian_dscs(dsc_fetches)
+    for package, version in dsc_fetches:
+        if (package, version) not in dscs:
+            warning_message(text=f'No DSC found for {package} {version}')
+    unfetched_dscs = [dsc for dsc in dscs.values() if dsc.package_list is None]
+    if unfetched_dscs:
+        fetch_debian_dsc_package_lists(unfetched_dscs, concurrent_processing, max_workers)
+    DSCs.clear()
+    for key, dsc in dscs.items():
+        if dsc.package_list is not None:
+            DSCs[key] = dsc.package_list
+
+
+def get_debian_dscs(dsc_fetches):
+    """ Returns a dict mapping (source package, version) tuples to the stored
+        DebianDSCs
+    """
+    dsc_fetches = list(dsc_fetches)
+    dscs = {}
+    for i in range(0, len(dsc_fetches), 100):
+        q = Q()
+        for source, version in dsc_fetches[i:i + 100]:
+            q |= Q(source=source, version=version)
+        for dsc in DebianDSC.objects.filter(q):
+            dscs[(dsc.source, dsc.version)] = dsc
+    return dscs
+
+
+def fetch_debian_dsc_package_lists(dscs, concurrent_processing=True, max_workers=25):
+    """ Fetch DSC package lists with a progress bar and store them
     """
-    flen = len(dsc_fetches)
+    flen = len(dscs)
     pbar_start.send(sender=None, ptext=f'Fetching {flen} Debian DSC files', plen=flen)
+    fetched_dscs = []
     if concurrent_processing:
-        for i, _ in enumerate(fetch_concurrently(fetch_dsc_worker, dsc_fetches, max_workers)):
-            pbar_update.send(sender=None, index=i + 1)
+        results = fetch_concurrently(fetch_dsc_worker, dscs, max_workers)
     else:
-        for i, (package, version) in enumerate(dsc_fetches):
-            fetch_debian_dsc_package_list(package, version)
-            pbar_update.send(sender=None, index=i + 1)
+        results = (fetch_dsc_worker(dsc) for dsc in dscs)
+    for i, dsc in enumerate(results):
+        if dsc.package_list is not None:
+            fetched_dscs.append(dsc)
+        pbar_update.send(sender=None, index=i + 1)
+    DebianDSC.objects.bulk_update(fetched_dscs, ['package_list'], batch_size=1000)
 
 
-def fetch_dsc_worker(item, session):
-    package, version = item
-    fetch_debian_dsc_package_list(package, version, session=session)
+def fetch_dsc_worker(dsc, session=None):
+    dsc.package_list = fetch_debian_dsc_package_list(dsc.url, session=session)
+    return dsc
 
 
 def get_debian_dsc_package_list(package, version):
     """ Get the package list from a DSC file for a given source package/version
     """
-    if not DSCs.get(package) or not DSCs[package].get(version):
-        return
-    package_list = DSCs[package][version].get('package_list')
-    if package_list:
-        return package_list
+    return DSCs.get((package, version))
 
 
-def fetch_debian_dsc_package_list(package, version, session=None):
-    """ Fetch the package list from a DSC file for a given source package/version
+def fetch_debian_dsc_package_list(url, session=None):
+    """ Fetch the package list from a DSC file
+        Returns a list of (binary package name, arches) for deb packages
     """
-    if not DSCs.get(package) or not DSCs[package].get(version):
-        warning_message(text=f'No DSC found for {package} {version}')
+    res = get_url(url, session=session)
+    if not res:
+        error_message(text=f'Failed to fetch DSC file {url}')
         return
-    source_url = DSCs[package][version]['url']
-    res = get_url(source_url, session=session)
-    data = res.content
-    dsc = Dsc(data.decode())
-    package_list = dsc.get('package-list')
-    DSCs[package][version]['package_list'] = package_list
+    dsc = Dsc(res.content.decode())
+    package_list = []
+    for package in dsc.get('package-list', []):
+        if package.get('package-type') == 'deb':
+            package_list.append([package.get('package'), package.get('_other')])
+    return package_list
 
 
 def get_accepted_debian_codenames():
@@ -316,24 +442,30 @@ def create_debian_os_releases(codename_to_version):
 
 def process_debian_erratum_fixed_packages(e, package_data):
     """ Process packages fixed in a Debian errata
+        Returns False if the package list of the DSC file is not available
     """
     if not package_data:
-        return
+        return True
     source_package, source_version = package_data
     epoch, ver, rel = find_evr(source_version)
     package_list = get_debian_dsc_package_list(source_package, source_version)
-    if not package_list:
-        return
+    if package_list is None:
+        return False
     fixed_packages = set()
-    for package in package_list:
-        if package.get('package-type') != 'deb':
-            continue
-        name = package.get('package')
-        arches = process_debian_dsc_arches(package.get('_other'))
+    for name, arches in package_list:
+        arches = process_debian_dsc_arches(arches)
         for arch in arches:
-            fixed_package = get_or_create_package(name, epoch, ver, rel, arch, Package.DEB)
+            fixed_package = PackageString(
+                name=name.lower(),
+                epoch=epoch,
+                version=ver,
+                release=rel,
+                arch=arch,
+                packagetype=Package.DEB,
+            )
             fixed_packages.add(fixed_package)
     e.add_fixed_packages(fixed_packages)
+    return True
 
 
 def process_debian_dsc_arches(arches):
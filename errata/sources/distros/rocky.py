@@ -15,35 +15,57 @@
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
 import concurrent.futures
-import json
+from datetime import timedelta
 
-from django.db.utils import OperationalError
-from tenacity import (
-    retry, retry_if_exception_type, stop_after_attempt, wait_exponential,
+from errata.sink import ErratumRecord, ErratumSink
+from errata.utils import (
+    errata_feed_needs_full_fetch, get_changed_errata, get_content_hash,
+    get_errata_feed_last_advisory_date, set_errata_feed_last_advisory_date,
+    set_errata_feed_last_full_fetch,
 )
-
-from errata.utils import get_or_create_erratum
-from modules.models import Module
-from modules.utils import get_matching_modules
-from operatingsystems.utils import get_or_create_osrelease
-from packages.models import Package
-from packages.utils import get_or_create_package, parse_package_string
+from packages.models import Package, PackageString
+from packages.utils import parse_package_string
 from patchman.signals import pbar_start, pbar_update
-from util import fetch_content, get_url, run_concurrently
+from util import (
+    fetch_content, get_datetime_now, get_setting_of_type, get_url, load_json,
+    run_concurrently, tz_aware_datetime,
+)
 from util.logging import clear_forked_pbar, error_message, info_message
 
 
-def update_rocky_errata(concurrent_processing=True, max_workers=25):
-    """ Update Rocky Linux errata
+def update_rocky_errata(concurrent_processing=True, max_workers=25, force=False):
+    """ Update Rocky Linux errata, only new or changed advisories are processed
+        The API lists advisories newest first and cannot be filtered by when
+        they were updated, so only the pages with advisories published or
+        updated since the newest advisory seen in the last run are fetched.
+        An older advisory that was updated recently can be on a later page,
+        so all advisories are fetched every ROCKY_ERRATA_FULL_FETCH_INTERVAL
+        days, or if force is set.
     """
     rocky_errata_api_host = 'https://apollo.build.resf.org'
     rocky_errata_api_url = '/api/v3/'
     if check_rocky_errata_endpoint_health(rocky_errata_api_host):
+        full_fetch_interval = get_setting_of_type(
+            setting_name='ROCKY_ERRATA_FULL_FETCH_INTERVAL',
+            setting_type=int,
+            default=7,
+        )
+        started = get_datetime_now()
+        since = None
+        if not force and not errata_feed_needs_full_fetch('rocky', timedelta(days=full_fetch_interval)):
+            since = get_errata_feed_last_advisory_date('rocky')
         advisories = fetch_rocky_advisories(
             rocky_errata_api_host, rocky_errata_api_url,
-            concurrent_processing, max_workers,
+            concurrent_processing, max_workers, since,
         )
-        process_rocky_errata(advisories, concurrent_processing, max_workers)
+        last_advisory_date = max(filter(None, (get_rocky_advisory_date(a) for a in advisories)), default=None)
+        content_hashes = {a.get('name'): get_content_hash(a) for a in advisories}
+        changed = get_changed_errata(content_hashes, force)
+        advisories = [a for a in advisories if a.get('name') in changed]
+        process_rocky_errata(advisories, concurrent_processing, max_workers, content_hashes)
+        set_errata_feed_last_advisory_date('rocky', last_advisory_date)
+        if since is None:
+            set_errata_feed_last_full_fetch('rocky', started)
 
 
 def check_rocky_errata_endpoint_health(rocky_errata_api_host):
@@ -55,7 +77,7 @@ def check_rocky_errata_endpoint_health(rocky_errata_api_host):
     res = get_url(rocky_errata_healthcheck_url, headers=headers)
     data = fetch_content(res, 'Rocky Linux Errata API healthcheck')
     try:
-        health = json.loads(data)
+        health = load_json(data)
         if health.get('status') == 'ok':
             s = f'Rocky Errata API healthcheck OK: {rocky_errata_healthcheck_url}'
             info_message(text=s)
@@ -71,17 +93,26 @@ def check_rocky_errata_endpoint_health(rocky_errata_api_host):
         return False
 
 
-def fetch_rocky_advisories(rocky_errata_api_host, rocky_errata_api_url, concurrent_processing, max_workers=25):
+def fetch_rocky_advisories(rocky_errata_api_host, rocky_errata_api_url, concurrent_processing, max_workers=25,
+                           since=None):
     """ Fetch Rocky Linux advisories and return the list
+        If since is set, only the pages up to the advisories published or
+        updated before since are fetched
     """
+    if since:
+        return fetch_rocky_advisories_serially(rocky_errata_api_host, rocky_errata_api_url, since)
     if concurrent_processing:
         return fetch_rocky_advisories_concurrently(rocky_errata_api_host, rocky_errata_api_url, max_workers)
     else:
         return fetch_rocky_advisories_serially(rocky_errata_api_host, rocky_errata_api_url)
 
 
-def fetch_rocky_advisories_serially(rocky_errata_api_host, rocky_errata_api_url):
+def fetch_rocky_advisories_serially(rocky_errata_api_host, rocky_errata_api_url, since=None):
     """ Fetch Rocky Linux advisories serially and return the list
+        The API returns the newest advisories first, so if since is set,
+        fetching stops at the first page with advisories published or updated
+        before since. If a page is not sorted newest first, all pages are
+        fetched. Advisories without a date are not used to decide when to stop.
     """
     rocky_errata_advisories_url = rocky_errata_api_host + rocky_errata_api_url + 'advisories/'
     headers = {'Accept': 'application/json'}
@@ -89,11 +120,18 @@ def fetch_rocky_advisories_serially(rocky_errata_api_host, rocky_errata_api_url)
     pages = None
     advisories = []
     params = {'page': 1, 'size': 100}
+    newest_first = True
     while True:
         res = get_url(rocky_errata_advisories_url, headers=headers, params=params)
         data = fetch_content(res, f'Rocky Advisories {page}{"/"+pages if pages else ""}')
-        advisories_dict = json.loads(data)
-        advisories += advisories_dict.get('advisories')
+        advisories_dict = load_json(data)
+        page_advisories = advisories_dict.get('advisories')
+        advisories += page_advisories
+        if since:
+            dates = [date for date in map(get_rocky_advisory_date, page_advisories) if date]
+            newest_first = newest_first and dates == sorted(dates, reverse=True)
+            if newest_first and dates and dates[-1] < since:
+                break
         links = advisories_dict.get('links')
         if page == 1:
             last_link = links.get('last')
@@ -117,7 +155,7 @@ def fetch_rocky_advisories_concurrently(rocky_errata_api_host, rocky_errata_api_
     params = {'page': 1, 'size': 100}
     res = get_url(rocky_errata_advisories_url, headers=headers, params=params)
     data = fetch_content(res, 'Rocky Advisories Page 1')
-    advisories_dict = json.loads(data)
+    advisories_dict = load_json(data)
     links = advisories_dict.get('links')
     last_link = links.get('last')
     pages = int(last_link.split('=')[-1])
@@ -134,6 +172,14 @@ def fetch_rocky_advisories_concurrently(rocky_errata_api_host, rocky_errata_api_
     return advisories
 
 
+def get_rocky_advisory_date(advisory):
+    """ Returns the date a Rocky Linux advisory was last published or updated,
+        or None if the advisory has no date
+    """
+    dates = [tz_aware_datetime(date) for date in (advisory.get('published_at'), advisory.get('updated_at')) if date]
+    return max(dates, default=None)
+
+
 def get_rocky_advisory(rocky_errata_advisories_url, page):
     """ Fetch a single Rocky Linux advisory
     """
@@ -141,36 +187,39 @@ def get_rocky_advisory(rocky_errata_advisories_url, page):
     params = {'page': page, 'size': 100}
     res = get_url(rocky_errata_advisories_url, headers=headers, params=params)
     data = res.content
-    advisories_dict = json.loads(data)
+    advisories_dict = load_json(data)
     return advisories_dict.get('advisories')
 
 
-def process_rocky_errata(advisories, concurrent_processing, max_workers=25):
+def process_rocky_errata(advisories, concurrent_processing, max_workers=25, content_hashes=None):
     """ Process Rocky Linux Errata
     """
     if concurrent_processing:
-        process_rocky_errata_concurrently(advisories, max_workers)
+        process_rocky_errata_concurrently(advisories, max_workers, content_hashes)
     else:
-        process_rocky_errata_serially(advisories)
+        process_rocky_errata_serially(advisories, content_hashes)
 
 
-def process_rocky_errata_serially(advisories):
+def process_rocky_errata_serially(advisories, content_hashes=None):
     """ Process Rocky Linux errata serially
     """
     elen = len(advisories)
     pbar_start.send(sender=None, ptext=f'Processing {elen} Rocky Errata', plen=elen)
-    for i, advisory in enumerate(advisories):
-        process_rocky_erratum(advisory)
-        pbar_update.send(sender=None, index=i + 1)
+    with ErratumSink(content_hashes=content_hashes) as sink:
+        for i, advisory in enumerate(advisories):
+            sink.add(process_rocky_erratum(advisory))
+            pbar_update.send(sender=None, index=i + 1)
 
 
-def process_rocky_errata_concurrently(advisories, max_workers=25):
+def process_rocky_errata_concurrently(advisories, max_workers=25, content_hashes=None):
     """ Process Rocky Linux errata concurrently
     """
     elen = len(advisories)
     pbar_start.send(sender=None, ptext=f'Processing {elen} Rocky Errata', plen=elen)
-    for i, _ in enumerate(run_concurrently(process_rocky_erratum_wrapper, advisories, max_workers)):
-        pbar_update.send(sender=None, index=i + 1)
+    with ErratumSink(content_hashes=content_hashes) as sink:
+        for i, record in enumerate(run_concurrently(process_rocky_erratum_wrapper, advisories, max_workers)):
+            sink.add(record)
+            pbar_update.send(sender=None, index=i + 1)
 
 
 def process_rocky_erratum_wrapper(advisory):
@@ -178,20 +227,16 @@ def process_rocky_erratum_wrapper(advisory):
     return process_rocky_erratum(advisory)
 
 
-@retry(
-    retry=retry_if_exception_type(OperationalError),
-    stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=2, max=15),
-)
 def process_rocky_erratum(advisory):
     """ Process a single Rocky Linux erratum
+        Returns an ErratumRecord
     """
     try:
         erratum_name = advisory.get('name')
         e_type = advisory.get('kind').lower().replace(' ', '')
         issue_date = advisory.get('published_at')
         synopsis = advisory.get('synopsis')
-        e, created = get_or_create_erratum(
+        e = ErratumRecord(
             name=erratum_name,
             e_type=e_type,
             issue_date=issue_date,
@@ -200,6 +245,7 @@ def process_rocky_erratum(advisory):
         add_rocky_erratum_references(e, advisory)
         add_rocky_erratum_oses(e, advisory)
         add_rocky_erratum_packages(e, advisory)
+        return e
     except Exception as exc:
         error_message(text=exc)
 
@@ -226,9 +272,7 @@ def add_rocky_erratum_oses(e, advisory):
     for affected_os in affected_oses:
         variant = affected_os.get('variant')
         major_version = affected_os.get('major_version')
-        osrelease_name = f'{variant} {major_version}'
-        osrelease = get_or_create_osrelease(name=osrelease_name)
-        e.osreleases.add(osrelease)
+        e.add_osrelease(f'{variant} {major_version}')
 
 
 def add_rocky_erratum_packages(e, advisory):
@@ -236,30 +280,30 @@ def add_rocky_erratum_packages(e, advisory):
     """
     packages = advisory.get('packages')
     fixed_packages = set()
-    module_package_adds = {}
     for package in packages:
         package_name = package.get('nevra')
         if package_name:
             name, epoch, ver, rel, dist, arch = parse_package_string(package_name)
-            p_type = Package.RPM
-            fixed_package = get_or_create_package(name, epoch, ver, rel, arch, p_type)
+            fixed_package = PackageString(
+                name=name.lower(),
+                epoch=epoch,
+                version=ver,
+                release=rel,
+                arch=arch,
+                packagetype=Package.RPM,
+            )
             fixed_packages.add(fixed_package)
             module_name = package.get('module_name')
             module_context = package.get('module_context')
             module_stream = package.get('module_stream')
             module_version = package.get('module_version')
             if module_name and module_context and module_stream and module_version:
-                matching_modules = get_matching_modules(
+                e.add_module_package_match(
                     module_name,
                     module_stream,
-                    module_version,
+                    str(module_version),
                     module_context,
                     arch,
+                    [fixed_package],
                 )
-                for match in matching_modules:
-                    if match.pk not in module_package_adds:
-                        module_package_adds[match.pk] = set()
-                    module_package_adds[match.pk].add(fixed_package)
-    for module_pk, pkgs in module_package_adds.items():
-        Module.objects.get(pk=module_pk).packages.add(*pkgs)
     e.add_fixed_packages(fixed_packages)
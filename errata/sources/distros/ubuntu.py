@@ -15,38 +15,42 @@
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
 import csv
-import json
 import os
 from io import StringIO
 from urllib.parse import urlparse
 
-from errata.utils import get_or_create_erratum
+from errata.sink import ErratumRecord, ErratumSink
+from errata.utils import (
+    errata_feed_has_changed, get_content_hash, get_errata_content_hashes,
+    set_errata_feed_checksum,
+)
 from operatingsystems.models import OSRelease, OSVariant
 from operatingsystems.utils import get_or_create_osrelease
-from packages.models import Package
-from packages.utils import (
-    find_evr, get_matching_packages, get_or_create_package,
-    parse_package_string,
-)
-from patchman.signals import pbar_start, pbar_update
+from packages.models import Package, PackageString
+from packages.utils import find_evr, parse_package_string
 from util import (
-    bunzip2, fetch_content, get_setting_of_type, get_sha256, get_url,
-    run_concurrently,
+    fetch_content, get_setting_of_type, get_sha256, get_url,
+    iter_json_object_items, open_extracted, run_concurrently,
 )
-from util.logging import clear_forked_pbar, error_message
+from util.logging import clear_forked_pbar, error_message, info_message
 
 
-def update_ubuntu_errata(concurrent_processing=True, max_workers=25):
+def update_ubuntu_errata(concurrent_processing=True, max_workers=25, force=False):
     """ Update Ubuntu errata
+        The USN database is only fetched if its published checksum has changed
     """
     codenames = retrieve_ubuntu_codenames()
     create_ubuntu_os_releases(codenames)
+    expected_checksum = fetch_ubuntu_usn_db_checksum()
+    feed_checksum = get_content_hash([expected_checksum, get_accepted_ubuntu_codenames()])
+    if not errata_feed_has_changed('ubuntu', feed_checksum, force):
+        return
     data = fetch_ubuntu_usn_db()
     if data:
-        expected_checksum = fetch_ubuntu_usn_db_checksum()
         actual_checksum = get_sha256(data)
         if actual_checksum == expected_checksum:
-            parse_usn_data(data, concurrent_processing, max_workers)
+            parse_usn_data(data, concurrent_processing, max_workers, force)
+            set_errata_feed_checksum('ubuntu', feed_checksum)
         else:
             e = 'Ubuntu USN DB checksum mismatch, skipping Ubuntu errata parsing\n'
             e += f'{actual_checksum} (actual) != {expected_checksum} (expected)'
@@ -69,36 +73,58 @@ def fetch_ubuntu_usn_db_checksum():
     return fetch_content(res, 'Fetching Ubuntu Errata Checksum').decode().split()[0]
 
 
-def parse_usn_data(data, concurrent_processing, max_workers=25):
-    """ Parse the Ubuntu USN data
+def parse_usn_data(data, concurrent_processing, max_workers=25, force=False):
+    """ Parse the Ubuntu USN data, only new or changed USNs that affect
+        accepted releases are processed. The USN database is decompressed
+        and parsed one USN at a time.
+    """
+    accepted_releases = get_ubuntu_osrelease_names(get_accepted_ubuntu_codenames())
+    stored_hashes = {} if force else get_errata_content_hashes('USN-')
+    with open_extracted(data, 'bz2') as reader:
+        advisories = iter_changed_usns(reader, accepted_releases, stored_hashes)
+        if concurrent_processing:
+            elen = parse_usn_data_concurrently(advisories, accepted_releases, max_workers)
+        else:
+            elen = parse_usn_data_serially(advisories, accepted_releases)
+    info_message(text=f'Processed {elen} new or changed Ubuntu Errata')
+
+
+def iter_changed_usns(reader, accepted_releases, stored_hashes):
+    """ Yields (usn_id, advisory, content_hash) for each USN in the USN
+        database that affects accepted releases and whose content hash
+        differs from the one in stored_hashes
     """
-    accepted_releases = get_accepted_ubuntu_codenames()
-    extracted = bunzip2(data).decode()
-    advisories = json.loads(extracted)
-    if concurrent_processing:
-        parse_usn_data_concurrently(advisories, accepted_releases, max_workers)
-    else:
-        parse_usn_data_serially(advisories, accepted_releases)
+    for usn_id, advisory in iter_json_object_items(reader):
+        if not release_is_affected(advisory.get('releases', {}).keys(), accepted_releases):
+            continue
+        content_hash = get_content_hash([advisory, accepted_releases])
+        if stored_hashes.get(f'USN-{usn_id}') != content_hash:
+            yield usn_id, advisory, content_hash
 
 
 def parse_usn_data_serially(advisories, accepted_releases):
     """ Parse the Ubuntu USN data serially
+        Returns the number of USNs processed
     """
-    elen = len(advisories)
-    pbar_start.send(sender=None, ptext=f'Processing {elen} Ubuntu Errata', plen=elen)
-    for i, (usn_id, advisory) in enumerate(advisories.items()):
-        process_usn(usn_id, advisory, accepted_releases)
-        pbar_update.send(sender=None, index=i + 1)
+    elen = 0
+    with ErratumSink() as sink:
+        for usn_id, advisory, content_hash in advisories:
+            sink.add(process_usn(usn_id, advisory, accepted_releases, content_hash))
+            elen += 1
+    return elen
 
 
 def parse_usn_data_concurrently(advisories, accepted_releases, max_workers=25):
     """ Parse the Ubuntu USN data concurrently
+        Returns the number of USNs processed
     """
-    elen = len(advisories)
-    pbar_start.send(sender=None, ptext=f'Processing {elen} Ubuntu Errata', plen=elen)
-    args = [(usn_id, advisory, accepted_releases) for usn_id, advisory in advisories.items()]
-    for i, _ in enumerate(run_concurrently(process_usn_wrapper, args, max_workers)):
-        pbar_update.send(sender=None, index=i + 1)
+    elen = 0
+    args = ((usn_id, advisory, accepted_releases, content_hash) for usn_id, advisory, content_hash in advisories)
+    with ErratumSink() as sink:
+        for record in run_concurrently(process_usn_wrapper, args, max_workers):
+            sink.add(record)
+            elen += 1
+    return elen
 
 
 def process_usn_wrapper(args):
@@ -106,8 +132,10 @@ def process_usn_wrapper(args):
     return process_usn(*args)
 
 
-def process_usn(usn_id, advisory, accepted_releases):
+def process_usn(usn_id, advisory, accepted_releases, content_hash=None):
     """ Process a single USN advisory
+        accepted_releases maps accepted codenames to OSRelease names
+        Returns an ErratumRecord
     """
     try:
         affected_releases = advisory.get('releases', {}).keys()
@@ -116,11 +144,12 @@ def process_usn(usn_id, advisory, accepted_releases):
         name = f'USN-{usn_id}'
         issue_date = int(advisory.get('timestamp'))
         synopsis = advisory.get('title')
-        e, created = get_or_create_erratum(
+        e = ErratumRecord(
             name=name,
             e_type='security',
             issue_date=issue_date,
             synopsis=synopsis,
+            content_hash=content_hash,
         )
         add_ubuntu_erratum_osreleases(
             e,
@@ -128,7 +157,8 @@ def process_usn(usn_id, advisory, accepted_releases):
             accepted_releases,
         )
         add_ubuntu_erratum_references(e, usn_id, advisory)
-        add_ubuntu_erratum_packages(e, advisory)
+        add_ubuntu_erratum_packages(e, advisory, accepted_releases)
+        return e
     except Exception as exc:
         error_message(text=exc)
 
@@ -138,8 +168,7 @@ def add_ubuntu_erratum_osreleases(e, affected_releases, accepted_releases):
     """
     for release in affected_releases:
         if release in accepted_releases:
-            osrelease = OSRelease.objects.get(codename=release)
-            e.osreleases.add(osrelease)
+            e.add_osrelease(accepted_releases[release])
 
 
 def release_is_affected(affected_releases, accepted_releases):
@@ -165,14 +194,14 @@ def add_ubuntu_erratum_references(e, usn_id, advisory):
                 e.add_reference('Link', cve_id)
 
 
-def add_ubuntu_erratum_packages(e, advisory):
+def add_ubuntu_erratum_packages(e, advisory, accepted_releases):
     """ Add Ubuntu erratum packages
     """
     affected_releases = advisory.get('releases')
     p_type = Package.DEB
     fixed_packages = set()
     for release, packages in affected_releases.items():
-        if release in get_accepted_ubuntu_codenames():
+        if release in accepted_releases:
             arches = packages.get('archs')
             if arches:
                 for arch, urls in arches.items():
@@ -181,7 +210,14 @@ def add_ubuntu_erratum_packages(e, advisory):
                         package_name = os.path.basename(path)
                         if package_name.endswith('.deb'):
                             name, epoch, ver, rel, dist, arch = parse_package_string(package_name)
-                            fixed_package = get_or_create_package(name, epoch, ver, rel, arch, p_type)
+                            fixed_package = PackageString(
+                                name=name.lower(),
+                                epoch=epoch,
+                                version=ver,
+                                release=rel,
+                                arch=arch,
+                                packagetype=p_type,
+                            )
                             fixed_packages.add(fixed_package)
             else:
                 binaries = packages.get('binaries')
@@ -190,15 +226,7 @@ def add_ubuntu_erratum_packages(e, advisory):
                     # we don't know the architecture so this requires the packages to
                     # exist (e.g. on a host or a mirror) to be captured
                     epoch, ver, rel = find_evr(package_data.get('version'))
-                    matching_packages = get_matching_packages(
-                        name=package_name,
-                        epoch=epoch,
-                        version=ver,
-                        release=rel,
-                        p_type=p_type,
-                    )
-                    for fixed_package in matching_packages:
-                        fixed_packages.add(fixed_package)
+                    e.add_fixed_package_match(package_name, epoch, ver, rel, p_type)
     e.add_fixed_packages(fixed_packages)
 
 
@@ -215,6 +243,13 @@ def get_accepted_ubuntu_codenames():
     return accepted_codenames
 
 
+def get_ubuntu_osrelease_names(accepted_codenames):
+    """ Returns a dict mapping accepted Ubuntu codenames to OSRelease names
+    """
+    osreleases = OSRelease.objects.filter(codename__in=accepted_codenames)
+    return dict(osreleases.values_list('codename', 'name'))
+
+
 def retrieve_ubuntu_codenames():
     """ Returns the codename to version mapping
     """
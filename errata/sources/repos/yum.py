@@ -14,53 +14,103 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/
 
-from io import BytesIO
-
 from defusedxml import ElementTree
+from django.core.cache import cache
+
+from operatingsystems.utils import normalize_el_osrelease
+from packages.models import Package, PackageString
+from util import get_setting_of_type, get_url, open_extracted, run_concurrently
+from util.logging import clear_forked_pbar, error_message, info_message
 
-from operatingsystems.utils import (
-    get_or_create_osrelease, normalize_el_osrelease,
-)
-from packages.models import Package
-from packages.utils import get_or_create_package
-from patchman.signals import pbar_start, pbar_update
-from security.models import Reference
-from util import extract, get_url, run_concurrently
-from util.logging import clear_forked_pbar, error_message
+SUSE_ADVISORY_URL_CACHE_TIMEOUT = 60 * 60 * 24 * 7
 
 
 def extract_updateinfo(data, url, concurrent_processing=True, max_workers=25):
     """ Parses updateinfo.xml and extracts package/errata information
+        The updates are streamed from updateinfo.xml as plain dicts
+    """
+    updates = iter_updateinfo_updates(data, url)
+    if concurrent_processing:
+        elen = extract_updateinfo_concurrently(updates, max_workers)
+    else:
+        elen = extract_updateinfo_serially(updates)
+    info_message(text=f'Extracted {elen} updateinfo Errata')
+
+
+def iter_updateinfo_updates(data, url):
+    """ Yields the updates in updateinfo.xml as dicts, parsing the file
+        incrementally and discarding each update once it has been read
     """
-    extracted = extract(data, url)
+    depth = 0
+    root = None
     try:
-        tree = ElementTree.parse(BytesIO(extracted))
-        root = tree.getroot()
-        elen = root.__len__()
-        updates = root.findall('update')
+        for event, element in ElementTree.iterparse(open_extracted(data, url), events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if root is None:
+                    root = element
+                continue
+            depth -= 1
+            if depth == 1 and element.tag == 'update':
+                yield parse_updateinfo_update(element)
+                root.clear()
     except ElementTree.ParseError as e:
         error_message(text=f'Error parsing updateinfo file from {url} : {e}')
-    if concurrent_processing:
-        extract_updateinfo_concurrently(updates, elen, max_workers)
-    else:
-        extract_updateinfo_serially(updates, elen)
 
 
-def extract_updateinfo_serially(updates, elen):
+def parse_updateinfo_update(update):
+    """ Returns an update element from updateinfo.xml as a dict
+    """
+    release = update.find('release')
+    references = update.find('references')
+    pkglist = update.find('pkglist')
+    package_attribs = ['name', 'epoch', 'version', 'release', 'arch']
+    collections = []
+    if pkglist is not None:
+        for collection in pkglist.findall('collection'):
+            collection_name = collection.find('name')
+            collections.append({
+                'name': collection_name.text if collection_name is not None else None,
+                'packages': [
+                    {attrib: pkg.attrib.get(attrib) for attrib in package_attribs}
+                    for pkg in collection.findall('package')
+                ],
+            })
+    return {
+        'type': update.attrib.get('type'),
+        'id': update.find('id').text,
+        'title': update.find('title').text,
+        'issued': update.find('issued').attrib.get('date'),
+        'release': release.text if release is not None else None,
+        'references': [dict(r.attrib) for r in references.findall('reference')] if references is not None else [],
+        'collections': collections,
+    }
+
+
+def extract_updateinfo_serially(updates):
     """ Parses updateinfo.xml and extracts package/errata information serially
+        Returns the number of updates extracted
     """
-    pbar_start.send(sender=None, ptext=f'Extracting {elen} updateinfo Errata', plen=elen)
-    for i, update in enumerate(updates):
-        process_updateinfo_erratum(update)
-        pbar_update.send(sender=None, index=i + 1)
+    from errata.sink import ErratumSink
+    elen = 0
+    with ErratumSink() as sink:
+        for update in updates:
+            sink.add(process_updateinfo_erratum(update))
+            elen += 1
+    return elen
 
 
-def extract_updateinfo_concurrently(updates, elen, max_workers=25):
+def extract_updateinfo_concurrently(updates, max_workers=25):
     """ Parses updateinfo.xml and extracts package/errata information concurrently
+        Returns the number of updates extracted
     """
-    pbar_start.send(sender=None, ptext=f'Extracting {elen} updateinfo Errata', plen=elen)
-    for i, _ in enumerate(run_concurrently(process_updateinfo_erratum_wrapper, updates, max_workers)):
-        pbar_update.send(sender=None, index=i + 1)
+    from errata.sink import ErratumSink
+    elen = 0
+    with ErratumSink() as sink:
+        for record in run_concurrently(process_updateinfo_erratum_wrapper, updates, max_workers):
+            sink.add(record)
+            elen += 1
+    return elen
 
 
 def process_updateinfo_erratum_wrapper(update):
@@ -69,18 +119,17 @@ def process_updateinfo_erratum_wrapper(update):
 
 
 def process_updateinfo_erratum(update):
-    """ Processes a single erratum from updateinfo.xml
+    """ Processes a single erratum from updateinfo.xml, as returned by
+        parse_updateinfo_update()
+        Returns an ErratumRecord
     """
-    from errata.utils import get_or_create_erratum
-    e_type = update.attrib.get('type')
-    e_name = update.find('id').text
-    name, ref_type, urls = get_distro_data(e_name, e_type)
-    synopsis = update.find('title').text
-    issue_date = update.find('issued').attrib.get('date')
-    e, created = get_or_create_erratum(name, e_type, issue_date, synopsis)
+    from errata.sink import ErratumRecord
+    e_type = update.get('type')
+    name, ref_type, urls = get_distro_data(update.get('id'), e_type)
+    e = ErratumRecord(name, e_type, update.get('issued'), update.get('title'))
     add_updateinfo_erratum_references(e, update, ref_type, urls)
     add_updateinfo_packages(e, update)
-    update.clear()
+    return e
 
 
 def get_distro_data(name, e_type):
@@ -107,16 +156,7 @@ def get_distro_data(name, e_type):
         identifier = f'{year}:{number}'
         prefix = f'SUSE-{update_type}'
         name = f'{prefix}-{identifier}-1'
-        url_root = 'https://www.suse.com/support/update/announcement/'
-        url_path = f'{year}/{prefix}-{year}{number}-'
-        for i in range(1, 10):
-            url = f'{url_root}{url_path}{i}'
-            if Reference.objects.filter(url=url).exists():
-                continue
-            res = get_url(url)
-            if res.status_code != 200:
-                break
-            urls.append(f'{url_root}{url_path}{i}')
+        urls = get_suse_advisory_urls(year, prefix, number)
     elif name.startswith('EL'):
         ref_type = 'Oracle Advisory'
         urls.append(f'https://linux.oracle.com/errata/{name}.html')
@@ -127,21 +167,50 @@ def get_distro_data(name, e_type):
     return name, ref_type, urls
 
 
+def get_suse_advisory_urls(year, prefix, number):
+    """ Returns the URLs of the announcements for a SUSE advisory, which are
+        numbered from 1 upwards. The URLs that exist are discovered once and
+        cached, as this requires a http request per announcement.
+        Discovery can be disabled with SUSE_ADVISORY_URL_DISCOVERY, in which
+        case only the first announcement URL is returned.
+    """
+    url_root = 'https://www.suse.com/support/update/announcement/'
+    url_path = f'{year}/{prefix}-{year}{number}-'
+    discover = get_setting_of_type(
+        setting_name='SUSE_ADVISORY_URL_DISCOVERY',
+        setting_type=bool,
+        default=True,
+    )
+    if not discover:
+        return [f'{url_root}{url_path}1']
+    cache_key = f'suse_advisory_urls_{prefix}-{year}{number}'
+    urls = cache.get(cache_key)
+    if urls is not None:
+        return urls
+    urls = []
+    for i in range(1, 10):
+        url = f'{url_root}{url_path}{i}'
+        res = get_url(url)
+        if res is None or res.status_code != 200:
+            break
+        urls.append(url)
+    if res is not None:
+        cache.set(cache_key, urls, SUSE_ADVISORY_URL_CACHE_TIMEOUT)
+    return urls
+
+
 def add_updateinfo_erratum_references(e, update, ref_type, urls):
     """ Adds references to an Erratum
     """
     if urls:
         for url in urls:
             e.add_reference(ref_type, url)
-    references = update.find('references')
-    if references is None:
-        return
-    for reference in references.findall('reference'):
-        if reference.attrib.get('type') == 'cve':
-            cve_id = reference.attrib.get('id')
+    for reference in update.get('references'):
+        if reference.get('type') == 'cve':
+            cve_id = reference.get('id')
             e.add_cve(cve_id)
         else:
-            ref = reference.attrib.get('href')
+            ref = reference.get('href')
             e.add_reference('Link', ref)
 
 
@@ -150,10 +219,10 @@ def get_osrelease_names(e, update):
         Special case for opensuse and sles which share updates/repos
     """
     osreleases = []
-    release = update.find('release')
+    release = update.get('release')
     if release is not None:
-        if release.text != '0':  # alma sets this to zero for some reason
-            osrelease_name = release.text
+        if release != '0':  # alma sets this to zero for some reason
+            osrelease_name = release
             if osrelease_name.startswith('openSUSE'):
                 suse_parts = osrelease_name.split()
                 if suse_parts[1] == 'Backports':
@@ -207,9 +276,8 @@ def add_updateinfo_osreleases(e, collection, osrelease_names):
         EPEL maps to existing EL-based OSReleases only
     """
     if not osrelease_names:
-        collection_name = collection.find('name')
-        if collection_name is not None:
-            osrelease_name = collection_name.text
+        osrelease_name = collection.get('name')
+        if osrelease_name is not None:
             osrelease_names.append(osrelease_name)
     for osrelease_name in osrelease_names:
         if osrelease_name.startswith('Fedora EPEL'):
@@ -217,34 +285,31 @@ def add_updateinfo_osreleases(e, collection, osrelease_names):
             version_str = osrelease_name.split()[-1]  # "10.0"
             major_version = version_str.split('.')[0]  # "10"
             for osrelease in get_existing_el_osreleases(major_version):
-                e.osreleases.add(osrelease)
+                e.add_osrelease(osrelease.name)
             continue
-        osrelease_name = normalize_el_osrelease(osrelease_name)
-        osrelease = get_or_create_osrelease(name=osrelease_name)
-        e.osreleases.add(osrelease)
+        e.add_osrelease(normalize_el_osrelease(osrelease_name))
 
 
 def add_updateinfo_packages(e, update):
     """ Adds packages to an Erratum
     """
     osrelease_names = get_osrelease_names(e, update)
-    pkglist = update.find('pkglist')
     packages = set()
-    for collection in pkglist.findall('collection'):
+    for collection in update.get('collections'):
         add_updateinfo_osreleases(e, collection, osrelease_names)
-        for pkg in collection.findall('package'):
-            name = pkg.attrib.get('name')
-            epoch = pkg.attrib.get('epoch')
-            version = pkg.attrib.get('version')
-            release = pkg.attrib.get('release')
-            arch = pkg.attrib.get('arch')
-            package = get_or_create_package(
+        for pkg in collection.get('packages'):
+            name = pkg.get('name')
+            epoch = pkg.get('epoch')
+            version = pkg.get('version')
+            release = pkg.get('release')
+            arch = pkg.get('arch')
+            package = PackageString(
                 name=name.lower(),
                 epoch=epoch,
                 version=version,
                 release=release,
                 arch=arch,
-                p_type=Package.RPM,
+                packagetype=Package.RPM,
             )
             packages.add(package)
         e.add_fixed_packages(packages)
@@ -17,13 +17,21 @@
 from celery import shared_task
 from django.core.cache import cache
 
+from errata.sink import resolve_errata_package_matches
 from errata.sources.distros.alma import update_alma_errata
 from errata.sources.distros.arch import update_arch_errata
 from errata.sources.distros.centos import update_centos_errata
 from errata.sources.distros.debian import update_debian_errata
 from errata.sources.distros.rocky import update_rocky_errata
 from errata.sources.distros.ubuntu import update_ubuntu_errata
+from errata.utils import (
+    enrich_errata, mark_errata_security_updates,
+    scan_package_updates_for_affected_packages, start_tracking_errata_packages,
+    stop_tracking_errata_packages,
+)
+from hosts.utils import get_hosts_with_packages, update_host_vulnerabilities
 from repos.models import Repository
+from repos.utils import update_repo_security_counts
 from security.tasks import update_cves, update_cwes
 from util import get_setting_of_type
 from util.logging import error_message, warning_message
@@ -42,8 +50,12 @@ def update_yum_repo_errata(repo_id=None, force=False):
 
 
 @shared_task(priority=1)
-def update_errata(erratum_type=None, force=False, repo=None):
+def update_errata(erratum_type=None, force=False, repo=None, enrich=False, full_index=False):
     """ Update all distros errata
+        Unchanged feeds and advisories are skipped unless force is set
+        If enrich is set, errata are also enriched with data from osv.dev
+        Only hosts with packages whose errata changed are re-indexed, unless
+        force or full_index is set, which rebuild the index for all hosts
     """
     lock_key = 'update_errata_lock'
     # lock will expire after 48 hours
@@ -51,6 +63,7 @@ def update_errata(erratum_type=None, force=False, repo=None):
 
     if cache.add(lock_key, 'true', lock_expire):
         try:
+            start_tracking_errata_packages()
             errata_os_updates = []
             erratum_types = ['yum', 'rocky', 'alma', 'arch', 'ubuntu', 'debian', 'centos']
             erratum_type_defaults = ['yum', 'rocky', 'alma', 'arch', 'ubuntu', 'debian']
@@ -78,18 +91,33 @@ def update_errata(erratum_type=None, force=False, repo=None):
             if 'yum' in errata_os_updates:
                 update_yum_repo_errata(repo_id=repo, force=force)
             if 'arch' in errata_os_updates:
-                update_arch_errata()
+                update_arch_errata(force=force)
             if 'alma' in errata_os_updates:
-                update_alma_errata(concurrent, max_workers)
+                update_alma_errata(concurrent, max_workers, force)
             if 'rocky' in errata_os_updates:
-                update_rocky_errata(concurrent, max_workers)
+                update_rocky_errata(concurrent, max_workers, force)
             if 'debian' in errata_os_updates:
-                update_debian_errata(concurrent, max_workers)
+                update_debian_errata(concurrent, max_workers, force)
             if 'ubuntu' in errata_os_updates:
-                update_ubuntu_errata(concurrent, max_workers)
+                update_ubuntu_errata(concurrent, max_workers, force)
             if 'centos' in errata_os_updates:
-                update_centos_errata()
+                update_centos_errata(force)
+            # skipped advisories may match packages that have appeared since
+            resolve_errata_package_matches()
+            scan_package_updates_for_affected_packages()
+            mark_errata_security_updates()
+            if enrich:
+                enrich_errata(concurrent, max_workers)
+            # security package counts depend on the fixed packages of errata
+            update_repo_security_counts()
+            # the index depends on the affected and fixed packages of errata
+            package_ids = stop_tracking_errata_packages()
+            if force or full_index:
+                update_host_vulnerabilities()
+            else:
+                update_host_vulnerabilities(get_hosts_with_packages(package_ids))
         finally:
+            stop_tracking_errata_packages()
             cache.delete(lock_key)
     else:
         warning_message('Already updating Errata, skipping task.')
@@ -0,0 +1,283 @@
+# Copyright 2026 Marcus Furlong <furlongm@gmail.com>
+#
+# This file is part of Patchman.
+#
+# Patchman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 only.
+#
+# Patchman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchman. If not, see <http://www.gnu.org/licenses/>
+
+from datetime import datetime, timezone
+
+from defusedxml import ElementTree
+from django.test import TestCase, override_settings
+
+from arch.models import MachineArchitecture, PackageArchitecture
+from errata.models import Erratum
+from errata.sink import (
+    ErratumRecord, ErratumSink, resolve_errata_package_matches,
+)
+from errata.sources.repos.yum import (
+    parse_updateinfo_update, process_updateinfo_erratum,
+)
+from errata.utils import (
+    start_tracking_errata_packages, stop_tracking_errata_packages,
+)
+from modules.models import Module
+from operatingsystems.models import OSRelease
+from packages.models import Package, PackageName, PackageString
+from repos.models import Repository
+from security.models import CVE, Reference
+
+
+def make_record(name, synopsis='Security update'):
+    e = ErratumRecord(
+        name=name,
+        e_type='security',
+        issue_date='2026-01-10 00:00:00',
+        synopsis=synopsis,
+    )
+    e.add_cve('CVE-2026-0001')
+    e.add_reference('Link', f'https://example.com/{name}')
+    e.add_osrelease('Rocky Linux 9')
+    e.add_fixed_packages([PackageString(
+        name='openssl', epoch='1', version='3.0.7', release='1.el9', arch='x86_64', packagetype=Package.RPM,
+    )])
+    return e
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class ErratumSinkTests(TestCase):
+    """Tests for writing ErratumRecords in bulk."""
+
+    def test_sink_creates_errata_and_related_objects(self):
+        """Test that a batch creates errata, related objects and counts."""
+        with ErratumSink() as sink:
+            sink.add(make_record('RLSA-2026:0001'))
+            sink.add(make_record('RLSA-2026:0002'))
+        self.assertEqual(Erratum.objects.count(), 2)
+        self.assertEqual(CVE.objects.count(), 1)
+        self.assertEqual(Package.objects.count(), 1)
+        e = Erratum.objects.get(name='RLSA-2026:0001')
+        self.assertEqual(list(e.cves.values_list('cve_id', flat=True)), ['CVE-2026-0001'])
+        self.assertEqual(list(e.osreleases.values_list('name', flat=True)), ['Rocky Linux 9'])
+        self.assertEqual(e.fixed_packages.get().name.name, 'openssl')
+        self.assertEqual(e.references.get().url, 'https://example.com/RLSA-2026:0001')
+        self.assertEqual(e.cves_count, 1)
+        self.assertEqual(e.osreleases_count, 1)
+        self.assertEqual(e.fixed_packages_count, 1)
+        self.assertEqual(e.references_count, 1)
+        self.assertEqual(e.affected_packages_count, 0)
+
+    def test_sink_updates_existing_errata(self):
+        """Test that existing errata and related objects are reused."""
+        Erratum.objects.create(
+            name='RLSA-2026:0001',
+            e_type='security',
+            issue_date=datetime(2026, 1, 10, tzinfo=timezone.utc),
+            synopsis='Old synopsis',
+        )
+        CVE.objects.create(cve_id='CVE-2026-0001')
+        Reference.objects.create(ref_type='Rocky Advisory', url='https://example.com/RLSA-2026:0001')
+        OSRelease.objects.create(name='Rocky Linux 9')
+        with ErratumSink() as sink:
+            sink.add(make_record('RLSA-2026:0001', synopsis='New synopsis'))
+        e = Erratum.objects.get(name='RLSA-2026:0001')
+        self.assertEqual(e.synopsis, 'New synopsis')
+        self.assertEqual(CVE.objects.count(), 1)
+        self.assertEqual(Reference.objects.count(), 1)
+        self.assertEqual(OSRelease.objects.count(), 1)
+        self.assertEqual(e.references.get().ref_type, 'Rocky Advisory')
+
+    def test_sink_is_idempotent(self):
+        """Test that writing the same records twice does not add duplicates."""
+        for _ in range(2):
+            with ErratumSink() as sink:
+                sink.add(make_record('RLSA-2026:0001'))
+        e = Erratum.objects.get(name='RLSA-2026:0001')
+        self.assertEqual(e.fixed_packages.count(), 1)
+        self.assertEqual(e.cves.count(), 1)
+        self.assertEqual(e.fixed_packages_count, 1)
+
+    def test_sink_records_written_packages(self):
+        """Test that the packages of written errata are tracked for re-indexing hosts."""
+        start_tracking_errata_packages()
+        with ErratumSink() as sink:
+            sink.add(make_record('RLSA-2026:0001'))
+        self.assertEqual(stop_tracking_errata_packages(), {Package.objects.get().id})
+        with ErratumSink() as sink:
+            sink.add(make_record('RLSA-2026:0002'))
+        self.assertEqual(stop_tracking_errata_packages(), set())
+
+    def test_sink_flushes_batches_and_merges_records(self):
+        """Test that full batches are written and records for the same erratum are merged."""
+        sink = ErratumSink(batch_size=2)
+        sink.add(make_record('RLSA-2026:0001'))
+        sink.add(None)
+        other = make_record('RLSA-2026:0001')
+        other.add_cve('CVE-2026-0002')
+        sink.add(other)
+        self.assertEqual(Erratum.objects.count(), 0)
+        sink.add(make_record('RLSA-2026:0002'))
+        self.assertEqual(Erratum.objects.count(), 2)
+        self.assertEqual(Erratum.objects.get(name='RLSA-2026:0001').cves_count, 2)
+        sink.add(make_record('RLSA-2026:0003'))
+        sink.flush()
+        self.assertEqual(Erratum.objects.count(), 3)
+
+    def test_record_ignores_invalid_cve_ids(self):
+        """Test that invalid CVE IDs are not added to a record."""
+        e = make_record('RLSA-2026:0001')
+        e.add_cve('CVE-ABCD-0001')
+        self.assertEqual(e.cve_ids, {'CVE-2026-0001'})
+
+    def test_sink_adds_existing_and_module_packages(self):
+        """Test that matched Package objects and module packages are written."""
+        name = PackageName.objects.create(name='bash')
+        arch = PackageArchitecture.objects.create(name='x86_64')
+        package = Package.objects.create(
+            name=name, arch=arch, epoch='', version='5.1', release='1.el9', packagetype=Package.RPM,
+        )
+        repo = Repository.objects.create(
+            name='rocky-9-appstream',
+            arch=MachineArchitecture.objects.create(name='x86_64'),
+            repotype=Repository.RPM,
+        )
+        module = Module.objects.create(
+            name='nodejs', stream='18', version=1, context='abc', arch=arch, repo=repo,
+        )
+        e = make_record('RLSA-2026:0001')
+        e.add_affected_packages([package])
+        strpackage = PackageString(
+            name='nodejs', epoch='', version='18.1', release='1.el9', arch='x86_64', packagetype=Package.RPM,
+        )
+        e.add_module_packages(module.id, [strpackage])
+        with ErratumSink() as sink:
+            sink.add(e)
+        erratum = Erratum.objects.get(name='RLSA-2026:0001')
+        self.assertEqual(list(erratum.affected_packages.all()), [package])
+        self.assertEqual(erratum.affected_packages_count, 1)
+        self.assertEqual(module.packages.get().name.name, 'nodejs')
+
+    def test_updateinfo_erratum_record(self):
+        """Test that an updateinfo update is converted to an ErratumRecord."""
+        update = ElementTree.fromstring('''
+            <update type="security">
+              <id>RLSA-2026:0001</id>
+              <title>Important: openssl security update</title>
+              <issued date="2026-01-10 00:00:00"/>
+              <release>Rocky Linux 9.5</release>
+              <references>
+                <reference type="cve" id="CVE-2026-0001" href="https://example.com/cve"/>
+              </references>
+              <pkglist>
+                <collection>
+                  <package name="openssl" epoch="1" version="3.0.7" release="1.el9" arch="x86_64"/>
+                </collection>
+              </pkglist>
+            </update>
+        ''')
+        e = process_updateinfo_erratum(parse_updateinfo_update(update))
+        self.assertEqual(e.name, 'RLSA-2026:0001')
+        self.assertEqual(e.cve_ids, {'CVE-2026-0001'})
+        self.assertEqual(e.osrelease_names, {'Rocky Linux 9'})
+        self.assertEqual(len(e.fixed_packages), 1)
+        self.assertEqual(Erratum.objects.count(), 0)
+
+    def test_sink_matches_packages_without_arch(self):
+        """Test that fixed packages without an architecture are matched against existing packages."""
+        name = PackageName.objects.create(name='openssl')
+        for arch in ['amd64', 'arm64']:
+            Package.objects.create(
+                name=name, arch=PackageArchitecture.objects.create(name=arch),
+                epoch='', version='3.0.2', release='0ubuntu1.10', packagetype=Package.DEB,
+            )
+        e = make_record('USN-6000-1')
+        e.add_fixed_package_match('openssl', '', '3.0.2', '0ubuntu1.10', Package.DEB)
+        e.add_fixed_package_match('curl', '', '7.81.0', '1ubuntu1.15', Package.DEB)
+        with ErratumSink() as sink:
+            sink.add(e)
+        erratum = Erratum.objects.get(name='USN-6000-1')
+        self.assertEqual(
+            sorted(erratum.fixed_packages.values_list('name__name', 'arch__name')),
+            [('openssl', 'amd64'), ('openssl', 'arm64'), ('openssl', 'x86_64')],
+        )
+        self.assertEqual(erratum.fixed_packages_count, 3)
+
+    def test_matches_are_resolved_after_import(self):
+        """Test that packages and modules matching an erratum are linked on later runs."""
+        e = make_record('USN-6000-1')
+        e.add_fixed_package_match('openssl', '', '3.0.2', '0ubuntu1.10', Package.DEB)
+        e.add_affected_package_match('openssl', '', '3.0.1', '0ubuntu1.9', Package.DEB)
+        e.add_fixed_module_match('nodejs', '18', '1', 'abc', 'x86_64')
+        with ErratumSink() as sink:
+            sink.add(e)
+        erratum = Erratum.objects.get(name='USN-6000-1')
+        self.assertEqual(erratum.fixed_packages_count, 1)
+        self.assertEqual(erratum.affected_packages_count, 0)
+
+        name = PackageName.objects.get(name='openssl')
+        arch = PackageArchitecture.objects.create(name='amd64')
+        fixed = Package.objects.create(
+            name=name, arch=arch, epoch='', version='3.0.2', release='0ubuntu1.10', packagetype=Package.DEB,
+        )
+        affected = Package.objects.create(
+            name=name, arch=arch, epoch='', version='3.0.1', release='0ubuntu1.9', packagetype=Package.DEB,
+        )
+        repo = Repository.objects.create(
+            name='rocky-9-appstream',
+            arch=MachineArchitecture.objects.create(name='x86_64'),
+            repotype=Repository.RPM,
+        )
+        module = Module.objects.create(
+            name='nodejs', stream='18', version='1', context='abc',
+            arch=PackageArchitecture.objects.get(name='x86_64'), repo=repo,
+        )
+        nodejs = Package.objects.create(
+            name=PackageName.objects.create(name='nodejs'), arch=module.arch,
+            epoch='', version='18.1', release='1.el9', packagetype=Package.RPM,
+        )
+        module.packages.add(nodejs)
+        resolve_errata_package_matches()
+        resolve_errata_package_matches()
+        erratum.refresh_from_db()
+        self.assertEqual(
+            sorted(erratum.fixed_packages.values_list('name__name', 'version')),
+            [('nodejs', '18.1'), ('openssl', '3.0.2'), ('openssl', '3.0.7')],
+        )
+        self.assertIn(fixed, erratum.fixed_packages.all())
+        self.assertEqual(list(erratum.affected_packages.all()), [affected])
+        self.assertEqual(erratum.fixed_packages_count, 3)
+        self.assertEqual(erratum.affected_packages_count, 1)
+
+    def test_module_package_matches_are_resolved(self):
+        """Test that fixed packages are added to modules that appear after import."""
+        e = make_record('RLSA-2026:0001')
+        strpackage = PackageString(
+            name='nodejs', epoch='', version='18.1', release='1.el9', arch='x86_64', packagetype=Package.RPM,
+        )
+        e.add_fixed_packages([strpackage])
+        e.add_module_package_match('nodejs', '18', '1', 'abc', 'x86_64', [strpackage])
+        with ErratumSink() as sink:
+            sink.add(e)
+        repo = Repository.objects.create(
+            name='rocky-9-appstream',
+            arch=MachineArchitecture.objects.create(name='x86_64'),
+            repotype=Repository.RPM,
+        )
+        module = Module.objects.create(
+            name='nodejs', stream='18', version='1', context='abc',
+            arch=PackageArchitecture.objects.get(name='x86_64'), repo=repo,
+        )
+        resolve_errata_package_matches()
+        self.assertEqual(module.packages.get().name.name, 'nodejs')
@@ -0,0 +1,543 @@
+# Copyright 2026 Marcus Furlong <furlongm@gmail.com>
+#
+# This file is part of Patchman.
+#
+# Patchman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 only.
+#
+# Patchman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchman. If not, see <http://www.gnu.org/licenses/>
+
+import bz2
+import gzip
+import json
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from arch.models import PackageArchitecture
+from errata.models import DebianDSC, ErrataFeed, Erratum
+from errata.sink import ErratumRecord, ErratumSink
+from errata.sources.distros.alma import update_alma_errata
+from errata.sources.distros.debian import (
+    get_debian_dsc_fetches, get_debian_dsc_package_list,
+    load_debian_dsc_package_lists, parse_debian_package_file_map,
+    process_debian_erratum_fixed_packages, store_debian_dsc_urls,
+    update_debian_errata,
+)
+from errata.sources.distros.rocky import (
+    fetch_rocky_advisories_serially, get_rocky_advisory_date,
+    update_rocky_errata,
+)
+from errata.sources.distros.ubuntu import parse_usn_data
+from errata.sources.repos.yum import (
+    extract_updateinfo, get_suse_advisory_urls, iter_updateinfo_updates,
+)
+from errata.tasks import update_errata
+from errata.utils import (
+    errata_feed_has_changed, get_changed_errata, get_content_hash,
+    get_errata_feed_headers, get_errata_feed_last_advisory_date,
+    mark_errata_security_updates, scan_package_updates_for_affected_packages,
+    set_errata_feed_checksum, set_errata_feed_last_advisory_date,
+)
+from operatingsystems.models import OSRelease
+from packages.models import Package, PackageName, PackageUpdate
+
+
+def make_record(name):
+    return ErratumRecord(
+        name=name,
+        e_type='security',
+        issue_date=1767225600,
+        synopsis='Security update',
+    )
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class ErrataChangeDetectionTests(TestCase):
+    """Tests for skipping unchanged errata feeds and advisories."""
+
+    def test_content_hash_is_stable(self):
+        """Test that the content hash does not depend on key order."""
+        self.assertEqual(get_content_hash({'a': 1, 'b': [1, 2]}), get_content_hash({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(get_content_hash({'a': 1}), get_content_hash({'a': 2}))
+        self.assertEqual(len(get_content_hash(b'data')), 64)
+
+    def test_sink_stores_content_hashes(self):
+        """Test that the sink stores the content hashes of the records it writes."""
+        with ErratumSink(content_hashes={'DSA-1000-1': 'abc'}) as sink:
+            sink.add(make_record('DSA-1000-1'))
+            sink.add(make_record('DSA-1001-1'))
+        self.assertEqual(Erratum.objects.get(name='DSA-1000-1').content_hash, 'abc')
+        self.assertIsNone(Erratum.objects.get(name='DSA-1001-1').content_hash)
+        with ErratumSink(content_hashes={'DSA-1000-1': 'def'}) as sink:
+            sink.add(make_record('DSA-1000-1'))
+        self.assertEqual(Erratum.objects.get(name='DSA-1000-1').content_hash, 'def')
+
+    def test_incomplete_record_does_not_store_content_hash(self):
+        """Test that a record with an empty content hash is retried next time."""
+        e = make_record('DSA-1000-1')
+        e.content_hash = ''
+        with ErratumSink(content_hashes={'DSA-1000-1': 'abc'}) as sink:
+            sink.add(e)
+        self.assertEqual(get_changed_errata({'DSA-1000-1': 'abc'}), {'DSA-1000-1'})
+
+    def test_get_changed_errata(self):
+        """Test that only new and changed errata are returned."""
+        with ErratumSink(content_hashes={'DSA-1000-1': 'abc', 'DSA-1001-1': 'def'}) as sink:
+            sink.add(make_record('DSA-1000-1'))
+            sink.add(make_record('DSA-1001-1'))
+        content_hashes = {'DSA-1000-1': 'abc', 'DSA-1001-1': 'changed', 'DSA-1002-1': 'new'}
+        self.assertEqual(get_changed_errata(content_hashes), {'DSA-1001-1', 'DSA-1002-1'})
+        self.assertEqual(get_changed_errata(content_hashes, force=True), set(content_hashes))
+
+    def test_errata_feed_checksum(self):
+        """Test that an errata feed is skipped until its checksum changes."""
+        self.assertTrue(errata_feed_has_changed('ubuntu', 'abc'))
+        set_errata_feed_checksum('ubuntu', 'abc')
+        self.assertFalse(errata_feed_has_changed('ubuntu', 'abc'))
+        self.assertTrue(errata_feed_has_changed('ubuntu', 'abc', force=True))
+        self.assertTrue(errata_feed_has_changed('ubuntu', 'def'))
+        self.assertTrue(errata_feed_has_changed('debian', 'abc'))
+        set_errata_feed_checksum('ubuntu', 'def')
+        self.assertFalse(errata_feed_has_changed('ubuntu', 'def'))
+
+    def test_debian_dsc_fetches_for_changed_errata(self):
+        """Test that DSC files are only needed for accepted codenames."""
+        errata = [
+            {'name': 'DSA-1000-1', 'packages': {'trixie': [('openssl', '3.0.1-1')], 'buster': [('openssl', '1.1')]}},
+            {'name': 'DLA-2000-1', 'packages': {'bookworm': [None, ('openssl', '3.0.1-1')]}},
+        ]
+        fetches = get_debian_dsc_fetches(errata, ['bookworm', 'trixie'])
+        self.assertEqual(fetches, [('openssl', '3.0.1-1')])
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class DebianDSCTests(TestCase):
+    """Tests for caching Debian DSC package lists."""
+
+    def test_parse_debian_package_file_map(self):
+        """Test that only DSC files are indexed from a package file map."""
+        data = (
+            'Path: ./pool/updates/main/o/openssl/openssl_3.0.1-1.dsc\n'
+            'Source: openssl\n'
+            'Source-Version: 3.0.1-1\n'
+            '\n'
+            'Path: ./pool/updates/main/o/openssl/openssl_3.0.1.orig.tar.gz\n'
+            'Source: openssl\n'
+            'Source-Version: 3.0.1-2\n'
+        )
+        dsc_urls = parse_debian_package_file_map(data, 'debian-security')
+        url = 'https://deb.debian.org/debian-security/pool/updates/main/o/openssl/openssl_3.0.1-1.dsc'
+        self.assertEqual(dsc_urls, {('openssl', '3.0.1-1'): url})
+
+    def test_store_debian_dsc_urls_keeps_package_lists(self):
+        """Test that storing file map URLs keeps cached package lists."""
+        DebianDSC.objects.create(
+            source='openssl', version='3.0.1-1', url='https://example.com/old.dsc',
+            package_list=[['openssl', 'arch=any']],
+        )
+        store_debian_dsc_urls({
+            ('openssl', '3.0.1-1'): 'https://example.com/new.dsc',
+            ('bash', '5.2-1'): 'https://example.com/bash.dsc',
+        })
+        dsc = DebianDSC.objects.get(source='openssl')
+        self.assertEqual(dsc.url, 'https://example.com/new.dsc')
+        self.assertEqual(dsc.package_list, [['openssl', 'arch=any']])
+        self.assertIsNone(DebianDSC.objects.get(source='bash').package_list)
+
+    @patch('errata.sources.distros.debian.update_debian_package_file_maps')
+    @patch('errata.sources.distros.debian.fetch_debian_dsc_package_list')
+    def test_only_unseen_dscs_are_fetched(self, fetch_package_list, update_file_maps):
+        """Test that only DSC files without a stored package list are fetched."""
+        DebianDSC.objects.create(
+            source='openssl', version='3.0.1-1', url='https://example.com/openssl.dsc',
+            package_list=[['openssl', 'arch=any']],
+        )
+        DebianDSC.objects.create(source='bash', version='5.2-1', url='https://example.com/bash.dsc')
+        fetch_package_list.return_value = [['bash', 'arch=all']]
+        load_debian_dsc_package_lists([('openssl', '3.0.1-1'), ('bash', '5.2-1')], concurrent_processing=False)
+        fetch_package_list.assert_called_once_with('https://example.com/bash.dsc', session=None)
+        update_file_maps.assert_not_called()
+        self.assertEqual(DebianDSC.objects.get(source='bash').package_list, [['bash', 'arch=all']])
+        self.assertEqual(get_debian_dsc_package_list('openssl', '3.0.1-1'), [['openssl', 'arch=any']])
+
+        fetch_package_list.reset_mock()
+        load_debian_dsc_package_lists([('bash', '5.2-1'), ('zsh', '5.9-1')], concurrent_processing=False)
+        fetch_package_list.assert_not_called()
+        update_file_maps.assert_called_once()
+        self.assertIsNone(get_debian_dsc_package_list('zsh', '5.9-1'))
+
+    @patch('errata.sources.distros.debian.update_debian_package_file_maps')
+    def test_fixed_packages_from_cached_package_list(self, update_file_maps):
+        """Test that fixed packages are created from a cached package list."""
+        DebianDSC.objects.create(
+            source='openssl', version='3.0.1-1', url='https://example.com/openssl.dsc',
+            package_list=[['openssl', 'arch=amd64,arm64'], ['openssl-doc', 'arch=all']],
+        )
+        load_debian_dsc_package_lists([('openssl', '3.0.1-1')], concurrent_processing=False)
+        e = ErratumRecord(name='DSA-1000-1', e_type='security', issue_date=1767225600, synopsis='openssl')
+        self.assertTrue(process_debian_erratum_fixed_packages(e, ('openssl', '3.0.1-1')))
+        self.assertFalse(process_debian_erratum_fixed_packages(e, ('bash', '5.2-1')))
+        self.assertEqual(
+            sorted((p.name, p.arch) for p in e.fixed_packages),
+            [('openssl', 'amd64'), ('openssl', 'arm64'), ('openssl-doc', 'all')],
+        )
+
+    @patch('errata.sources.distros.debian.load_debian_dsc_package_lists')
+    @patch('errata.sources.distros.debian.get_accepted_debian_codenames', return_value=['bookworm'])
+    @patch('errata.sources.distros.debian.fetch_debian_dla_advisories', return_value='')
+    @patch('errata.sources.distros.debian.fetch_debian_dsa_advisories')
+    @patch('errata.sources.distros.debian.create_debian_os_releases')
+    @patch('errata.sources.distros.debian.retrieve_debian_codenames')
+    def test_feed_checksum_is_not_stored_for_incomplete_errata(self, *mocks):
+        """Test that the feed is processed again when a DSC file was missing."""
+        fetch_dsa_advisories = mocks[2]
+        fetch_dsa_advisories.return_value = (
+            '[01 Jan 2026] DSA-1000-1 curl - security update\n'
+            '\t{CVE-2026-0001}\n'
+            '\t[bookworm] - curl 7.88.1-10\n'
+        )
+        OSRelease.objects.create(name='Debian 12', codename='bookworm')
+        update_debian_errata(concurrent_processing=False)
+        self.assertEqual(Erratum.objects.get(name='DSA-1000-1').content_hash, '')
+        self.assertFalse(ErrataFeed.objects.filter(name='debian', checksum__isnull=False).exists())
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    UBUNTU_CODENAMES=['jammy'],
+)
+class UbuntuUSNStreamingTests(TestCase):
+    """Tests for streaming the Ubuntu USN database."""
+
+    def setUp(self):
+        OSRelease.objects.create(name='Ubuntu 22.04', codename='jammy')
+        url = 'https://launchpad.net/ubuntu/+archive/primary/+files/openssl_3.0.2-0ubuntu1.10_amd64.deb'
+        self.advisories = {
+            '6000-1': {
+                'title': 'OpenSSL vulnerabilities',
+                'timestamp': 1767225600,
+                'cves': ['CVE-2026-0001'],
+                'releases': {'jammy': {'archs': {'amd64': {'urls': [url]}}}},
+            },
+            '6001-1': {
+                'title': 'Bash vulnerability',
+                'timestamp': 1767225600,
+                'cves': ['CVE-2026-0002'],
+                'releases': {'xenial': {'binaries': {}, 'allbinaries': {}}},
+            },
+        }
+
+    def get_usn_db(self):
+        return bz2.compress(json.dumps(self.advisories).encode())
+
+    def test_only_new_or_changed_usns_are_processed(self):
+        """Test that USNs for other releases and unchanged USNs are skipped."""
+        parse_usn_data(self.get_usn_db(), concurrent_processing=False)
+        e = Erratum.objects.get()
+        self.assertEqual(e.name, 'USN-6000-1')
+        self.assertEqual(e.fixed_packages.get().name.name, 'openssl')
+        self.assertEqual(list(e.osreleases.values_list('name', flat=True)), ['Ubuntu 22.04'])
+
+        with patch('errata.sources.distros.ubuntu.process_usn') as process_usn:
+            parse_usn_data(self.get_usn_db(), concurrent_processing=False)
+            process_usn.assert_not_called()
+
+        self.advisories['6000-1']['cves'].append('CVE-2026-0003')
+        parse_usn_data(self.get_usn_db(), concurrent_processing=False)
+        self.assertEqual(Erratum.objects.get().cves.count(), 2)
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    ALMA_RELEASES=[9],
+)
+class IncrementalErrataFeedTests(TestCase):
+    """Tests for only fetching new Rocky and Alma advisories."""
+
+    def test_errata_feed_headers(self):
+        """Test that conditional headers are built from the last response."""
+        self.assertEqual(get_errata_feed_headers('alma-9'), {})
+        res = MagicMock(headers={'ETag': '"abc"', 'Last-Modified': 'Thu, 01 Jan 2026 00:00:00 GMT'})
+        set_errata_feed_checksum('alma-9', 'def', res)
+        headers = get_errata_feed_headers('alma-9')
+        self.assertEqual(headers['If-None-Match'], '"abc"')
+        self.assertEqual(headers['If-Modified-Since'], 'Thu, 01 Jan 2026 00:00:00 GMT')
+        self.assertEqual(get_errata_feed_headers('alma-9', force=True), {})
+
+    def test_last_advisory_date_only_increases(self):
+        """Test that the newest advisory date is not moved backwards."""
+        newer = datetime(2026, 2, 1, tzinfo=timezone.utc)
+        set_errata_feed_last_advisory_date('rocky', newer)
+        set_errata_feed_last_advisory_date('rocky', datetime(2026, 1, 1, tzinfo=timezone.utc))
+        set_errata_feed_last_advisory_date('rocky', None)
+        self.assertEqual(get_errata_feed_last_advisory_date('rocky'), newer)
+
+    @patch('errata.sources.distros.alma.process_alma_errata')
+    @patch('errata.sources.distros.alma.get_url')
+    def test_unmodified_alma_errata_are_skipped(self, get_url, process_alma_errata):
+        """Test that Alma errata are not processed if the server returns 304."""
+        set_errata_feed_checksum('alma-9', 'abc', MagicMock(headers={'ETag': '"abc"'}))
+        get_url.return_value = MagicMock(status_code=304)
+        update_alma_errata(concurrent_processing=False)
+        self.assertEqual(get_url.call_args.kwargs['headers']['If-None-Match'], '"abc"')
+        process_alma_errata.assert_not_called()
+
+    @override_settings(ALMA_RELEASES=[9], FETCH_SPOOL_THRESHOLD=0)
+    @patch('errata.sources.distros.alma.process_alma_errata')
+    @patch('errata.sources.distros.alma.get_url')
+    def test_spooled_alma_errata_are_parsed(self, get_url, process_alma_errata):
+        """Test that Alma errata spooled to disk by fetch_content are parsed."""
+        advisories = [{'id': 'ALSA-2026:0001', 'updateinfo_id': 'ALSA-2026:0001'}]
+        data = json.dumps({'data': advisories}).encode()
+        get_url.return_value = MagicMock(status_code=200, headers={}, url='https://errata.almalinux.org')
+        get_url.return_value.iter_content.return_value = [data[:10], data[10:]]
+        update_alma_errata(concurrent_processing=False)
+        self.assertEqual(process_alma_errata.call_args.args[1], advisories)
+
+    @patch('errata.sources.distros.rocky.get_url')
+    @patch('errata.sources.distros.rocky.fetch_content')
+    def test_rocky_pages_are_fetched_until_older_advisories(self, fetch_content, get_url):
+        """Test that Rocky pages are only fetched until advisories are older than the last run."""
+        def page(dates, number):
+            links = {'last': '/api/v3/advisories/?page=3', 'next': f'/api/v3/advisories/?page={number + 1}'}
+            advisories = [{'name': f'RLSA-{number}-{i}', 'published_at': date} for i, date in enumerate(dates)]
+            return json.dumps({'advisories': advisories, 'links': links}).encode()
+        fetch_content.side_effect = [
+            page(['2026-03-01T00:00:00Z', '2026-02-01T00:00:00Z'], 1),
+            page(['2026-01-20T00:00:00Z', '2025-12-01T00:00:00Z'], 2),
+            page(['2025-11-01T00:00:00Z'], 3),
+        ]
+        since = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        advisories = fetch_rocky_advisories_serially('https://apollo.build.resf.org', '/api/v3/', since)
+        self.assertEqual(len(advisories), 4)
+        self.assertEqual(fetch_content.call_count, 2)
+
+        fetch_content.reset_mock()
+        fetch_content.side_effect = [
+            page(['2025-12-01T00:00:00Z', '2026-02-01T00:00:00Z'], 1),
+            page(['2025-11-01T00:00:00Z'], 2),
+            json.dumps({'advisories': [], 'links': {}}).encode(),
+        ]
+        advisories = fetch_rocky_advisories_serially('https://apollo.build.resf.org', '/api/v3/', since)
+        self.assertEqual(fetch_content.call_count, 3)
+
+    def test_rocky_advisory_date(self):
+        """Test that the Rocky advisory date is the later of published_at and updated_at."""
+        self.assertEqual(
+            get_rocky_advisory_date({'published_at': '2026-01-01T00:00:00Z', 'updated_at': '2026-02-01T00:00:00Z'}),
+            datetime(2026, 2, 1, tzinfo=timezone.utc),
+        )
+        self.assertEqual(
+            get_rocky_advisory_date({'published_at': '2026-01-01T00:00:00Z', 'updated_at': None}),
+            datetime(2026, 1, 1, tzinfo=timezone.utc),
+        )
+        self.assertIsNone(get_rocky_advisory_date({'published_at': None}))
+
+    @patch('errata.sources.distros.rocky.process_rocky_errata')
+    @patch('errata.sources.distros.rocky.fetch_rocky_advisories')
+    @patch('errata.sources.distros.rocky.check_rocky_errata_endpoint_health', return_value=True)
+    def test_rocky_advisories_without_dates_are_skipped(self, health, fetch_rocky_advisories, process_rocky_errata):
+        """Test that Rocky advisories without dates do not stop the last advisory date being stored."""
+        fetch_rocky_advisories.return_value = [
+            {'name': 'RLSA-2026:1', 'published_at': '2026-01-01T00:00:00Z', 'updated_at': '2026-03-01T00:00:00Z'},
+            {'name': 'RLSA-2026:2'},
+        ]
+        update_rocky_errata()
+        self.assertEqual(get_errata_feed_last_advisory_date('rocky'), datetime(2026, 3, 1, tzinfo=timezone.utc))
+
+    @patch('errata.sources.distros.rocky.process_rocky_errata')
+    @patch('errata.sources.distros.rocky.fetch_rocky_advisories', return_value=[])
+    @patch('errata.sources.distros.rocky.check_rocky_errata_endpoint_health', return_value=True)
+    def test_rocky_advisories_are_periodically_fetched_in_full(self, health, fetch_rocky_advisories,
+                                                               process_rocky_errata):
+        """Test that all Rocky advisories are fetched if the last full fetch is older than the interval."""
+        since = datetime(2026, 3, 1, tzinfo=timezone.utc)
+        set_errata_feed_last_advisory_date('rocky', since)
+        update_rocky_errata()
+        self.assertIsNone(fetch_rocky_advisories.call_args.args[-1])
+        update_rocky_errata()
+        self.assertEqual(fetch_rocky_advisories.call_args.args[-1], since)
+        with self.settings(ROCKY_ERRATA_FULL_FETCH_INTERVAL=0):
+            update_rocky_errata()
+        self.assertIsNone(fetch_rocky_advisories.call_args.args[-1])
+
+
+UPDATEINFO = b'''<?xml version="1.0" encoding="UTF-8"?>
+<updates>
+  <update type="security">
+    <id>RLSA-2026:0001</id>
+    <title>Important: openssl security update</title>
+    <issued date="2026-01-10 00:00:00"/>
+    <references>
+      <reference type="cve" id="CVE-2026-0001" href="https://example.com/cve"/>
+    </references>
+    <pkglist>
+      <collection>
+        <name>Rocky Linux 9</name>
+        <package name="openssl" epoch="1" version="3.0.7" release="1.el9" arch="x86_64" src="openssl.src.rpm"/>
+      </collection>
+    </pkglist>
+  </update>
+  <update type="bugfix">
+    <id>RLBA-2026:0002</id>
+    <title>bash bug fix update</title>
+    <issued date="2026-01-11 00:00:00"/>
+    <release>Rocky Linux 9.5</release>
+  </update>
+</updates>
+'''
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class UpdateinfoStreamingTests(TestCase):
+    """Tests for streaming updateinfo.xml files."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_updates_are_parsed_into_dicts(self):
+        """Test that updates are yielded as plain dicts."""
+        updates = list(iter_updateinfo_updates(gzip.compress(UPDATEINFO), 'updateinfo.xml.gz'))
+        self.assertEqual([u['id'] for u in updates], ['RLSA-2026:0001', 'RLBA-2026:0002'])
+        self.assertEqual(updates[0]['references'][0]['id'], 'CVE-2026-0001')
+        self.assertEqual(updates[0]['collections'][0]['name'], 'Rocky Linux 9')
+        self.assertEqual(
+            updates[0]['collections'][0]['packages'],
+            [{'name': 'openssl', 'epoch': '1', 'version': '3.0.7', 'release': '1.el9', 'arch': 'x86_64'}],
+        )
+        self.assertIsNone(updates[0]['release'])
+        self.assertEqual(updates[1]['release'], 'Rocky Linux 9.5')
+        self.assertEqual(updates[1]['collections'], [])
+
+    def test_extract_updateinfo(self):
+        """Test that streamed updates are written as errata."""
+        extract_updateinfo(UPDATEINFO, 'updateinfo.xml', concurrent_processing=False)
+        e = Erratum.objects.get(name='RLSA-2026:0001')
+        self.assertEqual(e.fixed_packages.get().name.name, 'openssl')
+        self.assertEqual(list(e.osreleases.values_list('name', flat=True)), ['Rocky Linux 9'])
+        self.assertEqual(Erratum.objects.get(name='RLBA-2026:0002').e_type, 'bugfix')
+
+    def test_truncated_updateinfo(self):
+        """Test that the updates before a parse error are still yielded."""
+        updates = list(iter_updateinfo_updates(UPDATEINFO[:UPDATEINFO.index(b'<update type="bugfix">') + 30], 'xml'))
+        self.assertEqual([u['id'] for u in updates], ['RLSA-2026:0001'])
+
+    @patch('errata.sources.repos.yum.get_url')
+    def test_suse_advisory_urls_are_cached(self, get_url):
+        """Test that SUSE announcement URLs are only looked up once."""
+        get_url.side_effect = [MagicMock(status_code=200), MagicMock(status_code=200), MagicMock(status_code=404)]
+        url = 'https://www.suse.com/support/update/announcement/2026/SUSE-SU-20260123-'
+        self.assertEqual(get_suse_advisory_urls('2026', 'SUSE-SU', '0123'), [f'{url}1', f'{url}2'])
+        self.assertEqual(get_suse_advisory_urls('2026', 'SUSE-SU', '0123'), [f'{url}1', f'{url}2'])
+        self.assertEqual(get_url.call_count, 3)
+        with self.settings(SUSE_ADVISORY_URL_DISCOVERY=False):
+            self.assertEqual(get_suse_advisory_urls('2026', 'SUSE-SU', '0124'), [f'{url[:-5]}0124-1'])
+        self.assertEqual(get_url.call_count, 3)
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class ErrataUpdateScanTests(TestCase):
+    """Tests for the set-based scans of PackageUpdates against errata."""
+
+    def setUp(self):
+        """Set up openssl and bash updates and a security erratum fixing openssl."""
+        arch = PackageArchitecture.objects.create(name='x86_64')
+        packages = {}
+        for name, version in [('openssl', '3.0.1'), ('openssl', '3.0.7'), ('bash', '5.1'), ('bash', '5.2')]:
+            packages[(name, version)] = Package.objects.create(
+                name=PackageName.objects.get_or_create(name=name)[0], arch=arch,
+                epoch='', version=version, release='1.el9', packagetype=Package.RPM,
+            )
+        self.old_openssl = packages[('openssl', '3.0.1')]
+        self.new_openssl = packages[('openssl', '3.0.7')]
+        self.openssl_update = PackageUpdate.objects.create(oldpackage=self.old_openssl, newpackage=self.new_openssl)
+        self.bash_update = PackageUpdate.objects.create(
+            oldpackage=packages[('bash', '5.1')], newpackage=packages[('bash', '5.2')],
+        )
+        self.erratum = Erratum.objects.create(
+            name='RLSA-2026:0001', e_type='security', issue_date=datetime(2026, 1, 10, tzinfo=timezone.utc),
+        )
+        self.erratum.fixed_packages.add(self.new_openssl)
+
+    def test_scan_package_updates_for_affected_packages(self):
+        """Test that the old packages of updates are added to the errata fixing the new packages."""
+        scan_package_updates_for_affected_packages()
+        scan_package_updates_for_affected_packages()
+        self.erratum.refresh_from_db()
+        self.assertEqual(list(self.erratum.affected_packages.all()), [self.old_openssl])
+        self.assertEqual(self.erratum.affected_packages_count, 1)
+
+    def test_mark_errata_security_updates(self):
+        """Test that updates fixed by or affected by security errata are marked as security updates."""
+        bugfix = Erratum.objects.create(
+            name='RLBA-2026:0002', e_type='bugfix', issue_date=datetime(2026, 1, 10, tzinfo=timezone.utc),
+        )
+        bugfix.fixed_packages.add(self.bash_update.newpackage)
+        mark_errata_security_updates()
+        self.openssl_update.refresh_from_db()
+        self.bash_update.refresh_from_db()
+        self.assertTrue(self.openssl_update.security)
+        self.assertFalse(self.bash_update.security)
+        self.erratum.affected_packages.add(self.bash_update.oldpackage)
+        mark_errata_security_updates()
+        self.bash_update.refresh_from_db()
+        self.assertTrue(self.bash_update.security)
+
+    def test_mark_errata_security_updates_removes_duplicates(self):
+        """Test that updates duplicating an existing security update are removed."""
+        PackageUpdate.objects.create(oldpackage=self.old_openssl, newpackage=self.new_openssl, security=True)
+        mark_errata_security_updates()
+        self.assertEqual(
+            list(PackageUpdate.objects.filter(newpackage=self.new_openssl).values_list('security', flat=True)),
+            [True],
+        )
+
+    @override_settings(ERRATA_OS_UPDATES=[])
+    def test_update_errata_indexes_vulnerabilities_after_scan(self):
+        """Test that updating errata indexes host vulnerabilities once, after the scans."""
+        calls = []
+
+        def record_scan(host_ids=None):
+            calls.append(list(self.erratum.affected_packages.all()))
+
+        with patch('errata.tasks.update_host_vulnerabilities', side_effect=record_scan):
+            update_errata()
+        self.assertEqual(calls, [[self.old_openssl]])
+        self.openssl_update.refresh_from_db()
+        self.assertTrue(self.openssl_update.security)
+
+    @override_settings(ERRATA_OS_UPDATES=[])
+    def test_update_errata_indexes_hosts_with_changed_packages(self):
+        """Test that only hosts with packages whose errata changed are re-indexed, unless forced."""
+        with patch('errata.tasks.get_hosts_with_packages', return_value={1}) as get_hosts:
+            with patch('errata.tasks.update_host_vulnerabilities') as update_index:
+                update_errata()
+                get_hosts.assert_called_once_with({self.old_openssl.id})
+                update_index.assert_called_once_with({1})
+                update_index.reset_mock()
+                update_errata(full_index=True)
+                update_index.assert_called_once_with()
@@ -14,11 +14,49 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
-from errata.models import Erratum
+import json
+import mmap
+from hashlib import sha256
+
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from errata.models import ErrataFeed, Erratum
 from packages.models import PackageUpdate
 from patchman.signals import pbar_start, pbar_update
-from util import fetch_concurrently, run_concurrently, tz_aware_datetime
-from util.logging import warning_message
+from util import fetch_concurrently, get_datetime_now, tz_aware_datetime
+from util.logging import info_message, warning_message
+
+# the ids of the packages whose errata have changed, collected while errata
+# are updated so that only the hosts with those packages are re-indexed
+tracked_package_ids = None
+
+
+def start_tracking_errata_packages():
+    """ Start collecting the ids of packages whose errata change, see
+        record_errata_packages
+    """
+    global tracked_package_ids
+    tracked_package_ids = set()
+
+
+def stop_tracking_errata_packages():
+    """ Stop collecting the ids of packages whose errata change. Returns the
+        set of ids collected since tracking was started
+    """
+    global tracked_package_ids
+    package_ids = tracked_package_ids or set()
+    tracked_package_ids = None
+    return package_ids
+
+
+def record_errata_packages(package_ids):
+    """ Record the ids of packages that were linked to errata, or whose
+        errata gained CVEs, if tracking is enabled
+    """
+    if tracked_package_ids is not None:
+        tracked_package_ids.update(package_ids)
 
 
 def get_or_create_erratum(name, e_type, issue_date, synopsis):
@@ -26,26 +64,7 @@ def get_or_create_erratum(name, e_type, issue_date, synopsis):
     """
     try:
         e = Erratum.objects.get(name=name)
-        issue_date_tz = tz_aware_datetime(issue_date)
-        # if it's +/- 1 day we don't update it, just use whichever was the first one
-        # different sources are generated at different times
-        # e.g. yum updateinfo vs website errata info
-        days_delta = abs(e.issue_date.date() - issue_date_tz.date()).days
-        updated = False
-        if e.e_type != e_type:
-            warning_message(text=f'Updating {name} type `{e.e_type}` -> `{e_type}`')
-            e.e_type = e_type
-            updated = True
-        if days_delta > 1:
-            text = f'Updating {name} issue date `{e.issue_date.date()}` -> `{issue_date_tz.date()}`'
-            warning_message(text=text)
-            e.issue_date = issue_date_tz
-            updated = True
-        if e.synopsis != synopsis:
-            warning_message(text=f'Updating {name} synopsis `{e.synopsis}` -> `{synopsis}`')
-            e.synopsis = synopsis
-            updated = True
-        if updated:
+        if update_erratum(e, e_type, issue_date, synopsis):
             e.save()
         created = False
     except Erratum.DoesNotExist:
@@ -58,36 +77,202 @@ def get_or_create_erratum(name, e_type, issue_date, synopsis):
     return e, created
 
 
-def mark_errata_security_updates(concurrent_processing=True, max_workers=25):
-    """ For each set of erratum packages, modify any PackageUpdate that
-        should be marked as a security update.
+def update_erratum(e, e_type, issue_date, synopsis):
+    """ Update the type, issue date and synopsis of an existing Erratum
+        object without saving it. Returns True if anything changed
     """
-    elen = Erratum.objects.count()
-    pbar_start.send(sender=None, ptext=f'Scanning {elen} Errata for security updates', plen=elen)
-    if concurrent_processing:
-        pks = list(Erratum.objects.values_list('pk', flat=True))
-        for i, _ in enumerate(run_concurrently(scan_security_worker, pks, max_workers)):
-            pbar_update.send(sender=None, index=i + 1)
-    else:
-        for i, e in enumerate(Erratum.objects.all()):
-            e.scan_for_security_updates()
-            pbar_update.send(sender=None, index=i + 1)
+    issue_date_tz = tz_aware_datetime(issue_date)
+    # if it's +/- 1 day we don't update it, just use whichever was the first one
+    # different sources are generated at different times
+    # e.g. yum updateinfo vs website errata info
+    days_delta = abs(e.issue_date.date() - issue_date_tz.date()).days
+    updated = False
+    if e.e_type != e_type:
+        warning_message(text=f'Updating {e.name} type `{e.e_type}` -> `{e_type}`')
+        e.e_type = e_type
+        updated = True
+    if days_delta > 1:
+        text = f'Updating {e.name} issue date `{e.issue_date.date()}` -> `{issue_date_tz.date()}`'
+        warning_message(text=text)
+        e.issue_date = issue_date_tz
+        updated = True
+    if e.synopsis != synopsis:
+        warning_message(text=f'Updating {e.name} synopsis `{e.synopsis}` -> `{synopsis}`')
+        e.synopsis = synopsis
+        updated = True
+    return updated
+
+
+def update_errata_counts(erratum_ids, batch_size=1000):
+    """ Update the cached related object counts of errata in bulk, for use
+        after the through tables have been written to directly
+    """
+    counts = {}
+    for field in ['affected_packages', 'fixed_packages', 'osreleases', 'cves', 'references']:
+        through = getattr(Erratum, field).through
+        counts[f'{field}_count'] = Coalesce(Subquery(
+            through.objects.filter(erratum=OuterRef('pk')).order_by().values(
+                'erratum').annotate(count=Count('*')).values('count')), 0)
+    erratum_ids = list(erratum_ids)
+    for i in range(0, len(erratum_ids), batch_size):
+        Erratum.objects.filter(id__in=erratum_ids[i:i + batch_size]).update(**counts)
+
+
+def get_content_hash(content):
+    """ Returns the sha256 hash of the content of an advisory or feed, which
+        can be bytes, SpooledContent or json-serializable data
+    """
+    if not isinstance(content, (bytes, mmap.mmap)):
+        content = json.dumps(content, sort_keys=True, default=str).encode()
+    return sha256(content).hexdigest()
+
+
+def get_changed_errata(content_hashes, force=False):
+    """ Takes a dict mapping erratum names to the content hashes of their
+        advisories. Returns the set of names of errata that are new or whose
+        advisories have changed since they were last processed, or all names
+        if force is set.
+    """
+    if force:
+        return set(content_hashes)
+    names = list(content_hashes)
+    stored_hashes = {}
+    for i in range(0, len(names), 1000):
+        stored_hashes.update(Erratum.objects.filter(name__in=names[i:i + 1000]).values_list('name', 'content_hash'))
+    changed = {name for name, content_hash in content_hashes.items() if stored_hashes.get(name) != content_hash}
+    info_message(text=f'{len(changed)} of {len(names)} Errata are new or have changed')
+    return changed
 
 
-def scan_security_worker(pk):
-    e = Erratum.objects.get(pk=pk)
-    return e.scan_for_security_updates()
+def get_errata_content_hashes(name_prefix):
+    """ Returns a dict mapping the names of errata starting with name_prefix
+        to the content hashes stored when they were last processed
+    """
+    errata = Erratum.objects.filter(name__startswith=name_prefix)
+    return dict(errata.values_list('name', 'content_hash'))
+
+
+def errata_feed_has_changed(name, checksum, force=False):
+    """ Returns True if the checksum of an errata feed differs from the one
+        stored when the feed was last processed
+    """
+    if force or not checksum:
+        return True
+    if ErrataFeed.objects.filter(name=name, checksum=checksum).exists():
+        info_message(text=f'Errata feed `{name}` has not changed, skipping Errata processing')
+        return False
+    return True
+
+
+def set_errata_feed_checksum(name, checksum, response=None):
+    """ Store the checksum of an errata feed once it has been processed,
+        along with the ETag and Last-Modified headers of the response the
+        feed was fetched with, if any
+    """
+    defaults = {'checksum': checksum}
+    if response is not None:
+        defaults['etag'] = response.headers.get('ETag')
+        defaults['last_modified'] = response.headers.get('Last-Modified')
+    ErrataFeed.objects.update_or_create(name=name, defaults=defaults)
+
+
+def get_errata_feed_headers(name, force=False):
+    """ Returns the http headers to fetch an errata feed only if it has been
+        modified since it was last processed
+    """
+    headers = {}
+    feed = None if force else ErrataFeed.objects.filter(name=name).first()
+    if feed:
+        if feed.etag:
+            headers['If-None-Match'] = feed.etag
+        if feed.last_modified:
+            headers['If-Modified-Since'] = feed.last_modified
+    return headers
+
+
+def get_errata_feed_last_advisory_date(name):
+    """ Returns the date of the newest advisory seen in an errata feed
+    """
+    return ErrataFeed.objects.filter(name=name).values_list('last_advisory_date', flat=True).first()
+
+
+def set_errata_feed_last_advisory_date(name, date):
+    """ Store the date of the newest advisory seen in an errata feed, if it
+        is newer than the stored date
+    """
+    last_advisory_date = get_errata_feed_last_advisory_date(name)
+    if date and (not last_advisory_date or date > last_advisory_date):
+        ErrataFeed.objects.update_or_create(name=name, defaults={'last_advisory_date': date})
+
+
+def errata_feed_needs_full_fetch(name, interval):
+    """ Returns True if an errata feed has not been fetched in full within
+        interval, a timedelta
+    """
+    last_full_fetch = ErrataFeed.objects.filter(name=name).values_list('last_full_fetch', flat=True).first()
+    return not last_full_fetch or get_datetime_now() - last_full_fetch >= interval
+
+
+def set_errata_feed_last_full_fetch(name, date):
+    """ Store the date an errata feed was last fetched in full
+    """
+    ErrataFeed.objects.update_or_create(name=name, defaults={'last_full_fetch': date})
+
+
+def mark_errata_security_updates():
+    """ Mark PackageUpdates as security updates where the new package is
+        fixed by, or the old package is affected by, a security erratum.
+        Updates that would duplicate an existing security update are
+        removed instead.
+    """
+    security_errata = Erratum.objects.filter(e_type='security')
+    fixed = Erratum.fixed_packages.through.objects.filter(erratum__in=security_errata).values('package_id')
+    affected = Erratum.affected_packages.through.objects.filter(erratum__in=security_errata).values('package_id')
+    updates = PackageUpdate.objects.filter(
+        Q(newpackage__in=fixed) | Q(oldpackage__in=affected),
+        security=False,
+    )
+    duplicates = PackageUpdate.objects.filter(
+        oldpackage=OuterRef('oldpackage'),
+        newpackage=OuterRef('newpackage'),
+        security=True,
+    )
+    with transaction.atomic():
+        updates.filter(Exists(duplicates)).delete()
+        marked = updates.update(security=True)
+    info_message(text=f'Marked {marked} Updates as security updates')
 
 
 def scan_package_updates_for_affected_packages():
-    """ Scan PackageUpdates for packages affected by errata
+    """ Mark the old packages of PackageUpdates as affected by the errata
+        that fix their new packages
     """
-    plen = PackageUpdate.objects.count()
-    pbar_start.send(sender=None, ptext=f'Scanning {plen} Updates for affected packages', plen=plen)
-    for i, pu in enumerate(PackageUpdate.objects.all()):
-        pbar_update.send(sender=None, index=i + 1)
-        for e in pu.newpackage.provides_fix_in_erratum.all():
-            e.affected_packages.add(pu.oldpackage)
+    fixed_table = Erratum.fixed_packages.through._meta.db_table
+    affected_table = Erratum.affected_packages.through._meta.db_table
+    update_table = PackageUpdate._meta.db_table
+    query = (
+        f'FROM {update_table} pu '
+        f'INNER JOIN {fixed_table} f ON f.package_id = pu.newpackage_id '
+        f'WHERE NOT EXISTS (SELECT 1 FROM {affected_table} a '
+        f'WHERE a.erratum_id = f.erratum_id AND a.package_id = pu.oldpackage_id)'
+    )
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT DISTINCT f.erratum_id {query}')
+            erratum_ids = [row[0] for row in cursor.fetchall()]
+            if not erratum_ids:
+                return
+            cursor.execute(f'SELECT DISTINCT pu.oldpackage_id {query}')
+            record_errata_packages(row[0] for row in cursor.fetchall())
+            cursor.execute(
+                f'INSERT INTO {affected_table} (erratum_id, package_id) '
+                f'SELECT DISTINCT f.erratum_id, pu.oldpackage_id {query}'
+            )
+            added = cursor.rowcount
+        # the through table is written to directly, so the m2m_changed
+        # signal that maintains affected_packages_count is not sent
+        update_errata_counts(erratum_ids)
+    info_message(text=f'Added {added} affected Packages to {len(erratum_ids)} Errata')
 
 
 def enrich_errata(concurrent_processing=True, max_workers=25):
@@ -118,6 +303,8 @@ def enrich_errata(concurrent_processing=True, max_workers=25):
         pbar_start.send(sender=None, ptext=f'Parsing osv.dev data for {rlen} Errata', plen=rlen)
         for i, (erratum, osv_data) in enumerate(results):
             erratum.parse_osv_dev_data(osv_data)
+            record_errata_packages(erratum.fixed_packages.values_list('id', flat=True))
+            record_errata_packages(erratum.affected_packages.values_list('id', flat=True))
             pbar_update.send(sender=None, index=i + 1)
 
 
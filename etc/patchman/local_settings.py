@@ -44,6 +44,18 @@ DAYS_WITHOUT_REPORT = 14
 # list of errata sources to update, remove unwanted ones to improve performance
 ERRATA_OS_UPDATES = ['yum', 'rocky', 'alma', 'arch', 'ubuntu', 'debian']
 
+# Number of errata to collect from errata sources before writing them to the database
+ERRATA_BATCH_SIZE = 1000
+
+# Whether to look up the announcement URLs of SUSE advisories, which takes a
+# http request per announcement, the URLs found are cached for a week
+SUSE_ADVISORY_URL_DISCOVERY = True
+
+# The Rocky Linux errata API cannot be filtered by update date, so only the
+# pages with advisories newer than the last run are fetched. Older advisories
+# that have been updated are found by fetching all advisories every this many days
+ROCKY_ERRATA_FULL_FETCH_INTERVAL = 7
+
 # list of Alma Linux releases to update
 ALMA_RELEASES = [8, 9, 10]
 
@@ -53,6 +65,29 @@ DEBIAN_CODENAMES = ['bookworm', 'trixie']
 # list of Ubuntu Linux releases to update
 UBUNTU_CODENAMES = ['jammy', 'noble', 'resolute']
 
+# Directory to cache downloaded repo and errata metadata in, e.g.
+# '/var/cache/patchman', leave empty to disable the metadata cache
+METADATA_CACHE_DIR = ''
+
+# Maximum size of the metadata cache in MB, least recently used files are evicted first
+METADATA_CACHE_MAX_SIZE = 2048
+
+# Repos are refreshed twice as often as their mirrors change, between these
+# intervals in hours. Security repos are refreshed at least daily.
+REPO_REFRESH_MIN_INTERVAL = 1
+REPO_REFRESH_MAX_INTERVAL = 168
+
+# Maximum number of repos, and the total MB that they downloaded last time,
+# to queue for refresh each time refresh_repos runs (0 = no limit)
+REPO_REFRESH_MAX_REPOS = 0
+REPO_REFRESH_BANDWIDTH = 0
+
+# Size in MB above which downloaded metadata is spooled to a temporary file instead of memory
+FETCH_SPOOL_THRESHOLD = 64
+
+# Only use metadata from the metadata cache, do not contact mirrors or errata sources
+METADATA_CACHE_OFFLINE = False
+
 # Whether to run patchman under the gunicorn web server
 RUN_GUNICORN = False
 
@@ -75,9 +110,9 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'reports.tasks.process_reports',
         'schedule': crontab(minute='*/5'),
      },
-    'refresh_repos_daily': {
+    'refresh_due_repos_hourly': {
         'task': 'repos.tasks.refresh_repos',
-        'schedule': crontab(hour=4, minute=00),
+        'schedule': crontab(minute=00),
     },
     'update_errata_cves_cwes_every_12_hours': {
         'task': 'errata.tasks.update_errata_and_cves',
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packages', '0008_package_repos_count'),
+        ('security', '0010_fix_cvss_vector_string_length'),
+        ('hosts', '0012_backfill_cached_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostVulnerability',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cve', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='security.cve')),
+                ('fixed_in_package', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='packages.package')),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='hosts.host')),
+                ('package_name', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='packages.packagename')),
+            ],
+            options={
+                'verbose_name': 'Host Vulnerability',
+                'verbose_name_plural': 'Host Vulnerabilities',
+                'ordering': ['cve_id', 'host_id'],
+                'indexes': [models.Index(fields=['cve', 'host'], name='host_vulnerability_cve_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='hostvulnerability',
+            constraint=models.UniqueConstraint(
+                fields=('host', 'cve', 'package_name', 'fixed_in_package'),
+                name='unique_host_vulnerability',
+            ),
+        ),
+    ]
@@ -32,13 +32,14 @@ from taggit.managers import TaggableManager
 from arch.models import MachineArchitecture
 from domains.models import Domain
 from errata.models import Erratum
-from hosts.utils import update_rdns
+from hosts.utils import update_host_vulnerabilities, update_rdns
 from modules.models import Module
 from operatingsystems.models import OSVariant
-from packages.models import Package, PackageUpdate
+from packages.models import Package, PackageName, PackageUpdate
 from packages.utils import get_or_create_package_update
 from repos.models import Repository
 from repos.utils import find_best_repo
+from security.models import CVE
 from util.logging import info_message
 
 
@@ -222,6 +223,8 @@ class Host(models.Model):
             if erratum.id not in errata_ids:
                 self.errata.remove(erratum)
 
+        update_host_vulnerabilities([self.id])
+
     def find_repo_updates(self, host_packages, repo_packages, errata_ids):
 
         update_ids = set()
@@ -654,3 +657,30 @@ class HostRepo(models.Model):
 
     def __str__(self):
         return f'{self.host}-{self.repo}'
+
+
+class HostVulnerability(models.Model):
+    """ An index of the CVEs that hosts are affected by, with the installed
+        package that is affected and the package that fixes it, if known
+    """
+    host = models.ForeignKey(Host, on_delete=models.CASCADE)
+    cve = models.ForeignKey(CVE, on_delete=models.CASCADE)
+    package_name = models.ForeignKey(PackageName, on_delete=models.CASCADE)
+    fixed_in_package = models.ForeignKey(Package, blank=True, null=True, on_delete=models.CASCADE)
+
+    class Meta:
+        verbose_name = 'Host Vulnerability'
+        verbose_name_plural = 'Host Vulnerabilities'
+        ordering = ['cve_id', 'host_id']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['host', 'cve', 'package_name', 'fixed_in_package'],
+                name='unique_host_vulnerability',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['cve', 'host'], name='host_vulnerability_cve_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.host} - {self.cve} ({self.package_name})'
@@ -17,7 +17,7 @@
 from rest_framework import serializers
 from taggit.serializers import TagListSerializerField
 
-from hosts.models import Host, HostRepo
+from hosts.models import Host, HostRepo, HostVulnerability
 
 
 class HostSerializer(serializers.HyperlinkedModelSerializer):
@@ -43,3 +43,13 @@ class HostRepoSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = HostRepo
         fields = ('host', 'repo', 'enabled', 'priority')
+
+
+class HostVulnerabilitySerializer(serializers.HyperlinkedModelSerializer):
+    hostname = serializers.CharField(source='host.hostname', read_only=True)
+    cve_id = serializers.CharField(source='cve.cve_id', read_only=True)
+    package_name = serializers.CharField(source='package_name.name', read_only=True)
+
+    class Meta:
+        model = HostVulnerability
+        fields = ('id', 'host', 'hostname', 'cve', 'cve_id', 'package_name', 'fixed_in_package')
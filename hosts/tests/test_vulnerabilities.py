@@ -0,0 +1,145 @@
+# Copyright 2026 Marcus Furlong <furlongm@gmail.com>
+#
+# This file is part of Patchman.
+#
+# Patchman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 only.
+#
+# Patchman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchman. If not, see <http://www.gnu.org/licenses/>
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from arch.models import MachineArchitecture, PackageArchitecture
+from domains.models import Domain
+from errata.models import Erratum
+from hosts.models import Host, HostVulnerability
+from hosts.utils import get_hosts_with_packages, update_host_vulnerabilities
+from operatingsystems.models import OSRelease, OSVariant
+from packages.models import Package, PackageName, PackageUpdate
+from security.models import CVE
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class HostVulnerabilityTests(APITestCase):
+    """Tests for the index of hosts affected by CVEs."""
+
+    def setUp(self):
+        """Set up a host with an openssl update fixed by an erratum."""
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        machine_arch = MachineArchitecture.objects.create(name='x86_64')
+        osrelease = OSRelease.objects.create(name='Rocky Linux 9')
+        osvariant = OSVariant.objects.create(name='Rocky Linux 9 x86_64', osrelease=osrelease, arch=machine_arch)
+        self.host = Host.objects.create(
+            hostname='vulnerable.example.com',
+            ipaddress='192.168.1.100',
+            arch=machine_arch,
+            osvariant=osvariant,
+            domain=Domain.objects.create(name='example.com'),
+            kernel='5.14.0-362.el9.x86_64',
+            lastreport=timezone.now(),
+        )
+        arch = PackageArchitecture.objects.create(name='x86_64')
+        self.openssl = PackageName.objects.create(name='openssl')
+        self.old_openssl = Package.objects.create(
+            name=self.openssl, arch=arch, epoch='1', version='3.0.1', release='1.el9', packagetype=Package.RPM,
+        )
+        self.new_openssl = Package.objects.create(
+            name=self.openssl, arch=arch, epoch='1', version='3.0.7', release='1.el9', packagetype=Package.RPM,
+        )
+        self.bash = Package.objects.create(
+            name=PackageName.objects.create(name='bash'), arch=arch,
+            epoch='', version='5.1', release='1.el9', packagetype=Package.RPM,
+        )
+        self.host.packages.add(self.old_openssl, self.bash)
+        self.host.updates.add(PackageUpdate.objects.create(
+            oldpackage=self.old_openssl, newpackage=self.new_openssl, security=True,
+        ))
+        self.cve = CVE.objects.create(cve_id='CVE-2026-0001')
+        self.erratum = Erratum.objects.create(
+            name='RLSA-2026:0001', e_type='security', issue_date=timezone.now(), synopsis='openssl',
+        )
+        self.erratum.cves.add(self.cve)
+        self.erratum.fixed_packages.add(self.new_openssl)
+
+    def test_fixed_packages_are_indexed(self):
+        """Test that hosts with an update fixed by an erratum are affected by its CVEs."""
+        update_host_vulnerabilities()
+        vulnerability = HostVulnerability.objects.get()
+        self.assertEqual(vulnerability.host, self.host)
+        self.assertEqual(vulnerability.cve, self.cve)
+        self.assertEqual(vulnerability.package_name, self.openssl)
+        self.assertEqual(vulnerability.fixed_in_package, self.new_openssl)
+
+    def test_affected_packages_are_indexed(self):
+        """Test that hosts with a package affected by an erratum are affected by its CVEs."""
+        other = Erratum.objects.create(name='RLSA-2026:0002', e_type='security', issue_date=timezone.now())
+        other.cves.add(CVE.objects.create(cve_id='CVE-2026-0002'))
+        other.affected_packages.add(self.bash)
+        self.erratum.affected_packages.add(self.old_openssl)
+        update_host_vulnerabilities([self.host.id])
+        rows = HostVulnerability.objects.values_list('cve__cve_id', 'package_name__name', 'fixed_in_package')
+        self.assertEqual(
+            sorted(rows),
+            [('CVE-2026-0001', 'openssl', self.new_openssl.id), ('CVE-2026-0002', 'bash', None)],
+        )
+
+    def test_index_is_updated_incrementally(self):
+        """Test that rows are only replaced when they change."""
+        update_host_vulnerabilities()
+        row_id = HostVulnerability.objects.get().id
+        update_host_vulnerabilities()
+        self.assertEqual(HostVulnerability.objects.get().id, row_id)
+        self.host.updates.clear()
+        update_host_vulnerabilities()
+        self.assertFalse(HostVulnerability.objects.exists())
+
+    def test_get_hosts_with_packages(self):
+        """Test that hosts are found by their installed packages and updates."""
+        self.assertEqual(get_hosts_with_packages([self.bash.id]), {self.host.id})
+        self.assertEqual(get_hosts_with_packages([self.new_openssl.id]), {self.host.id})
+        self.host.packages.remove(self.bash)
+        self.assertEqual(get_hosts_with_packages([self.bash.id]), set())
+
+    def test_find_updates_updates_index(self):
+        """Test that finding updates for a host updates its index rows."""
+        update_host_vulnerabilities()
+        self.host.find_updates()
+        self.assertFalse(HostVulnerability.objects.exists())
+
+    def test_api_filter_by_cve(self):
+        """Test that the API lists the hosts affected by a CVE."""
+        update_host_vulnerabilities()
+        response = self.client.get('/api/host-vulnerability/', {'cve_id': 'CVE-2026-0001'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['hostname'], 'vulnerable.example.com')
+        self.assertEqual(response.data['results'][0]['package_name'], 'openssl')
+        response = self.client.get('/api/host-vulnerability/', {'cve_id': 'CVE-2026-9999'})
+        self.assertEqual(len(response.data['results']), 0)
+
+    def test_csv_export(self):
+        """Test that the csv export streams one row per affected host."""
+        update_host_vulnerabilities()
+        self.client.force_login(self.user)
+        response = self.client.get('/hosts/vulnerabilities.csv', {'cve_id': 'CVE-2026-0001'})
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(content, [
+            'cve,hostname,package,fixed_in_version,fixed_in_arch',
+            'CVE-2026-0001,vulnerable.example.com,openssl,1:3.0.7-1.el9,x86_64',
+        ])
@@ -18,6 +18,7 @@
 from socket import gaierror, gethostbyaddr, herror
 
 from django.db import IntegrityError, transaction
+from django.db.models import Q
 from taggit.models import Tag
 
 from util import get_datetime_now
@@ -124,6 +125,84 @@ def find_host_updates_homogenous(hosts, verbose=False):
                 info_message(text=f'Added the same updates to {fhost}')
         elif verbose:
             info_message(text='Updates already added in this run')
+    update_host_vulnerabilities(updated_host_ids)
+
+
+def get_hosts_with_packages(package_ids, batch_size=1000):
+    """ Returns the set of ids of hosts that have any of the given packages
+        installed, or that have updates to or from them
+    """
+    from hosts.models import Host
+    package_ids = list(package_ids)
+    host_ids = set()
+    for i in range(0, len(package_ids), batch_size):
+        batch = package_ids[i:i + batch_size]
+        host_ids.update(Host.packages.through.objects.filter(
+            package_id__in=batch).values_list('host_id', flat=True))
+        host_ids.update(Host.updates.through.objects.filter(
+            Q(packageupdate__newpackage_id__in=batch) | Q(packageupdate__oldpackage_id__in=batch),
+        ).values_list('host_id', flat=True))
+    return host_ids
+
+
+def update_host_vulnerabilities(host_ids=None, batch_size=200):
+    """ Update the index of the CVEs that hosts are affected by, for the
+        given hosts or for all hosts. A host is affected by the CVEs of
+        errata that fix an update for one of its packages, or that list one
+        of its packages as affected.
+    """
+    from hosts.models import Host
+    if host_ids is None:
+        host_ids = Host.objects.values_list('id', flat=True)
+    host_ids = list(host_ids)
+    for i in range(0, len(host_ids), batch_size):
+        with transaction.atomic():
+            update_host_vulnerabilities_batch(host_ids[i:i + batch_size])
+
+
+def update_host_vulnerabilities_batch(host_ids):
+    """ Update the CVE index for a batch of hosts, only rows that have
+        changed are deleted or created
+    """
+    from hosts.models import Host, HostVulnerability
+    fixed = Host.updates.through.objects.filter(
+        host_id__in=host_ids,
+        packageupdate__newpackage__provides_fix_in_erratum__cves__isnull=False,
+    ).values_list(
+        'host_id',
+        'packageupdate__newpackage__provides_fix_in_erratum__cves',
+        'packageupdate__oldpackage__name_id',
+        'packageupdate__newpackage_id',
+    ).distinct()
+    affected = Host.packages.through.objects.filter(
+        host_id__in=host_ids,
+        package__affected_by_erratum__cves__isnull=False,
+    ).values_list(
+        'host_id',
+        'package__affected_by_erratum__cves',
+        'package__name_id',
+    ).distinct()
+    rows = set(fixed)
+    fixed_keys = {row[:3] for row in rows}
+    rows.update(key + (None,) for key in affected if key not in fixed_keys)
+
+    existing = set()
+    stale_ids = []
+    for row_id, *row in HostVulnerability.objects.filter(host_id__in=host_ids).values_list(
+            'id', 'host_id', 'cve_id', 'package_name_id', 'fixed_in_package_id'):
+        row = tuple(row)
+        # duplicates are removed too, the unique constraint does not cover
+        # rows without a fixed_in_package as NULLs are distinct
+        if row not in rows or row in existing:
+            stale_ids.append(row_id)
+        existing.add(row)
+    for i in range(0, len(stale_ids), 1000):
+        HostVulnerability.objects.filter(id__in=stale_ids[i:i + 1000]).delete()
+    new_rows = [
+        HostVulnerability(host_id=host_id, cve_id=cve_id, package_name_id=name_id, fixed_in_package_id=package_id)
+        for host_id, cve_id, name_id, package_id in rows if (host_id, cve_id, name_id, package_id) not in existing
+    ]
+    HostVulnerability.objects.bulk_create(new_rows, batch_size=1000, ignore_conflicts=True)
 
 
 def clean_tags():
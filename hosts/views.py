@@ -15,11 +15,13 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
+import csv
 from urllib.parse import parse_qs
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django_filters import rest_framework as filters
@@ -30,8 +32,10 @@ from taggit.models import Tag
 from arch.models import MachineArchitecture
 from domains.models import Domain
 from hosts.forms import EditHostForm
-from hosts.models import Host, HostRepo
-from hosts.serializers import HostRepoSerializer, HostSerializer
+from hosts.models import Host, HostRepo, HostVulnerability
+from hosts.serializers import (
+    HostRepoSerializer, HostSerializer, HostVulnerabilitySerializer,
+)
 from hosts.tables import HostTable
 from hosts.tasks import find_host_updates
 from operatingsystems.models import OSRelease, OSVariant
@@ -279,6 +283,59 @@ def host_bulk_action(request):
     return redirect('hosts:host_list')
 
 
+class CSVBuffer:
+    """ A file-like object that returns what is written to it, for streaming
+        csv rows
+    """
+
+    def write(self, value):
+        return value
+
+
+def filter_host_vulnerabilities(queryset, params):
+    """ Filter HostVulnerabilities by cve_id, hostname or package_name
+    """
+    if params.get('cve_id'):
+        queryset = queryset.filter(cve__cve_id=params['cve_id'])
+    if params.get('hostname'):
+        queryset = queryset.filter(host__hostname=params['hostname'])
+    if params.get('package_name'):
+        queryset = queryset.filter(package_name__name=params['package_name'])
+    return queryset
+
+
+@login_required
+def host_vulnerability_csv(request):
+    """ Export the hosts affected by CVEs as csv, optionally filtered by
+        cve_id, hostname or package_name
+    """
+    vulnerabilities = filter_host_vulnerabilities(HostVulnerability.objects.all(), request.GET)
+    rows = vulnerabilities.values_list(
+        'cve__cve_id',
+        'host__hostname',
+        'package_name__name',
+        'fixed_in_package__epoch',
+        'fixed_in_package__version',
+        'fixed_in_package__release',
+        'fixed_in_package__arch__name',
+    )
+    writer = csv.writer(CSVBuffer())
+
+    def generate_rows():
+        yield writer.writerow(['cve', 'hostname', 'package', 'fixed_in_version', 'fixed_in_arch'])
+        for cve_id, hostname, package_name, epoch, version, release, arch in rows.iterator(chunk_size=5000):
+            fixed_in_version = ''
+            if version:
+                fixed_in_version = f'{epoch}:{version}' if epoch else version
+                if release:
+                    fixed_in_version += f'-{release}'
+            yield writer.writerow([cve_id, hostname, package_name, fixed_in_version, arch or ''])
+
+    response = StreamingHttpResponse(generate_rows(), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="host_vulnerabilities.csv"'
+    return response
+
+
 class HostFilter(filters.FilterSet):
     package_id = filters.NumberFilter(field_name='packages', lookup_expr='exact')
     package_name = filters.CharFilter(field_name='packages__name__name', lookup_expr='exact')
@@ -308,3 +365,22 @@ class HostRepoViewSet(viewsets.ModelViewSet):
     """
     queryset = HostRepo.objects.select_related('host', 'repo').all()
     serializer_class = HostRepoSerializer
+
+
+class HostVulnerabilityFilter(filters.FilterSet):
+    cve_id = filters.CharFilter(field_name='cve__cve_id', lookup_expr='exact')
+    hostname = filters.CharFilter(field_name='host__hostname', lookup_expr='exact')
+    package_name = filters.CharFilter(field_name='package_name__name', lookup_expr='exact')
+
+    class Meta:
+        model = HostVulnerability
+        fields = ['host', 'cve']
+
+
+class HostVulnerabilityViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint that allows the hosts affected by CVEs to be viewed.
+    """
+    queryset = HostVulnerability.objects.select_related('host', 'cve', 'package_name').all()
+    serializer_class = HostVulnerabilitySerializer
+    filterset_class = HostVulnerabilityFilter
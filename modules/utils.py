@@ -52,17 +52,33 @@ def get_matching_modules(name, stream, version, context, arch):
     """ Return modules that match name, stream, version, context, and arch,
         regardless of repo
     """
-    m_arch, c = PackageArchitecture.objects.get_or_create(name=arch)
     modules = Module.objects.filter(
         name=name,
         stream=stream,
         version=version,
         context=context,
-        arch=m_arch,
+        arch__name=arch,
     )
     return modules
 
 
+def get_matching_module_ids(keys):
+    """ Find the ids of modules matching a set of (name, stream, version,
+        context, arch) tuples, regardless of repo. Returns a dict mapping each
+        found tuple to a set of module ids
+    """
+    names = list({key[0] for key in keys})
+    ids = {}
+    for i in range(0, len(names), 1000):
+        modules = Module.objects.filter(name__in=names[i:i + 1000]).values_list(
+            'id', 'name', 'stream', 'version', 'context', 'arch__name')
+        for module_id, name, stream, version, context, arch in modules:
+            key = (name, stream, version, context, arch)
+            if key in keys:
+                ids.setdefault(key, set()).add(module_id)
+    return ids
+
+
 def clean_modules():
     """ Delete modules that have no host or no repo
     """
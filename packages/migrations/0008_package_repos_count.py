@@ -0,0 +1,18 @@
+# Generated by Django 4.2.28 on 2026-10-19 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packages', '0007_alter_package_epoch_alter_package_release_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='package',
+            name='repos_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+    ]
@@ -82,6 +82,8 @@ class Package(models.Model):
     category = models.ForeignKey(PackageCategory, blank=True, null=True, on_delete=models.SET_NULL)
     description = models.TextField(blank=True, null=True)
     url = models.URLField(max_length=255, blank=True, null=True)
+    # Cached count field for query optimization
+    repos_count = models.PositiveIntegerField(default=0, db_index=True)
 
     objects = PackageManager()
 
@@ -204,6 +206,9 @@ class PackageString(models.Model):
         else:
             return f'{self.name}-{epo}{self.version}{rel}-{self.arch}.{self.get_packagetype_display()}'
 
+    def get_packagetype_display(self):
+        return dict(Package.PACKAGE_TYPES).get(self.packagetype, self.packagetype)
+
     def __key(self):
         return (self.name, self.epoch, self.version, self.release, self.arch, self.packagetype, self.category)
 
@@ -28,7 +28,7 @@ class PackageNameSerializer(serializers.HyperlinkedModelSerializer):
 class PackageSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Package
-        fields = ('id', 'name', 'epoch', 'version', 'release', 'arch')
+        fields = ('id', 'name', 'epoch', 'version', 'release', 'arch', 'repos_count')
 
 
 class PackageUpdateSerializer(serializers.HyperlinkedModelSerializer):
@@ -20,7 +20,7 @@ from util.tables import BaseTable
 PACKAGE_NAME_TEMPLATE = '<a href="{{ record.get_absolute_url }}">{{ record }}</a>'
 PACKAGE_REPOS_TEMPLATE = (
     '<a href="{% url \'repos:repo_list\' %}?package_id={{ record.id }}">'
-    'Available from {{ record.repo_count }} Repositories</a>'
+    'Available from {{ record.repos_count }} Repositories</a>'
 )
 PACKAGE_HOSTS_TEMPLATE = (
     '<a href="{% url \'hosts:host_list\' %}?package_id={{ record.id }}">'
@@ -71,7 +71,7 @@ class PackageTable(BaseTable):
     package_repos = tables.TemplateColumn(
         PACKAGE_REPOS_TEMPLATE,
         verbose_name='Repositories',
-        order_by='repo_count',
+        order_by='repos_count',
         attrs={'th': {'class': 'col-sm-auto'}, 'td': {'class': 'col-sm-auto'}},
     )
     package_hosts = tables.TemplateColumn(
@@ -0,0 +1,64 @@
+# Copyright 2026 Marcus Furlong <furlongm@gmail.com>
+#
+# This file is part of Patchman.
+#
+# Patchman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 only.
+#
+# Patchman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchman. If not, see <http://www.gnu.org/licenses/>
+
+from django.test import TestCase, override_settings
+
+from packages.models import Package, PackageString
+from packages.utils import (
+    get_matching_package_ids, get_or_create_package, get_or_create_packages,
+)
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class GetOrCreatePackagesTests(TestCase):
+    """Tests for bulk package resolution."""
+
+    def test_creates_and_reuses_packages(self):
+        """Test that existing packages are reused and missing ones created."""
+        existing = get_or_create_package('bash', '', '5.1.8', '9.el9', 'x86_64', Package.RPM)
+        bash = PackageString(name='Bash', epoch='0', version='5.1.8', release='9.el9', arch='x86_64', packagetype='R')
+        curl = PackageString(name='curl', epoch='', version='7.76.1', release='29.el9', arch='x86_64', packagetype='R')
+        pubkey = PackageString(name='gpg-pubkey', epoch='', version='1', release='1', arch='noarch', packagetype='R')
+        package_ids = get_or_create_packages([bash, curl, pubkey])
+        self.assertEqual(package_ids[bash], existing.id)
+        self.assertNotIn(pubkey, package_ids)
+        curl_package = Package.objects.get(id=package_ids[curl])
+        self.assertEqual(curl_package.name.name, 'curl')
+        self.assertEqual(Package.objects.count(), 2)
+        self.assertEqual(get_or_create_packages([curl]), {curl: curl_package.id})
+
+    def test_gentoo_categories(self):
+        """Test that packages in different categories are kept apart."""
+        a = PackageString(name='foo', epoch='', version='1.0', release='', arch='amd64', packagetype='G',
+                          category='app-misc')
+        b = PackageString(name='foo', epoch='', version='1.0', release='', arch='amd64', packagetype='G',
+                          category='dev-libs')
+        package_ids = get_or_create_packages([a, b])
+        self.assertNotEqual(package_ids[a], package_ids[b])
+        self.assertEqual(Package.objects.get(id=package_ids[b]).category.name, 'dev-libs')
+
+    def test_get_matching_package_ids(self):
+        """Test that packages are matched on everything but the architecture."""
+        amd64 = get_or_create_package('openssl', '', '3.0.2', '0ubuntu1.10', 'amd64', Package.DEB)
+        arm64 = get_or_create_package('openssl', '', '3.0.2', '0ubuntu1.10', 'arm64', Package.DEB)
+        get_or_create_package('openssl', '', '3.0.2', '0ubuntu1.9', 'amd64', Package.DEB)
+        match = ('openssl', '', '3.0.2', '0ubuntu1.10', Package.DEB)
+        missing = ('curl', '', '7.81.0', '1ubuntu1.15', Package.DEB)
+        rpm = ('openssl', '', '3.0.2', '0ubuntu1.10', Package.RPM)
+        self.assertEqual(get_matching_package_ids({match, missing, rpm}), {match: {amd64.id, arm64.id}})
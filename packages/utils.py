@@ -203,6 +203,115 @@ def get_or_create_package(name, epoch, version, release, arch, p_type):
     return package
 
 
+def get_or_create_by_name(model, names):
+    """ Get or create objects of a model with a unique name field in bulk
+        Returns a dict mapping each name to the object id
+    """
+    names = list(set(names))
+    ids = {}
+    for i in range(0, len(names), 1000):
+        ids.update(model.objects.filter(name__in=names[i:i + 1000]).values_list('name', 'id'))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        model.objects.bulk_create([model(name=name) for name in missing], ignore_conflicts=True, batch_size=1000)
+        for i in range(0, len(missing), 1000):
+            ids.update(model.objects.filter(name__in=missing[i:i + 1000]).values_list('name', 'id'))
+    return ids
+
+
+def get_package_ids(keys):
+    """ Find the ids of existing packages matching a set of
+        (name_id, epoch, version, release, arch_id, packagetype, category_id)
+        tuples. Returns a dict mapping each found tuple to the package id
+    """
+    ids = {}
+    name_ids = list({key[0] for key in keys})
+    for i in range(0, len(name_ids), 1000):
+        packages = Package.objects.filter(name_id__in=name_ids[i:i + 1000]).values_list(
+            'id', 'name_id', 'epoch', 'version', 'release', 'arch_id', 'packagetype', 'category_id')
+        for package_id, *key in packages:
+            key = tuple(key)
+            if key in keys:
+                ids.setdefault(key, package_id)
+    return ids
+
+
+def get_matching_package_ids(keys):
+    """ Find the ids of existing packages of any architecture matching a set
+        of (name, epoch, version, release, packagetype) tuples, for packages
+        whose architecture is not known. Returns a dict mapping each found
+        tuple to a set of package ids
+    """
+    names = list({key[0] for key in keys})
+    name_ids = {}
+    for i in range(0, len(names), 1000):
+        name_ids.update(PackageName.objects.filter(name__in=names[i:i + 1000]).values_list('id', 'name'))
+    versions = list({key[2] for key in keys})
+    ids = {}
+    name_id_list = list(name_ids)
+    for i in range(0, len(name_id_list), 500):
+        for j in range(0, len(versions), 500):
+            packages = Package.objects.filter(
+                name_id__in=name_id_list[i:i + 500],
+                version__in=versions[j:j + 500],
+            ).values_list('id', 'name_id', 'epoch', 'version', 'release', 'packagetype')
+            for package_id, name_id, epoch, version, release, packagetype in packages:
+                key = (name_ids[name_id], epoch, version, release, packagetype)
+                if key in keys:
+                    ids.setdefault(key, set()).add(package_id)
+    return ids
+
+
+def get_or_create_packages(strpackages):
+    """ Get or create Packages for PackageStrings in bulk, using a handful of
+        queries rather than several per package. Returns a dict mapping each
+        PackageString to a Package id. The pseudo package gpg-pubkey is skipped
+    """
+    strkeys = {}
+    for strpackage in strpackages:
+        name = strpackage.name.lower()
+        if name == 'gpg-pubkey':
+            continue
+        epoch = strpackage.epoch
+        if epoch in [None, 0, '0']:
+            epoch = ''
+        strkeys[strpackage] = (
+            name, epoch, strpackage.version, strpackage.release,
+            strpackage.arch, strpackage.packagetype, strpackage.category or None,
+        )
+    if not strkeys:
+        return {}
+
+    name_ids = get_or_create_by_name(PackageName, [k[0] for k in strkeys.values()])
+    arch_ids = get_or_create_by_name(PackageArchitecture, [k[4] for k in strkeys.values()])
+    category_ids = get_or_create_by_name(PackageCategory, [k[6] for k in strkeys.values() if k[6]])
+    keys = {}
+    for strpackage, (name, epoch, version, release, arch, packagetype, category) in strkeys.items():
+        keys[strpackage] = (
+            name_ids[name], epoch, version, release,
+            arch_ids[arch], packagetype, category_ids.get(category),
+        )
+
+    wanted = set(keys.values())
+    package_ids = get_package_ids(wanted)
+    missing = wanted.difference(package_ids)
+    if missing:
+        new_packages = []
+        for name_id, epoch, version, release, arch_id, packagetype, category_id in missing:
+            new_packages.append(Package(
+                name_id=name_id,
+                epoch=epoch,
+                version=version,
+                release=release,
+                arch_id=arch_id,
+                packagetype=packagetype,
+                category_id=category_id,
+            ))
+        Package.objects.bulk_create(new_packages, ignore_conflicts=True, batch_size=1000)
+        package_ids.update(get_package_ids(missing))
+    return {s: package_ids[k] for s, k in keys.items() if k in package_ids}
+
+
 def get_or_create_package_update(oldpackage, newpackage, security):
     """ Get or create a PackageUpdate object. Returns the object. Returns None
         if it cannot be created
@@ -58,6 +58,9 @@ def package_list(request):
     if 'mirror_id' in request.GET:
         packages = packages.filter(mirror=request.GET['mirror_id']).distinct()
 
+    if 'repo_id' in request.GET:
+        packages = packages.filter(mirror__repo=request.GET['repo_id']).distinct()
+
     if 'module_id' in request.GET:
         packages = packages.filter(module=request.GET['module_id']).distinct()
 
@@ -85,9 +88,9 @@ def package_list(request):
     if 'available_in_repos' in request.GET:
         available_in_repos = request.GET['available_in_repos'] == 'true'
         if available_in_repos:
-            packages = packages.filter(mirror__isnull=False)
+            packages = packages.filter(repos_count__gt=0)
         else:
-            packages = packages.filter(mirror__isnull=True)
+            packages = packages.filter(repos_count=0)
 
     if 'search' in request.GET:
         terms = request.GET['search'].lower()
@@ -111,7 +114,6 @@ def package_list(request):
 
     packages = packages.annotate(
         host_count=Count('host', distinct=True),
-        repo_count=Count('mirror__repo', distinct=True),
         affected_count=Count('affected_by_erratum', distinct=True),
         fixed_count=Count('provides_fix_in_erratum', distinct=True),
     )
@@ -178,7 +180,6 @@ def package_name_detail(request, packagename):
         'name', 'arch',
     ).filter(name=package.id).annotate(
         host_count=Count('host', distinct=True),
-        repo_count=Count('mirror__repo', distinct=True),
         affected_count=Count('affected_by_erratum', distinct=True),
         fixed_count=Count('provides_fix_in_erratum', distinct=True),
     )
@@ -38,6 +38,7 @@ router.register(r'machine-architecture', arch_views.MachineArchitectureViewSet)
 router.register(r'domain', domain_views.DomainViewSet)
 router.register(r'host', host_views.HostViewSet)
 router.register(r'host-repo', host_views.HostRepoViewSet)
+router.register(r'host-vulnerability', host_views.HostVulnerabilityViewSet)
 router.register(r'os-variant', os_views.OSVariantViewSet)
 router.register(r'os-release', os_views.OSReleaseViewSet)
 router.register(r'package-name', package_views.PackageNameViewSet)
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.28 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repos', '0009_backfill_mirror_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mirror',
+            name='latency',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mirror',
+            name='throughput',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.28 on 2026-10-19 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repos', '0010_mirror_latency_throughput'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mirror',
+            name='last_diff',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.28 on 2026-10-19 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repos', '0011_mirror_last_diff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mirror',
+            name='change_interval',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mirror',
+            name='download_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mirror',
+            name='download_duration',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mirror',
+            name='last_change',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='repository',
+            name='last_refresh',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
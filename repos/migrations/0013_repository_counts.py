@@ -0,0 +1,28 @@
+# Generated by Django 4.2.28 on 2026-10-19 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repos', '0012_mirror_health_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='last_change',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='repository',
+            name='packages_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='repository',
+            name='security_packages_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.28 on 2026-10-19 14:12
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_repository_counts(apps, schema_editor):
+    """Backfill packages counts for existing repositories and packages."""
+    Repository = apps.get_model('repos', 'Repository')
+    MirrorPackage = apps.get_model('repos', 'MirrorPackage')
+    Package = apps.get_model('packages', 'Package')
+    for repo in Repository.objects.all():
+        packages = Package.objects.filter(mirror__repo=repo)
+        repo.packages_count = packages.distinct().count()
+        repo.security_packages_count = packages.filter(
+            provides_fix_in_erratum__e_type='security').distinct().count()
+        repo.save(update_fields=['packages_count', 'security_packages_count'])
+    repos_count = MirrorPackage.objects.filter(package=OuterRef('pk')).order_by().values(
+        'package').annotate(count=Count('mirror__repo', distinct=True)).values('count')
+    Package.objects.filter(mirror__isnull=False).update(repos_count=Coalesce(Subquery(repos_count), 0))
+
+
+def reverse_backfill(apps, schema_editor):
+    """No-op reverse."""
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repos', '0013_repository_counts'),
+        ('packages', '0008_package_repos_count'),
+        ('errata', '0009_backfill_cached_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_repository_counts, reverse_backfill),
+    ]
@@ -17,6 +17,7 @@
 
 from django.db import models
 from django.urls import reverse
+from django.utils import timezone
 
 from arch.models import MachineArchitecture
 from packages.models import Package
@@ -49,6 +50,12 @@ class Repository(models.Model):
     enabled = models.BooleanField(default=True)
     repo_id = models.CharField(max_length=255, null=True, blank=True)
     auth_required = models.BooleanField(default=False)
+    last_refresh = models.DateTimeField(blank=True, null=True)
+    # Cached count fields for query optimization, and the time of the last
+    # refresh that changed the packages in the repo
+    packages_count = models.PositiveIntegerField(default=0, db_index=True)
+    security_packages_count = models.PositiveIntegerField(default=0)
+    last_change = models.DateTimeField(blank=True, null=True)
 
     from repos.managers import RepositoryManager
     objects = RepositoryManager()
@@ -77,32 +84,85 @@ class Repository(models.Model):
         for mirror in self.mirror_set.all():
             mirror.show()
 
-    def refresh(self, force=False):
+    def refresh(self, force=False, dry_run=False, full_diff=False):
         """ Refresh all of a repos mirror metadata,
             force can be set to force a reset of all the mirrors metadata
+            dry_run can be set to fetch and parse the metadata and compute the
+            changes, without writing anything to the database
+            Returns a summary of the packages added and removed per mirror,
+            including the packages themselves if full_diff is set
         """
-        if force:
-            self.mirror_set.all().update(
-                packages_checksum=None,
-                modules_checksum=None,
-                errata_checksum=None
-            )
+        started = timezone.now()
+        diffs = self._refresh(force, dry_run, full_diff)
+        summary = self.get_refresh_summary(diffs, full_diff)
+        summary['dry_run'] = dry_run
+        if not dry_run:
+            self.last_refresh = started
+            self.save(update_fields=['last_refresh'])
+        return summary
+
+    def get_refresh_summary(self, diffs, full_diff=False):
+        """ Summarise the packages added and removed on each mirror, from a
+            dict mapping mirror ids to the changes returned by a refresh
+        """
+        summary = {
+            'repo': self.id,
+            'name': self.name,
+            'dry_run': False,
+            'added': 0,
+            'removed': 0,
+            'mirrors': [],
+        }
+        mirrors = {mirror.id: mirror for mirror in self.mirror_set.all()}
+        for mirror_id, diff in sorted(diffs.items()):
+            mirror_summary = {
+                'mirror': mirror_id,
+                'url': mirrors[mirror_id].url,
+                'added': diff.get('added'),
+                'removed': diff.get('removed'),
+                'packages': diff.get('packages'),
+            }
+            if full_diff:
+                for key in ['added', 'removed']:
+                    packages = Package.objects.filter(id__in=diff.get(f'{key}_ids')).select_related(
+                        'name', 'arch', 'category')
+                    mirror_summary[f'{key}_packages'] = sorted(str(p) for p in packages)
+                mirror_summary['added_packages'] = sorted(mirror_summary['added_packages'] + diff.get('added_packages'))
+            summary['added'] += diff.get('added')
+            summary['removed'] += diff.get('removed')
+            summary['mirrors'].append(mirror_summary)
+        return summary
+
+    def _refresh(self, force=False, dry_run=False, full_diff=False):
+        """ Refresh all of a repos mirror metadata
+            Dry runs compare against the stored checksums, so force is ignored
+            Returns a dict mapping mirror ids to the changes to their packages
+        """
+        if not dry_run:
+            if force:
+                self.mirror_set.all().update(
+                    packages_checksum=None,
+                    modules_checksum=None,
+                    errata_checksum=None
+                )
+            self.mirror_set.all().update(download_bytes=0, download_duration=0)
 
         if not self.auth_required:
             if self.repotype == Repository.DEB:
-                refresh_deb_repo(self)
+                return refresh_deb_repo(self, dry_run, full_diff)
             elif self.repotype == Repository.RPM:
-                refresh_rpm_repo(self)
+                return refresh_rpm_repo(self, dry_run, full_diff)
             elif self.repotype == Repository.ARCH:
-                refresh_arch_repo(self)
+                return refresh_arch_repo(self, dry_run, full_diff)
             elif self.repotype == Repository.GENTOO:
-                refresh_gentoo_repo(self)
+                return refresh_gentoo_repo(self, dry_run, full_diff)
             else:
                 text = f'Error: unknown repo type for repo {self.id}: {self.repotype}'
                 error_message(text=text)
         else:
             text = 'Repo requires authentication, not updating'
             warning_message(text=text)
+        return {}
 
     def refresh_errata(self, force=False):
         """ Refresh errata metadata for all of a repos mirrors
@@ -145,6 +205,18 @@ class Mirror(models.Model):
     fail_count = models.IntegerField(default=0)
     # Cached count field for query optimization
     packages_count = models.PositiveIntegerField(default=0, db_index=True)
+    # seconds taken to respond to a probe, and bytes per second downloaded
+    latency = models.FloatField(blank=True, null=True)
+    throughput = models.FloatField(blank=True, null=True)
+    # packages added and removed by the last refresh that changed packages
+    last_diff = models.JSONField(blank=True, null=True)
+    # time of the last refresh that changed packages, and the average
+    # number of seconds between changes
+    last_change = models.DateTimeField(blank=True, null=True)
+    change_interval = models.FloatField(blank=True, null=True)
+    # bytes downloaded and seconds spent downloading by the last refresh
+    download_bytes = models.BigIntegerField(default=0)
+    download_duration = models.FloatField(default=0)
 
     class Meta:
         verbose_name_plural = 'Mirror'
@@ -14,27 +14,32 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
+import re
 import tarfile
-from io import BytesIO
 
 from packages.models import PackageString
-from patchman.signals import pbar_start, pbar_update
 from repos.utils import (
-    fetch_mirror_data, find_mirror_url, get_max_mirrors,
-    update_mirror_packages,
+    copy_mirror_packages, fetch_mirror_data, find_mirror_url, get_max_mirrors,
+    order_mirrors_by_speed, update_mirror_packages,
 )
-from util import Checksum, get_checksum, get_datetime_now
-from util.logging import info_message, warning_message
+from util import Checksum, get_checksum, get_datetime_now, open_extracted
+from util.logging import error_message, info_message, warning_message
 
+ARCH_NAME_RE = re.compile(rb'^%NAME%\n([^\n]+)', re.M)
+ARCH_VERSION_RE = re.compile(rb'^%VERSION%\n([^\n]+)', re.M)
+ARCH_ARCH_RE = re.compile(rb'^%ARCH%\n([^\n]+)', re.M)
 
-def refresh_arch_repo(repo):
+
+def refresh_arch_repo(repo, dry_run=False, full_diff=False):
     """ Refresh all mirrors of an arch linux repo
+        Returns a dict mapping mirror ids to the changes to their packages
     """
     max_mirrors = get_max_mirrors()
     fname = f'{repo.arch}/{repo.repo_id}.db'
     ts = get_datetime_now()
+    diffs = {}
 
-    enabled_mirrors = repo.mirror_set.filter(refresh=True, enabled=True)
+    enabled_mirrors = order_mirrors_by_speed(repo.mirror_set.filter(refresh=True, enabled=True))
     for i, mirror in enumerate(enabled_mirrors):
         if i >= max_mirrors:
             text = f'{max_mirrors} Mirrors already refreshed (max={max_mirrors}), skipping further refreshes'
@@ -51,7 +56,8 @@ def refresh_arch_repo(repo):
         package_data = fetch_mirror_data(
             mirror=mirror,
             url=mirror_url,
-            text='Fetching Arch Repo data')
+            text='Fetching Arch Repo data',
+            dry_run=dry_run)
         if not package_data:
             continue
 
@@ -60,60 +66,61 @@ def refresh_arch_repo(repo):
             text = 'Mirror checksum has not changed, not refreshing Package metadata'
             warning_message(text=text)
             continue
-        else:
-            mirror.packages_checksum = computed_checksum
+        diff = copy_mirror_packages(mirror, computed_checksum, dry_run, full_diff)
+        if diff:
+            diffs[mirror.id] = diff
+            continue
+        mirror.packages_checksum = computed_checksum
 
         packages = extract_arch_packages(package_data)
-        update_mirror_packages(mirror, packages)
+        diffs[mirror.id] = update_mirror_packages(mirror, packages, dry_run, full_diff)
         packages.clear()
-        mirror.timestamp = ts
-        mirror.save()
+        if not dry_run:
+            mirror.timestamp = ts
+            mirror.save()
+    return diffs
 
 
 def extract_arch_packages(data):
     """ Extract package metadata from an arch linux tarfile
     """
-    from packages.utils import find_evr
-    bio = BytesIO(data)
-    tf = tarfile.open(fileobj=bio, mode='r:*')
     packages = set()
-    plen = len(tf.getnames())
+    for name, epoch, version, release, arch in iter_arch_packages(data):
+        package = PackageString(name=name.lower(),
+                                epoch=epoch,
+                                version=version,
+                                release=release,
+                                arch=arch,
+                                packagetype='A')
+        packages.add(package)
+    plen = len(packages)
     if plen > 0:
-        pbar_start.send(sender=None, ptext=f'Extracting {plen} Packages', plen=plen)
-        for i, tarinfo in enumerate(tf):
-            pbar_update.send(sender=None, index=i + 1)
-            if tarinfo.isfile():
-                name_sec = ver_sec = arch_sec = False
-                t = tf.extractfile(tarinfo).read()
-                for line in t.decode('utf-8').splitlines():
-                    if line.startswith('%NAME%'):
-                        name_sec = True
-                        continue
-                    if name_sec:
-                        name_sec = False
-                        name = line
-                        continue
-                    if line.startswith('%VERSION%'):
-                        ver_sec = True
-                        continue
-                    if ver_sec:
-                        ver_sec = False
-                        epoch, version, release = find_evr(line)
-                        continue
-                    if line.startswith('%ARCH%'):
-                        arch_sec = True
-                        continue
-                    if arch_sec:
-                        arch_sec = False
-                        arch = line
-                        continue
-                package = PackageString(name=name.lower(),
-                                        epoch=epoch,
-                                        version=version,
-                                        release=release,
-                                        arch=arch,
-                                        packagetype='A')
-                packages.add(package)
+        info_message(text=f'Extracted {plen} Packages')
     else:
         info_message(text='No Packages found in Repo')
     return packages
+
+
+def iter_arch_packages(data):
+    """ Read an arch linux tarfile in a single streaming pass and yield
+        (name, epoch, version, release, arch) tuples from each desc file.
+        The data is decompressed while it is read, so SpooledContent is
+        streamed from its mmap rather than copied into memory.
+    """
+    from packages.utils import find_evr
+    try:
+        with open_extracted(data) as reader, tarfile.open(fileobj=reader, mode='r|') as tf:
+            for tarinfo in tf:
+                if not tarinfo.isfile() or not tarinfo.name.endswith('desc'):
+                    continue
+                desc = tf.extractfile(tarinfo).read()
+                name = ARCH_NAME_RE.search(desc)
+                version = ARCH_VERSION_RE.search(desc)
+                arch = ARCH_ARCH_RE.search(desc)
+                if not (name and version and arch):
+                    error_message(text=f'Error parsing Arch Package metadata: {tarinfo.name}')
+                    continue
+                epoch, version, release = find_evr(version.group(1).decode())
+                yield name.group(1).decode(), epoch, version, release, arch.group(1).decode()
+    except tarfile.TarError as e:
+        error_message(text=f'Error reading Arch Repo data: {e}')
@@ -14,105 +14,284 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
-import re
+import codecs
 
-from debian.deb822 import Packages
+from debian.deb822 import Packages, Release
 from debian.debian_support import Version
+from tenacity import RetryError
 
 from packages.models import PackageString
-from patchman.signals import pbar_start, pbar_update
 from repos.utils import (
-    fetch_mirror_data, find_mirror_url, update_mirror_packages,
+    PARSE_CHUNK_SIZE, PARSE_READ_SIZE, copy_mirror_packages, fail_mirror,
+    fetch_mirror_data, find_mirror_url, parse_concurrently,
+    update_mirror_packages,
 )
-from util import Checksum, extract, get_checksum, get_datetime_now
-from util.logging import error_message, info_message, warning_message
+from util import (
+    Checksum, ChecksumReader, fetch_content, get_datetime_now, get_url,
+    open_extracted, response_is_valid,
+)
+from util.logging import (
+    debug_message, error_message, info_message, warning_message,
+)
+
+DEB_PACKAGES_FORMATS = [
+    'Packages.xz',
+    'Packages.bz2',
+    'Packages.gz',
+    'Packages',
+]
 
 
 def extract_deb_packages(data, url):
     """ Extract package metadata from debian Packages file
+        The file is split on stanza boundaries as it is decompressed, and
+        the chunks are parsed concurrently
     """
+    packages = set()
     try:
-        extracted = extract(data, url).decode('utf-8')
+        with open_extracted(data, url) as reader:
+            for result in parse_concurrently(extract_deb_packages_chunk, split_deb_stanzas(reader)):
+                for name, epoch, version, release, arch in result:
+                    package = PackageString(name=name,
+                                            epoch=epoch,
+                                            version=version,
+                                            release=release,
+                                            arch=arch,
+                                            packagetype='D')
+                    packages.add(package)
     except UnicodeDecodeError as e:
         error_message(text=f'Skipping {url} : {e}')
         return
-    package_re = re.compile('^Package: ', re.M)
-    plen = len(package_re.findall(extracted))
-    packages = set()
-
+    plen = len(packages)
     if plen > 0:
-        pbar_start.send(sender=None, ptext=f'Extracting {plen} Packages', plen=plen)
-        for i, stanza in enumerate(Packages.iter_paragraphs(extracted)):
-            # https://github.com/furlongm/patchman/issues/55
-            if 'version' not in stanza:
-                continue
-            fullversion = Version(stanza['version'])
-            arch = stanza['architecture']
-            name = stanza['package']
-            epoch = fullversion._BaseVersion__epoch
-            if epoch is None:
-                epoch = ''
-            version = fullversion._BaseVersion__upstream_version
-            release = fullversion._BaseVersion__debian_revision
-            if release is None:
-                release = ''
-            pbar_update.send(sender=None, index=i + 1)
-            package = PackageString(name=name,
-                                    epoch=epoch,
-                                    version=version,
-                                    release=release,
-                                    arch=arch,
-                                    packagetype='D')
-            packages.add(package)
+        info_message(text=f'Extracted {plen} Packages')
     else:
         info_message(text='No packages found in repo')
     return packages
 
 
-def refresh_deb_repo(repo):
-    """ Refresh a debian repo.
-        Checks for the Packages* files to determine what the mirror urls
-        are and then fetches and extracts packages from those files.
+def split_deb_stanzas(reader, chunk_size=PARSE_CHUNK_SIZE):
+    """ Split a Packages file into chunks of roughly chunk_size characters
+        as it is read from reader, only splitting between stanzas
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    data = True
+    while data:
+        data = reader.read(PARSE_READ_SIZE)
+        buf += decoder.decode(data, final=not data)
+        split = buf.find('\n\n', chunk_size)
+        while split != -1:
+            yield buf[:split + 2]
+            buf = buf[split + 2:]
+            split = buf.find('\n\n', chunk_size)
+    if buf:
+        yield buf
+
+
+def extract_deb_packages_chunk(chunk):
+    """ Extract package metadata from a chunk of a Packages file
+        Returns a list of (name, epoch, version, release, arch) tuples
+    """
+    packages = []
+    for stanza in Packages.iter_paragraphs(chunk):
+        # https://github.com/furlongm/patchman/issues/55
+        if 'version' not in stanza:
+            continue
+        fullversion = Version(stanza['version'])
+        epoch = fullversion._BaseVersion__epoch
+        if epoch is None:
+            epoch = ''
+        version = fullversion._BaseVersion__upstream_version
+        release = fullversion._BaseVersion__debian_revision
+        if release is None:
+            release = ''
+        packages.append((stanza['package'], epoch, version, release, stanza['architecture']))
+    return packages
+
+
+def get_deb_release_location(mirror_url):
+    """ Split a deb mirror url into the url of the directory containing the
+        Release file and the path of the Packages index relative to it.
+        e.g. http://deb.debian.org/debian/dists/trixie/main/binary-amd64 ->
+             (http://deb.debian.org/debian/dists/trixie, main/binary-amd64)
+        Flat repos have their Release file next to the Packages file.
+    """
+    mirror_url = mirror_url.rstrip('/')
+    for fmt in DEB_PACKAGES_FORMATS:
+        if mirror_url.endswith(f'/{fmt}'):
+            mirror_url = mirror_url[:-len(fmt) - 1]
+            break
+    if '/dists/' in mirror_url:
+        base_url, _, dist_path = mirror_url.partition('/dists/')
+        parts = dist_path.split('/', 1)
+        release_url = f'{base_url}/dists/{parts[0]}'
+        index_path = parts[1] if len(parts) > 1 else ''
+        return release_url, index_path
+    return mirror_url, ''
+
+
+def fetch_deb_release(release_url):
+    """ Fetch the InRelease file for a deb repo, falling back to Release.
+        Returns the parsed Release or None if neither could be fetched.
     """
+    for fname in ['InRelease', 'Release']:
+        url = f'{release_url}/{fname}'
+        debug_message(text=f'Checking for Release file at {url}')
+        try:
+            res = get_url(url)
+        except RetryError:
+            continue
+        if not response_is_valid(res):
+            continue
+        data = fetch_content(res, f'Fetching deb {fname} data')
+        if not data:
+            continue
+        try:
+            return Release(data.decode('utf-8'))
+        except UnicodeDecodeError as e:
+            error_message(text=f'Error parsing {url}: {e}')
 
-    formats = [
-        'Packages.xz',
-        'Packages.bz2',
-        'Packages.gz',
-        'Packages',
-    ]
 
+def find_deb_packages_index(release, index_path):
+    """ Find the best available Packages index listed in a Release file.
+        Returns a dict with the url path, sha256 and size of the index
+        to download, and the sha256 of the uncompressed Packages file if
+        it is listed, or None if no Packages index is listed.
+    """
+    entries = {}
+    for entry in release.get('SHA256', []):
+        entries[entry.get('name')] = entry
+    prefix = f'{index_path}/' if index_path else ''
+    index = None
+    for fmt in DEB_PACKAGES_FORMATS:
+        entry = entries.get(f'{prefix}{fmt}')
+        if entry and int(entry.get('size', 0)) > 0:
+            index = {
+                'path': entry.get('name'),
+                'sha256': entry.get('sha256'),
+                'size': int(entry.get('size')),
+            }
+            break
+    if not index:
+        return
+    uncompressed = entries.get(f'{prefix}Packages')
+    if uncompressed:
+        index['checksum'] = uncompressed.get('sha256')
+    else:
+        index['checksum'] = index.get('sha256')
+    return index
+
+
+def fetch_deb_packages_index(mirror, dry_run=False, full_diff=False):
+    """ Use the InRelease/Release file of a mirror to find its Packages index.
+        Returns a tuple of (url, data, diff) where data is None if the index
+        has not changed since the last refresh or if the packages were copied
+        from another mirror, in which case diff holds the changes.
+        Returns None if there is no usable Release.
+    """
+    release_url, index_path = get_deb_release_location(mirror.url)
+    release = fetch_deb_release(release_url)
+    if not release:
+        return
+    index = find_deb_packages_index(release, index_path)
+    if not index:
+        debug_message(text=f'No Packages index for {index_path} in {release_url}')
+        return
+    mirror_url = f"{release_url}/{index.get('path')}"
+    info_message(text=f'Found deb Repo - {mirror_url}')
+
+    if mirror.packages_checksum == index.get('checksum'):
+        text = 'Mirror checksum has not changed, not refreshing Package metadata'
+        warning_message(text=text)
+        return mirror_url, None, None
+
+    diff = copy_mirror_packages(mirror, index.get('checksum'), dry_run, full_diff)
+    if diff:
+        return mirror_url, None, diff
+
+    package_data = fetch_mirror_data(
+        mirror=mirror,
+        url=mirror_url,
+        text='Fetching Debian Repo data',
+        checksum=index.get('sha256'),
+        checksum_type='sha256',
+        metadata_type='package',
+        dry_run=dry_run)
+    if package_data:
+        mirror.packages_checksum = index.get('checksum')
+    return mirror_url, package_data, None
+
+
+def probe_deb_packages_index(mirror, dry_run=False, full_diff=False):
+    """ Find the Packages index of a mirror that has no usable Release file
+        by probing for each supported format. The probe response is reused
+        so the index is only downloaded once.
+        Returns a tuple of (url, data, diff), see fetch_deb_packages_index,
+        or None if no index was found.
+    """
+    res = find_mirror_url(mirror.url, DEB_PACKAGES_FORMATS)
+    if not res:
+        return
+    mirror_url = res.url
+    info_message(text=f'Found deb Repo - {mirror_url}')
+    mirror.last_access_ok = True
+    package_data = fetch_content(res, 'Fetching Debian Repo data')
+    if not package_data:
+        fail_mirror(mirror, dry_run)
+        return
+
+    computed_checksum = get_deb_packages_checksum(package_data, mirror_url)
+    if mirror.packages_checksum == computed_checksum:
+        text = 'Mirror checksum has not changed, not refreshing Package metadata'
+        warning_message(text=text)
+        return mirror_url, None, None
+    diff = copy_mirror_packages(mirror, computed_checksum, dry_run, full_diff)
+    if diff:
+        return mirror_url, None, diff
+    mirror.packages_checksum = computed_checksum
+    return mirror_url, package_data, None
+
+
+def get_deb_packages_checksum(data, url):
+    """ Returns the sha256 of an uncompressed Packages file, which is the
+        checksum that is stored for mirrors with a Release file, regardless
+        of the compression format of the downloaded index
+    """
+    with open_extracted(data, url) as extracted:
+        return ChecksumReader(extracted, Checksum.sha256).hexdigest()
+
+
+def refresh_deb_repo(repo, dry_run=False, full_diff=False):
+    """ Refresh a debian repo.
+        Reads the InRelease/Release file to find the best available Packages
+        index and its checksum, so unchanged indexes are not downloaded.
+        Falls back to probing for the Packages* files if there is no Release.
+        Returns a dict mapping mirror ids to the changes to their packages
+    """
     ts = get_datetime_now()
+    diffs = {}
     enabled_mirrors = repo.mirror_set.filter(refresh=True, enabled=True)
     for mirror in enabled_mirrors:
-        res = find_mirror_url(mirror.url, formats)
-        if not res:
+        result = fetch_deb_packages_index(mirror, dry_run, full_diff)
+        if result is None:
+            result = probe_deb_packages_index(mirror, dry_run, full_diff)
+        if result is None:
             continue
-        mirror_url = res.url
-        text = f'Found deb Repo - {mirror_url}'
-        info_message(text=text)
-
-        package_data = fetch_mirror_data(
-            mirror=mirror,
-            url=mirror_url,
-            text='Fetching Debian Repo data')
+        mirror_url, package_data, diff = result
+        if diff:
+            diffs[mirror.id] = diff
         if not package_data:
             continue
 
-        computed_checksum = get_checksum(package_data, Checksum.sha1)
-        if mirror.packages_checksum == computed_checksum:
-            text = 'Mirror checksum has not changed, not refreshing Package metadata'
-            warning_message(text=text)
-            continue
-        else:
-            mirror.packages_checksum = computed_checksum
-
         packages = extract_deb_packages(package_data, mirror_url)
         if not packages:
-            mirror.fail()
+            fail_mirror(mirror, dry_run)
             continue
 
-        update_mirror_packages(mirror, packages)
+        diffs[mirror.id] = update_mirror_packages(mirror, packages, dry_run, full_diff)
         packages.clear()
-        mirror.timestamp = ts
-        mirror.save()
+        if not dry_run:
+            mirror.timestamp = ts
+            mirror.save()
+    return diffs
@@ -14,7 +14,9 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
+import lzma
 import os
+import re
 import shutil
 import tarfile
 import tempfile
@@ -24,41 +26,58 @@ from pathlib import Path
 
 import git
 from defusedxml import ElementTree
+from django.core.cache import cache
+from urllib3.exceptions import HTTPError
 
 from packages.models import PackageString
-from packages.utils import find_evr
+from packages.utils import convert_package_to_packagestring, find_evr
 from patchman.signals import pbar_start, pbar_update
 from repos.utils import (
-    add_mirrors_from_urls, mirror_checksum_is_valid, update_mirror_packages,
+    add_mirrors_from_urls, copy_mirror_packages, fail_mirror,
+    mirror_checksum_is_valid, order_mirrors_by_speed, update_mirror_packages,
 )
 from util import (
-    Checksum, extract, fetch_content, get_checksum, get_datetime_now, get_url,
-    response_is_valid,
+    Checksum, ChecksumReader, fetch_content, get_datetime_now, get_sha256,
+    get_url, response_is_valid,
 )
-from util.logging import error_message, info_message, warning_message
+from util.cache import get_cache_dir
+from util.logging import (
+    debug_message, error_message, info_message, warning_message,
+)
+
+GENTOO_KEYWORDS_RE = re.compile(rb'^KEYWORDS=.*$', re.M)
 
+# the Manifest checksums of a snapshot are kept for twice the longest repo
+# refresh interval, if they expire the next refresh parses every category
+GENTOO_MANIFESTS_CACHE_TIMEOUT = 60 * 60 * 24 * 14
 
-def refresh_gentoo_main_repo(repo):
+
+def refresh_gentoo_main_repo(repo, dry_run=False, full_diff=False):
     """ Refresh all mirrors of the main gentoo repo
+        Dry runs only use the existing mirrors
+        Returns a dict mapping mirror ids to the changes to their packages
     """
-    mirrors = get_gentoo_mirror_urls()
-    add_mirrors_from_urls(repo, mirrors)
+    if not dry_run:
+        mirrors = get_gentoo_mirror_urls()
+        add_mirrors_from_urls(repo, mirrors, probe_path='')
     ts = get_datetime_now()
-    for mirror in repo.mirror_set.filter(mirrorlist=False, refresh=True, enabled=True):
+    diffs = {}
+    for mirror in order_mirrors_by_speed(repo.mirror_set.filter(mirrorlist=False, refresh=True, enabled=True)):
         if mirror.url == 'https://api.gentoo.org/mirrors/distfiles.xml':
-            mirror.mirrorlist = True
-            mirror.save()
+            if not dry_run:
+                mirror.mirrorlist = True
+                mirror.save()
             continue
 
         res = get_url(mirror.url + '.md5sum')
         data = fetch_content(res, 'Fetching Gentoo Repo checksum')
         if data is None:
-            mirror.fail()
+            fail_mirror(mirror, dry_run)
             continue
 
         checksum = data.decode().split()[0]
         if checksum is None:
-            mirror.fail()
+            fail_mirror(mirror, dry_run)
             continue
 
         if mirror.packages_checksum == checksum:
@@ -66,47 +85,88 @@ def refresh_gentoo_main_repo(repo):
             warning_message(text=text)
             continue
 
+        diff = copy_mirror_packages(mirror, checksum, dry_run, full_diff)
+        if diff:
+            diffs[mirror.id] = diff
+            continue
+
         res = get_url(mirror.url)
         mirror.last_access_ok = response_is_valid(res)
         if not mirror.last_access_ok:
-            mirror.fail()
-            continue
-
-        data = fetch_content(res, 'Fetching Gentoo Repo data')
-        if data is None:
-            mirror.fail()
+            fail_mirror(mirror, dry_run)
             continue
-        extracted = extract(data, mirror.url)
         info_message(text=f'Found Gentoo Repo - {mirror.url}')
 
-        computed_checksum = get_checksum(data, Checksum.md5)
-        if not mirror_checksum_is_valid(computed_checksum, checksum, mirror, 'package'):
-            mirror.fail()
+        result = extract_gentoo_snapshot_packages(mirror, res, checksum, dry_run)
+        if result is None:
+            fail_mirror(mirror, dry_run)
             continue
-        else:
-            mirror.packages_checksum = checksum
-
-        packages = extract_gentoo_packages(mirror, extracted)
+        packages, manifests = result
         if packages:
-            update_mirror_packages(mirror, packages)
+            diffs[mirror.id] = update_mirror_packages(mirror, packages, dry_run, full_diff)
+        if dry_run:
+            continue
+        mirror.packages_checksum = checksum
+        cache.set(f'gentoo_manifests_{mirror.id}', {'checksum': checksum, 'manifests': manifests},
+                  GENTOO_MANIFESTS_CACHE_TIMEOUT)
 
         mirror.timestamp = ts
         mirror.save()
+    return diffs
 
 
-def refresh_gentoo_overlay_repo(repo):
+def refresh_gentoo_overlay_repo(repo, dry_run=False, full_diff=False):
     """ Refresh all mirrors of a Gentoo overlay repo
+        Dry runs only use the existing mirrors
+        Overlays are only refreshed incrementally if METADATA_CACHE_DIR is
+        set, see extract_gentoo_overlay_packages
+        Returns a dict mapping mirror ids to the changes to their packages
     """
-    mirrors = get_gentoo_overlay_mirrors(repo.repo_id)
-    add_mirrors_from_urls(repo, mirrors)
+    if not dry_run:
+        mirrors = get_gentoo_overlay_mirrors(repo.repo_id)
+        add_mirrors_from_urls(repo, mirrors)
     ts = get_datetime_now()
+    diffs = {}
     for mirror in repo.mirror_set.filter(mirrorlist=False, refresh=True, enabled=True):
-        # FIXME: need to check for failure
-        packages = extract_gentoo_overlay_packages(mirror)
+        head = get_gentoo_overlay_head(mirror.url)
+        if head is None:
+            fail_mirror(mirror, dry_run)
+            continue
+        mirror.last_access_ok = True
+
+        if mirror.packages_checksum == head:
+            text = 'Mirror checksum has not changed, not refreshing Package metadata'
+            warning_message(text=text)
+            if not dry_run:
+                mirror.save()
+            continue
+
+        packages = extract_gentoo_overlay_packages(mirror, head, dry_run)
+        if packages is None:
+            fail_mirror(mirror, dry_run)
+            continue
         if packages:
-            update_mirror_packages(mirror, packages)
+            diffs[mirror.id] = update_mirror_packages(mirror, packages, dry_run, full_diff)
+        if dry_run:
+            continue
+        mirror.packages_checksum = head
         mirror.timestamp = ts
         mirror.save()
+    return diffs
+
+
+def get_gentoo_overlay_head(url):
+    """ Get the commit id of HEAD of a Gentoo overlay git repo without cloning it
+    """
+    try:
+        output = git.cmd.Git().ls_remote(url, 'HEAD')
+    except git.GitCommandError as e:
+        error_message(text=f'Error checking Gentoo overlay {url}: {e}')
+        return
+    if not output:
+        error_message(text=f'No HEAD found for Gentoo overlay {url}')
+        return
+    return output.split()[0]
 
 
 def get_gentoo_ebuild_keywords(content):
@@ -129,9 +189,9 @@ def get_gentoo_ebuild_keywords(content):
         'sparc',
         'x86',
     }
-    for line in content.decode().splitlines():
-        if not line.startswith('KEYWORDS='):
-            continue
+    match = GENTOO_KEYWORDS_RE.search(content)
+    if match:
+        line = match.group(0).decode()
         all_keywords = line.split('=')[1].split('#')[0].strip(' "').split()
         if len(all_keywords) == 0 or '*' in all_keywords:
             all_keywords = default_keywords
@@ -144,7 +204,6 @@ def get_gentoo_ebuild_keywords(content):
                     all_keywords.remove(keyword)
                 continue
             keywords.add(keyword)
-        break
     if keywords:
         return keywords
     else:
@@ -215,22 +274,73 @@ def get_gentoo_mirror_urls():
     return mirror_urls
 
 
-def extract_gentoo_ebuilds(data):
-    """ Extract ebuilds from a Gentoo tarball
+def get_gentoo_ebuild_keywords_line(content):
+    """ Returns only the KEYWORDS line of an ebuild, which is all that is
+        needed to determine the arches it applies to
     """
-    extracted_ebuilds = {}
-    with tarfile.open(fileobj=BytesIO(data), mode='r') as tar:
-        for member in tar.getmembers():
-            if member.isfile() and member.name.endswith('ebuild') and not member.name.endswith('skel.ebuild'):
-                file_content = tar.extractfile(member).read()
-                full_path = Path(member.name)
-                ebuild_path = Path(*full_path.parts[1:])
-                extracted_ebuilds[str(ebuild_path)] = file_content
-    return extracted_ebuilds
+    match = GENTOO_KEYWORDS_RE.search(content)
+    if match:
+        return match.group(0)
+    return b''
+
+
+def extract_gentoo_snapshot_packages(mirror, res, checksum, dry_run=False):
+    """ Stream a Gentoo snapshot tarball and extract packages from its ebuilds
+        without holding the snapshot in memory. Only the KEYWORDS line of each
+        ebuild is kept. Categories whose Manifest has not changed since the
+        last refresh are not parsed, their packages are taken from the mirror.
+        Returns a tuple of (packages, manifests) where manifests maps each
+        category to the checksum of its Manifest, or None on error.
+    """
+    previous = cache.get(f'gentoo_manifests_{mirror.id}') or {}
+    if previous.get('checksum') and previous.get('checksum') == mirror.packages_checksum:
+        old_manifests = previous.get('manifests', {})
+    else:
+        old_manifests = {}
+    manifests = {}
+    unchanged = set()
+    ebuilds = {}
+
+    raw = res.raw
+    if hasattr(raw, 'decode_content'):
+        raw.decode_content = True
+    reader = ChecksumReader(raw, Checksum.md5)
+    info_message(text='Fetching and extracting Gentoo Repo data')
+    try:
+        with tarfile.open(fileobj=reader, mode='r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                parts = Path(member.name).parts[1:]
+                if len(parts) == 2 and parts[1] in ['Manifest', 'Manifest.gz']:
+                    category = parts[0]
+                    manifests[category] = get_sha256(tar.extractfile(member).read())
+                    if old_manifests.get(category) == manifests[category]:
+                        unchanged.add(category)
+                elif len(parts) == 3 and parts[2].endswith('.ebuild'):
+                    if parts[0] in unchanged:
+                        continue
+                    content = tar.extractfile(member).read()
+                    ebuilds[str(Path(*parts))] = get_gentoo_ebuild_keywords_line(content)
+    except (tarfile.TarError, lzma.LZMAError, EOFError, OSError, HTTPError) as e:
+        error_message(text=f'Error reading Gentoo Repo data from {mirror.url}: {e}')
+        return
+
+    computed_checksum = reader.hexdigest()
+    if not mirror_checksum_is_valid(computed_checksum, checksum, mirror, 'package', dry_run):
+        return
+
+    packages = extract_gentoo_packages_from_ebuilds(ebuilds) or set()
+    if unchanged:
+        debug_message(text=f'{len(unchanged)} Gentoo categories unchanged, reusing existing Packages')
+        existing = mirror.packages.filter(category__name__in=unchanged).select_related('name', 'arch', 'category')
+        for package in existing:
+            packages.add(convert_package_to_packagestring(package))
+    return packages, manifests
 
 
 def extract_gentoo_overlay_ebuilds(t):
-    """ Extract ebuilds from a Gentoo overlay tarball
+    """ Extract the KEYWORDS lines of ebuilds from a Gentoo overlay clone
     """
     extracted_ebuilds = {}
     for root, _, files in os.walk(t):
@@ -240,18 +350,11 @@ def extract_gentoo_overlay_ebuilds(t):
                 if len(package_name.split('/')) > 2:
                     continue
                 with open(os.path.join(root, name), 'rb') as f:
-                    content = f.read()
+                    content = get_gentoo_ebuild_keywords_line(f.read())
                 extracted_ebuilds[f'{package_name}/{name}'] = content
     return extracted_ebuilds
 
 
-def extract_gentoo_packages(mirror, data):
-    """ Extract packages from a Gentoo mirror
-    """
-    extracted_ebuilds = extract_gentoo_ebuilds(data)
-    return extract_gentoo_packages_from_ebuilds(extracted_ebuilds)
-
-
 def extract_gentoo_packages_from_ebuilds(extracted_ebuilds):
     """ Extract packages from ebuilds
     """
@@ -281,27 +384,105 @@ def extract_gentoo_packages_from_ebuilds(extracted_ebuilds):
             )
             packages.add(package)
     plen = len(packages)
-    info_message(text=f'Extracted {plen} Packages', plen=plen)
+    info_message(text=f'Extracted {plen} Packages')
     return packages
 
 
-def extract_gentoo_overlay_packages(mirror):
+def get_gentoo_overlay_clone_dir(mirror):
+    """ Returns the directory to keep a clone of a Gentoo overlay in between
+        refreshes, or None if the metadata cache is disabled
+    """
+    cache_dir = get_cache_dir()
+    if cache_dir:
+        return os.path.join(cache_dir, 'gentoo', f'mirror-{mirror.id}')
+
+
+def extract_gentoo_overlay_packages(mirror, head, dry_run=False):
     """ Extract packages from gentoo overlay repo
+        If a clone from the last refresh is available, only the ebuilds that
+        changed since then are parsed. The clone is kept under
+        METADATA_CACHE_DIR, so if the metadata cache is disabled every refresh
+        clones the overlay into a temporary directory and parses all ebuilds.
+        Dry runs clone into a temporary directory so that the kept clone is
+        left alone. Returns None on error.
     """
-    t = tempfile.mkdtemp()
+    clone_dir = None if dry_run else get_gentoo_overlay_clone_dir(mirror)
+    if clone_dir and mirror.packages_checksum and os.path.isdir(clone_dir):
+        try:
+            packages = update_gentoo_overlay_packages(mirror, clone_dir, head)
+        except (git.GitCommandError, git.InvalidGitRepositoryError, git.BadName, ValueError) as e:
+            warning_message(text=f'Incremental refresh of {mirror.url} failed, recloning: {e}')
+            packages = None
+        if packages is not None:
+            return packages
+
+    if clone_dir:
+        shutil.rmtree(clone_dir, ignore_errors=True)
+        t = clone_dir
+    else:
+        t = tempfile.mkdtemp()
     info_message(text=f'Extracting Gentoo packages from {mirror.url}')
-    git.Repo.clone_from(mirror.url, t, depth=1)
-    packages = set()
+    try:
+        git.Repo.clone_from(mirror.url, t, depth=1)
+    except git.GitCommandError as e:
+        error_message(text=f'Error cloning Gentoo overlay {mirror.url}: {e}')
+        shutil.rmtree(t, ignore_errors=True)
+        return
     extracted_ebuilds = extract_gentoo_overlay_ebuilds(t)
-    shutil.rmtree(t)
+    if not clone_dir:
+        shutil.rmtree(t)
     packages = extract_gentoo_packages_from_ebuilds(extracted_ebuilds)
     return packages
 
 
-def refresh_gentoo_repo(repo):
+def update_gentoo_overlay_packages(mirror, clone_dir, head):
+    """ Fetch a Gentoo overlay into an existing clone and update the mirror
+        packages from the ebuilds that changed between the last refreshed
+        commit and head
+    """
+    repo = git.Repo(clone_dir)
+    last = mirror.packages_checksum
+    if repo.head.commit.hexsha != last:
+        raise ValueError(f'clone is at {repo.head.commit.hexsha}, expected {last}')
+    repo.remotes.origin.fetch(depth=1)
+    diff = repo.git.diff('--name-status', '--no-renames', last, head)
+    repo.head.reset(head, index=True, working_tree=True)
+
+    changed = set()
+    added = {}
+    for line in diff.splitlines():
+        status, path = line.split('\t', 1)
+        parts = path.split('/')
+        if len(parts) != 3 or not fnmatch(parts[2], '*.ebuild'):
+            continue
+        changed.add(path)
+        if status != 'D':
+            with open(os.path.join(clone_dir, path), 'rb') as f:
+                added[path] = get_gentoo_ebuild_keywords_line(f.read())
+    info_message(text=f'{len(changed)} ebuilds changed in {mirror.url}')
+
+    removed = set()
+    for path in changed:
+        category, name, filename = path.split('/')
+        evr = filename.replace(f'{name}-', '').replace('.ebuild', '')
+        removed.add((category, name.lower(), find_evr(evr)))
+
+    packages = set()
+    existing = mirror.packages.select_related('name', 'arch', 'category')
+    for package in existing:
+        strpackage = convert_package_to_packagestring(package)
+        key = (strpackage.category, strpackage.name, (strpackage.epoch, strpackage.version, strpackage.release))
+        if key not in removed:
+            packages.add(strpackage)
+    packages.update(extract_gentoo_packages_from_ebuilds(added) or set())
+    return packages
+
+
+def refresh_gentoo_repo(repo, dry_run=False, full_diff=False):
     """ Refresh a Gentoo repo
+        Returns a dict mapping mirror ids to the changes to their packages
     """
     if repo.repo_id == 'gentoo':
-        refresh_gentoo_main_repo(repo)
+        return refresh_gentoo_main_repo(repo, dry_run, full_diff)
     else:
-        refresh_gentoo_overlay_repo(repo)
+        return refresh_gentoo_overlay_repo(repo, dry_run, full_diff)
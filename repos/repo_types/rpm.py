@@ -19,8 +19,8 @@ from django.db.models import Q
 from repos.repo_types.yast import refresh_yast_repo
 from repos.repo_types.yum import refresh_yum_repo
 from repos.utils import (
-    check_for_metalinks, check_for_mirrorlists, fetch_mirror_data,
-    find_mirror_url, get_max_mirrors,
+    check_for_metalinks, check_for_mirrorlists, fail_mirror, fetch_mirror_data,
+    find_mirror_url, get_max_mirrors, order_mirrors_by_speed,
 )
 from util import get_datetime_now
 from util.logging import info_message, warning_message
@@ -30,14 +30,17 @@ def refresh_repo_errata(repo):
     refresh_rpm_repo_mirrors(repo, errata_only=True)
 
 
-def refresh_rpm_repo(repo):
+def refresh_rpm_repo(repo, dry_run=False, full_diff=False):
     """ Refresh an rpm repo (yum or yast)
         Checks if the repo url is a mirrorlist or metalink,
         and extracts mirrors if so, then refreshes the mirrors
+        Dry runs only use the existing mirrors
+        Returns a dict mapping mirror ids to the changes to their packages
     """
-    check_for_mirrorlists(repo)
-    check_for_metalinks(repo)
-    refresh_rpm_repo_mirrors(repo)
+    if not dry_run:
+        check_for_mirrorlists(repo)
+        check_for_metalinks(repo)
+    return refresh_rpm_repo_mirrors(repo, dry_run=dry_run, full_diff=full_diff)
 
 
 def max_mirrors_refreshed(repo, checksum, ts):
@@ -55,9 +58,10 @@ def max_mirrors_refreshed(repo, checksum, ts):
     return False
 
 
-def refresh_rpm_repo_mirrors(repo, errata_only=False):
+def refresh_rpm_repo_mirrors(repo, errata_only=False, dry_run=False, full_diff=False):
     """ Checks a number of common yum repo formats to determine
         which type of repo it is, then refreshes the mirrors
+        Returns a dict mapping mirror ids to the changes to their packages
     """
     formats = [
         'repodata/repomd.xml.zst',
@@ -73,32 +77,39 @@ def refresh_rpm_repo_mirrors(repo, errata_only=False):
         'content',
     ]
     ts = get_datetime_now()
-    enabled_mirrors = repo.mirror_set.filter(mirrorlist=False, refresh=True, enabled=True)
+    diffs = {}
+    enabled_mirrors = order_mirrors_by_speed(repo.mirror_set.filter(mirrorlist=False, refresh=True, enabled=True))
     for mirror in enabled_mirrors:
         res = find_mirror_url(mirror.url, formats)
         if not res:
-            mirror.fail()
+            fail_mirror(mirror, dry_run)
             continue
         mirror_url = res.url
 
         repo_data = fetch_mirror_data(
             mirror=mirror,
             url=mirror_url,
-            text='Fetching rpm Repo data')
+            text='Fetching rpm Repo data',
+            dry_run=dry_run)
         if not repo_data:
             continue
 
         if mirror_url.endswith('content'):
             text = f'Found yast rpm Repo - {mirror_url}'
             info_message(text=text)
-            refresh_yast_repo(mirror, repo_data)
+            diff = refresh_yast_repo(mirror, repo_data, dry_run, full_diff)
         else:
             text = f'Found yum rpm Repo - {mirror_url}'
             info_message(text=text)
-            refresh_yum_repo(mirror, repo_data, mirror_url, errata_only)
+            diff = refresh_yum_repo(mirror, repo_data, mirror_url, errata_only, dry_run, full_diff)
+        if diff:
+            diffs[mirror.id] = diff
+        if dry_run:
+            continue
         if mirror.last_access_ok:
             mirror.timestamp = ts
             mirror.save()
             checksum = mirror.packages_checksum
             if max_mirrors_refreshed(repo, checksum, ts):
                 break
+    return diffs
@@ -17,47 +17,90 @@
 import re
 
 from packages.models import PackageString
-from patchman.signals import pbar_start, pbar_update
-from repos.utils import fetch_mirror_data, update_mirror_packages
-from util import extract
-from util.logging import info_message
+from repos.utils import (
+    copy_mirror_packages, fail_mirror, fetch_mirror_data,
+    update_mirror_packages,
+)
+from util import Checksum, get_checksum, open_extracted
+from util.logging import info_message, warning_message
 
 
-def refresh_yast_repo(mirror, data):
+def get_yast_packages_checksum(data):
+    """ Find the checksum of the packages file in a yast content file
+        Returns the checksum and checksum type, or None, None if not found
+    """
+    for line in data.decode('utf-8').splitlines():
+        fields = line.split()
+        if len(fields) == 4 and fields[0] == 'META' and fields[3] == 'packages.gz':
+            checksum_type = fields[1].lower()
+            if checksum_type in Checksum.__members__:
+                return fields[2], checksum_type
+    return None, None
+
+
+def refresh_yast_repo(mirror, data, dry_run=False, full_diff=False):
     """ Refresh package metadata for a yast-style rpm mirror
         and add the packages to the mirror
+        The packages file is skipped if its checksum in the content file,
+        or the checksum of the downloaded file, has not changed
+        Returns the changes to the mirror packages, or None if unchanged
     """
     package_dir = re.findall('DESCRDIR *(.*)', data.decode('utf-8'))[0]
     package_url = f'{mirror.url}/{package_dir}/packages.gz'
 
+    checksum, checksum_type = get_yast_packages_checksum(data)
+    if checksum and mirror.packages_checksum == checksum:
+        text = 'Mirror checksum has not changed, not refreshing Package metadata'
+        warning_message(text=text)
+        return
+    diff = copy_mirror_packages(mirror, checksum, dry_run, full_diff)
+    if diff:
+        return diff
+
     package_data = fetch_mirror_data(
         mirror=mirror,
         url=package_url,
-        text='Fetching yast Repo data')
+        checksum=checksum,
+        checksum_type=checksum_type,
+        text='Fetching yast Repo data',
+        metadata_type='package',
+        dry_run=dry_run)
     if not package_data:
         return
 
-    mirror.packages_checksum = 'yast'
+    if not checksum:
+        checksum = get_checksum(package_data, Checksum.sha256)
+        if mirror.packages_checksum == checksum:
+            text = 'Mirror checksum has not changed, not refreshing Package metadata'
+            warning_message(text=text)
+            return
+        diff = copy_mirror_packages(mirror, checksum, dry_run, full_diff)
+        if diff:
+            return diff
     packages = extract_yast_packages(package_data)
-    if packages:
-        update_mirror_packages(mirror, packages)
-        packages.clear()
+    if not packages:
+        fail_mirror(mirror, dry_run)
+        return
+    diff = update_mirror_packages(mirror, packages, dry_run, full_diff)
+    packages.clear()
+    # only store the checksum once the packages have been updated, so that
+    # a failed refresh is retried
+    mirror.packages_checksum = checksum
+    if not dry_run:
+        mirror.save()
+    return diff
 
 
 def extract_yast_packages(data):
     """ Extract package metadata from yast metadata file
+        The decompressed file is read line by line
     """
-    extracted = extract(data, 'gz').decode('utf-8')
-    pkgs = re.findall('=Pkg: (.*)', extracted)
-    plen = len(pkgs)
     packages = set()
-
-    if plen > 0:
-        pbar_start.send(sender=None, ptext=f'Extracting {plen} Packages', plen=plen)
-
-        for i, pkg in enumerate(pkgs):
-            pbar_update.send(sender=None, index=i + 1)
-            name, version, release, arch = pkg.split()
+    with open_extracted(data, 'gz') as reader:
+        for line in reader:
+            if not line.startswith(b'=Pkg: '):
+                continue
+            name, version, release, arch = line[6:].decode('utf-8').split()
             package = PackageString(name=name.lower(),
                                     epoch='',
                                     version=version,
@@ -65,6 +108,9 @@ def extract_yast_packages(data):
                                     arch=arch,
                                     packagetype='R')
             packages.add(package)
+    plen = len(packages)
+    if plen > 0:
+        info_message(text=f'Extracted {plen} Packages')
     else:
         info_message(text='No packages found in repo')
     return packages
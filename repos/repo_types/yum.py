@@ -20,13 +20,21 @@ from io import BytesIO
 import yaml
 from defusedxml import ElementTree
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 from errata.sources.repos.yum import extract_updateinfo
 from packages.models import Package, PackageString
-from packages.utils import get_or_create_package, parse_package_string
+from packages.utils import get_or_create_packages, parse_package_string
 from patchman.signals import pbar_start, pbar_update
-from repos.utils import fetch_mirror_data, update_mirror_packages
-from util import extract
-from util.logging import error_message, warning_message
+from repos.utils import (
+    PARSE_CHUNK_SIZE, PARSE_READ_SIZE, copy_mirror_packages, fetch_mirror_data,
+    parse_concurrently, update_mirror_packages,
+)
+from util import open_extracted
+from util.logging import clear_forked_pbar, error_message, warning_message
 
 
 def get_repomd_url(mirror_url, data, url_type='primary'):
@@ -38,10 +46,9 @@ def get_repomd_url(mirror_url, data, url_type='primary'):
             return None, None, None
 
     ns = 'http://linux.duke.edu/metadata/repo'
-    extracted = extract(data, mirror_url)
     location = None
     try:
-        tree = ElementTree.parse(BytesIO(extracted))
+        tree = ElementTree.parse(open_extracted(data, mirror_url))
         root = tree.getroot()
         for child in root:
             if child.attrib.get('type') == url_type:
@@ -61,22 +68,15 @@ def get_repomd_url(mirror_url, data, url_type='primary'):
 
 def extract_module_metadata(data, url, repo):
     """ Extract module metadata from a modules.yaml file
+        The documents are parsed in a single pass, then the artifacts of all
+        modules are resolved to packages in bulk
     """
     modules = set()
-    extracted = extract(data, url)
+    module_packages = {}
     try:
-        modules_yaml = yaml.safe_load_all(extracted)
-    except yaml.YAMLError as e:
-        error_message(text=f'Error parsing modules.yaml: {e}')
-        return modules
-
-    mlen = len(re.findall(r'---', yaml.dump(extracted.decode())))
-    pbar_start.send(sender=None, ptext=f'Extracting {mlen} Modules ', plen=mlen)
-    for i, doc in enumerate(modules_yaml):
-        pbar_update.send(sender=None, index=i + 1)
-        document = doc['document']
-        modulemd = doc['data']
-        if document == 'modulemd':
+        for doc in yaml.load_all(open_extracted(data, url), Loader=SafeLoader):
+            if not doc or doc.get('document') != 'modulemd':
+                continue
             modulemd = doc['data']
             m_name = modulemd.get('name')
             m_stream = modulemd['stream']
@@ -87,45 +87,133 @@ def extract_module_metadata(data, url, repo):
             # raw_profiles = list(modulemd.get('profiles', {}).keys())
 
             packages = set()
-            p_type = Package.RPM
             for pkg_str in raw_packages:
                 p_name, p_epoch, p_ver, p_rel, p_dist, p_arch = parse_package_string(pkg_str)
-                package = get_or_create_package(p_name, p_epoch, p_ver, p_rel, p_arch, p_type)
-                packages.add(package)
+                packages.add(PackageString(
+                    name=p_name,
+                    epoch=p_epoch,
+                    version=p_ver,
+                    release=p_rel,
+                    arch=p_arch,
+                    packagetype=Package.RPM,
+                ))
+            module_packages[(m_name, m_stream, m_version, m_context, arch)] = packages
+    except yaml.YAMLError as e:
+        error_message(text=f'Error parsing modules.yaml: {e}')
+        return modules
 
-            from modules.utils import get_or_create_module
-            module = get_or_create_module(m_name, m_stream, m_version, m_context, arch, repo)
+    all_packages = set().union(*module_packages.values())
+    package_ids = get_or_create_packages(all_packages)
 
-            package_ids = []
-            for package in packages:
-                package_ids.append(package.id)
-                module.packages.add(package)
-            for package in module.packages.all():
-                if package.id not in package_ids:
-                    module.packages.remove(package)
-            modules.add(module)
+    from modules.utils import get_or_create_module
+    mlen = len(module_packages)
+    pbar_start.send(sender=None, ptext=f'Extracting {mlen} Modules ', plen=mlen)
+    for i, ((m_name, m_stream, m_version, m_context, arch), packages) in enumerate(module_packages.items()):
+        pbar_update.send(sender=None, index=i + 1)
+        module = get_or_create_module(m_name, m_stream, m_version, m_context, arch, repo)
+        new_ids = {package_ids[p] for p in packages if p in package_ids}
+        old_ids = set(module.packages.values_list('id', flat=True))
+        if new_ids - old_ids:
+            module.packages.add(*(new_ids - old_ids))
+        if old_ids - new_ids:
+            module.packages.remove(*(old_ids - new_ids))
+        modules.add(module)
+    return modules
 
 
 def extract_yum_packages(data, url):
     """ Extract package metadata from a yum primary.xml file
+        The file is split on package element boundaries as it is
+        decompressed, and the chunks are parsed concurrently
     """
-    extracted = extract(data, url)
-    ns = 'http://linux.duke.edu/metadata/common'
     packages = set()
-    try:
-        context = ElementTree.iterparse(BytesIO(extracted), events=('start', 'end'))
-        for event, elem in context:
-            if event == 'start':
-                if elem.tag == f'{{{ns}}}metadata':
-                    plen = int(elem.attrib.get('packages'))
-                    break
+    with open_extracted(data, url) as reader:
+        chunks, plen = split_yum_packages(reader)
+        if not chunks:
+            error_message(text=f'Error parsing yum primary.xml from {url}: no metadata element found')
+            return packages
         pbar_start.send(sender=None, ptext=f'Extracting {plen} Packages', plen=plen)
         i = 0
+        for result in parse_concurrently(extract_yum_packages_chunk, chunks):
+            for name, epoch, version, release, arch in result:
+                package = PackageString(
+                    name=name,
+                    epoch=epoch,
+                    version=version,
+                    release=release,
+                    arch=arch,
+                    packagetype='R',
+                )
+                packages.add(package)
+            i += len(result)
+            pbar_update.send(sender=None, index=i)
+    return packages
+
+
+def split_yum_packages(reader, chunk_size=PARSE_CHUNK_SIZE):
+    """ Split a primary.xml file into well-formed documents of roughly
+        chunk_size bytes as it is read from reader, only splitting between
+        package elements. Each chunk is wrapped in the original metadata
+        element so that namespaces resolve. Returns a generator of the chunks
+        and the number of packages in the file, or no chunks if there is no
+        metadata element.
+    """
+    buf = b''
+    while True:
+        root_start = buf.find(b'<metadata')
+        if root_start != -1 and buf.find(b'>', root_start) != -1:
+            break
+        data = reader.read(PARSE_READ_SIZE)
+        if not data:
+            return [], 0
+        buf += data
+    root_end = buf.find(b'>', root_start) + 1
+    header = buf[:root_end]
+    match = re.search(rb'packages="(\d+)"', header)
+    plen = int(match.group(1)) if match else 0
+    return iter_yum_packages_chunks(reader, header, buf[root_end:], chunk_size), plen
+
+
+def iter_yum_packages_chunks(reader, header, buf, chunk_size):
+    """ Yield the chunks of a primary.xml file, see split_yum_packages
+        buf holds the data that has already been read after the header
+    """
+    footer = b'</metadata>'
+    end_tag = b'</package>'
+    chunked = False
+    data = True
+    while data:
+        data = reader.read(PARSE_READ_SIZE)
+        buf += data
+        split = buf.find(end_tag, chunk_size)
+        while split != -1:
+            split += len(end_tag)
+            yield header + buf[:split] + footer
+            chunked = True
+            buf = buf[split:]
+            split = buf.find(end_tag, chunk_size)
+    body_end = buf.rfind(footer)
+    if body_end != -1:
+        buf = buf[:body_end]
+    if b'<package' in buf or not chunked:
+        yield header + buf + footer
+
+
+def extract_yum_packages_chunk(chunk):
+    """ Extract package metadata from a chunk of a yum primary.xml file
+        Returns a list of (name, epoch, version, release, arch) tuples
+    """
+    clear_forked_pbar()
+    ns = 'http://linux.duke.edu/metadata/common'
+    packages = []
+    name = epoch = version = release = arch = ''
+    try:
+        context = ElementTree.iterparse(BytesIO(chunk), events=('start', 'end'))
         for event, elem in context:
             if event == 'start':
                 if elem.tag == f'{{{ns}}}package':
                     if elem.attrib.get('type') == 'rpm':
-                        name = version = release = arch = ''
+                        name = epoch = version = release = arch = ''
             elif event == 'end':
                 if elem.tag == f'{{{ns}}}name':
                     name = elem.text.lower()
@@ -140,23 +228,13 @@ def extract_yum_packages(data, url):
                     if name and version and release and arch:
                         if epoch == '0':
                             epoch = ''
-                        package = PackageString(
-                            name=name,
-                            epoch=epoch,
-                            version=version,
-                            release=release,
-                            arch=arch,
-                            packagetype='R',
-                        )
-                        packages.add(package)
-                        pbar_update.send(sender=None, index=i + 1)
-                        i += 1
+                        packages.append((name, epoch, version, release, arch))
                     else:
                         text = f'Error parsing Package: {name} {epoch} {version} {release} {arch}'
                         error_message(text=text)
                 elem.clear()
     except ElementTree.ParseError as e:
-        error_message(text=f'Error parsing yum primary.xml from {url}: {e}')
+        error_message(text=f'Error parsing yum primary.xml: {e}')
     return packages
 
 
@@ -218,19 +296,24 @@ def refresh_repomd_modules(mirror, data, mirror_url):
     extract_module_metadata(data, url, mirror.repo)
 
 
-def refresh_repomd_primary(mirror, data, mirror_url):
+def refresh_repomd_primary(mirror, data, mirror_url, dry_run=False, full_diff=False):
     """ Checks for and refreshes a yum repomd primary.xml file
+        Returns the changes to the mirror packages, or None if unchanged
     """
     url, checksum, checksum_type = get_repomd_url(mirror_url, data, url_type='primary')
     if not url:
         warning_message(text=f'No Package metadata found in {mirror_url}')
+    diff = copy_mirror_packages(mirror, checksum, dry_run, full_diff)
+    if diff:
+        return diff
     data = fetch_mirror_data(
         mirror=mirror,
         url=url,
         checksum=checksum,
         checksum_type=checksum_type,
         text='Fetching Package data',
-        metadata_type='package')
+        metadata_type='package',
+        dry_run=dry_run)
 
     if not mirror.last_access_ok:
         return
@@ -241,17 +324,24 @@ def refresh_repomd_primary(mirror, data, mirror_url):
         return
     else:
         mirror.packages_checksum = checksum
-        mirror.save()
+        if not dry_run:
+            mirror.save()
 
     packages = extract_yum_packages(data, url)
     if packages:
-        update_mirror_packages(mirror, packages)
+        return update_mirror_packages(mirror, packages, dry_run, full_diff)
 
 
-def refresh_yum_repo(mirror, data, mirror_url, errata_only):
+def refresh_yum_repo(mirror, data, mirror_url, errata_only, dry_run=False, full_diff=False):
     """ Refresh package, module and updateinfo/errata data for a yum-style rpm Mirror
+        Dry runs only compute the package changes
+        Returns the changes to the mirror packages, or None if unchanged
     """
+    if dry_run:
+        return refresh_repomd_primary(mirror, data, mirror_url, dry_run, full_diff)
+    diff = None
     if not errata_only:
-        refresh_repomd_primary(mirror, data, mirror_url)
+        diff = refresh_repomd_primary(mirror, data, mirror_url, full_diff=full_diff)
         refresh_repomd_modules(mirror, data, mirror_url)
     refresh_repomd_updateinfo(mirror, data, mirror_url)
+    return diff
@@ -22,14 +22,17 @@ from repos.models import Mirror, MirrorPackage, Repository
 class RepositorySerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Repository
-        fields = ('id', 'name', 'arch', 'security', 'repotype', 'enabled', 'auth_required')
+        fields = ('id', 'name', 'arch', 'security', 'repotype', 'enabled', 'auth_required', 'last_refresh',
+                  'packages_count', 'security_packages_count', 'last_change')
 
 
 class MirrorSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Mirror
         fields = ('id', 'repo', 'url', 'last_access_ok', 'packages_checksum',
-                  'timestamp', 'mirrorlist', 'enabled', 'refresh', 'fail_count')
+                  'timestamp', 'mirrorlist', 'enabled', 'refresh', 'fail_count',
+                  'last_change', 'change_interval', 'download_bytes', 'download_duration',
+                  'latency', 'throughput')
 
 
 class MirrorPackageSerializer(serializers.HyperlinkedModelSerializer):
@@ -22,7 +22,9 @@ from repos.models import Mirror
 
 @receiver(m2m_changed, sender=Mirror.packages.through)
 def update_mirror_packages_count(sender, instance, action, **kwargs):
-    """Update packages_count when Mirror.packages M2M changes."""
+    """Update packages_count when Mirror.packages M2M changes.
+    The package and repo counts are updated once by the mirror sync, see
+    record_mirror_diff."""
     if action in ('post_add', 'post_remove', 'post_clear'):
         instance.packages_count = instance.packages.count()
         instance.save(update_fields=['packages_count'])
@@ -25,6 +25,10 @@ MIRRORS_TEMPLATE = (
     '<a href="{% url \'repos:mirror_list\' %}?repo_id={{ record.id }}">'
     '{{ record.mirror_set.count }}</a>'
 )
+REPO_PACKAGES_TEMPLATE = (
+    '<a href="{% url \'packages:package_list\' %}?repo_id={{ record.id }}">'
+    '{{ record.packages_count }}</a>'
+)
 REPO_ENABLED_TEMPLATE = '{% load common %}{% yes_no_img record.enabled %}'
 SECURITY_TEMPLATE = '{% load common %}{% yes_no_img record.security %}'
 AUTH_REQUIRED_TEMPLATE = '{% if record.auth_required %}Yes{% else %}No{% endif %}'
@@ -61,7 +65,7 @@ class RepositoryTable(BaseTable):
     repo_id = tables.Column(
         verbose_name='Repo ID',
         default='',
-        attrs={'th': {'class': 'col-sm-3'}, 'td': {'class': 'col-sm-3'}},
+        attrs={'th': {'class': 'col-sm-2'}, 'td': {'class': 'col-sm-2'}},
     )
     mirrors = tables.TemplateColumn(
         MIRRORS_TEMPLATE,
@@ -69,6 +73,12 @@ class RepositoryTable(BaseTable):
         verbose_name='Mirrors',
         attrs={'th': {'class': 'col-sm-1'}, 'td': {'class': 'col-sm-1 centered'}},
     )
+    repo_packages = tables.TemplateColumn(
+        REPO_PACKAGES_TEMPLATE,
+        order_by='packages_count',
+        verbose_name='Packages',
+        attrs={'th': {'class': 'col-sm-1'}, 'td': {'class': 'col-sm-1 centered'}},
+    )
     repo_enabled = tables.TemplateColumn(
         REPO_ENABLED_TEMPLATE,
         orderable=False,
@@ -91,7 +101,7 @@ class RepositoryTable(BaseTable):
     class Meta(BaseTable.Meta):
         model = Repository
         fields = (
-            'selection', 'repo_name', 'repo_id', 'mirrors',
+            'selection', 'repo_name', 'repo_id', 'mirrors', 'repo_packages',
             'repo_enabled', 'security', 'auth_required',
         )
 
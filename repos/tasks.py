@@ -18,12 +18,18 @@ from celery import shared_task
 from django.core.cache import cache
 
 from repos.models import Repository
+from repos.utils import (
+    delete_mirrors, delete_repos, get_repos_due_for_refresh,
+    update_mirror_counts,
+)
 from util.logging import warning_message
 
 
 @shared_task(priority=0)
-def refresh_repo(repo_id, force=False):
+def refresh_repo(repo_id, force=False, dry_run=False, full_diff=False):
     """ Refresh metadata for a single repo
+        Returns a summary of the packages added and removed per mirror,
+        including the packages themselves if full_diff is set
     """
     repo_id_lock_key = f'refresh_repos_{repo_id}_lock'
     # lock will expire after 1 day
@@ -32,7 +38,7 @@ def refresh_repo(repo_id, force=False):
     if cache.add(repo_id_lock_key, 'true', lock_expire):
         try:
             repo = Repository.objects.get(id=repo_id)
-            repo.refresh(force)
+            return repo.refresh(force, dry_run, full_diff)
         finally:
             cache.delete(repo_id_lock_key)
     else:
@@ -41,9 +47,12 @@ def refresh_repo(repo_id, force=False):
 
 @shared_task(priority=1)
 def refresh_repos(force=False):
-    """ Refresh metadata for all enabled repos
+    """ Refresh metadata for enabled repos that are due for a refresh,
+        or for all enabled repos if force is set
     """
     repos = Repository.objects.filter(enabled=True)
+    if not force:
+        repos = get_repos_due_for_refresh(repos)
     lock_key = 'refresh_repos_lock'
     # lock will expire after 1 day
     lock_expire = 60 * 60 * 24
@@ -56,3 +65,24 @@ def refresh_repos(force=False):
             cache.delete(lock_key)
     else:
         warning_message('Already refreshing repos, skipping task.')
+
+
+@shared_task(priority=1)
+def bulk_delete_repos(repo_ids, task_id=None):
+    """ Delete repos and their mirrors in the background
+    """
+    delete_repos(repo_ids, task_id, f'Deleting {len(repo_ids)} Repositories')
+
+
+@shared_task(priority=1)
+def bulk_delete_mirrors(mirror_ids, task_id=None):
+    """ Delete mirrors in the background
+    """
+    delete_mirrors(mirror_ids, task_id, f'Deleting {len(mirror_ids)} Mirrors')
+
+
+@shared_task(priority=1)
+def update_moved_mirror_counts(mirror_ids, repo_ids, task_id=None):
+    """ Update the cached package counts of moved mirrors in the background
+    """
+    update_mirror_counts(mirror_ids, repo_ids, task_id, f'Updating Package counts for {len(mirror_ids)} Mirrors')
@@ -14,11 +14,25 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
+from datetime import timedelta
+from unittest.mock import patch
+
 from django.test import TestCase, override_settings
+from django.utils import timezone
 
 from arch.models import MachineArchitecture, PackageArchitecture
-from packages.models import Package, PackageName
+from domains.models import Domain
+from errata.models import Erratum
+from hosts.models import Host, HostRepo
+from operatingsystems.models import OSRelease, OSVariant
+from packages.models import Package, PackageName, PackageString
 from repos.models import Mirror, MirrorPackage, Repository
+from repos.utils import (
+    add_mirrors_from_urls, copy_mirror_packages, delete_mirrors,
+    get_repo_refresh_interval, get_repos_due_for_refresh, move_mirrors,
+    order_mirrors_by_speed, record_mirror_diff, update_mirror_packages,
+    update_repo_security_counts,
+)
 
 
 @override_settings(
@@ -139,3 +153,295 @@ class MirrorModelTests(TestCase):
     def test_mirror_str(self):
         """Test mirror string representation."""
         self.assertIn(self.mirror.url, str(self.mirror))
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class CopyMirrorPackagesTests(TestCase):
+    """Tests for copying packages between mirrors with the same checksum."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.machine_arch = MachineArchitecture.objects.create(name='x86_64')
+        self.pkg_arch = PackageArchitecture.objects.create(name='x86_64')
+        self.packages = []
+        for name in ['bash', 'curl', 'httpd']:
+            self.packages.append(Package.objects.create(
+                name=PackageName.objects.create(name=name),
+                arch=self.pkg_arch,
+                epoch='',
+                version='1.0',
+                release='1.el9',
+                packagetype=Package.RPM,
+            ))
+        source_repo = Repository.objects.create(name='upstream', arch=self.machine_arch, repotype=Repository.RPM)
+        self.source = Mirror.objects.create(
+            repo=source_repo,
+            url='http://upstream.example.com/repo',
+            packages_checksum='abc123',
+        )
+        self.source.packages.add(self.packages[0], self.packages[1])
+        repo = Repository.objects.create(name='internal', arch=self.machine_arch, repotype=Repository.RPM)
+        self.mirror = Mirror.objects.create(repo=repo, url='http://internal.example.com/repo')
+
+    def test_copy_replaces_packages(self):
+        """Test that packages are copied and obsolete packages removed."""
+        self.mirror.packages.add(self.packages[1], self.packages[2])
+        self.assertTrue(copy_mirror_packages(self.mirror, 'abc123'))
+        self.mirror.refresh_from_db()
+        self.assertEqual(set(self.mirror.packages.all()), {self.packages[0], self.packages[1]})
+        self.assertEqual(self.mirror.packages_count, 2)
+        self.assertEqual(self.mirror.packages_checksum, 'abc123')
+        self.assertIsNotNone(self.mirror.timestamp)
+
+    def test_no_copy_without_matching_mirror(self):
+        """Test that nothing is copied if no mirror has the checksum."""
+        self.assertFalse(copy_mirror_packages(self.mirror, 'def456'))
+        self.assertEqual(self.mirror.packages.count(), 0)
+
+    def test_no_copy_from_other_repotype(self):
+        """Test that packages are only copied between repos of the same type."""
+        self.mirror.repo.repotype = Repository.DEB
+        self.mirror.repo.save()
+        self.assertFalse(copy_mirror_packages(self.mirror, 'abc123'))
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    MAX_MIRRORS=2,
+)
+class MirrorSelectionTests(TestCase):
+    """Tests for latency-ranked mirror selection."""
+
+    urls = [
+        'http://a.example.com/9/BaseOS/x86_64/os',
+        'http://b.example.com/9/BaseOS/x86_64/os',
+        'http://c.example.com/9/BaseOS/x86_64/os',
+    ]
+
+    def setUp(self):
+        """Set up test data."""
+        self.machine_arch = MachineArchitecture.objects.create(name='x86_64')
+        self.repo = Repository.objects.create(name='baseos', arch=self.machine_arch, repotype=Repository.RPM)
+
+    def probe_results(self, latencies):
+        return {f'{url.rstrip("/")}/repodata/repomd.xml': latency for url, latency in zip(self.urls, latencies)}
+
+    def refreshed_urls(self):
+        return set(self.repo.mirror_set.filter(refresh=True).values_list('url', flat=True))
+
+    def test_mirrors_added_in_list_order_without_probing(self):
+        """Test that mirrors are added in list order if not probed."""
+        add_mirrors_from_urls(self.repo, self.urls)
+        self.assertEqual(self.refreshed_urls(), set(self.urls[:2]))
+
+    @patch('repos.utils.probe_mirror_urls')
+    def test_fastest_mirrors_are_added(self, mock_probe):
+        """Test that the fastest healthy mirrors are added."""
+        mock_probe.return_value = self.probe_results([None, 0.5, 0.1])
+        add_mirrors_from_urls(self.repo, self.urls, probe_path='repodata/repomd.xml')
+        self.assertEqual(self.refreshed_urls(), {self.urls[1], self.urls[2]})
+        self.assertEqual(Mirror.objects.get(url=self.urls[2]).latency, 0.1)
+
+    @patch('repos.utils.probe_mirror_urls')
+    def test_slow_mirrors_are_demoted_and_promoted(self, mock_probe):
+        """Test that mirrors are demoted when slower and promoted when faster."""
+        mock_probe.return_value = self.probe_results([0.1, 0.2, 0.9])
+        add_mirrors_from_urls(self.repo, self.urls, probe_path='repodata/repomd.xml')
+        self.assertEqual(self.refreshed_urls(), {self.urls[0], self.urls[1]})
+
+        mock_probe.return_value = self.probe_results([None, 0.2, 0.1])
+        add_mirrors_from_urls(self.repo, self.urls, probe_path='repodata/repomd.xml')
+        self.assertEqual(self.refreshed_urls(), {self.urls[1], self.urls[2]})
+        self.assertFalse(Mirror.objects.get(url=self.urls[0]).refresh)
+
+    def test_order_mirrors_by_speed(self):
+        """Test that mirrors without measurements are refreshed last."""
+        slow = Mirror.objects.create(repo=self.repo, url=self.urls[0], latency=0.9)
+        unknown = Mirror.objects.create(repo=self.repo, url=self.urls[1])
+        fast = Mirror.objects.create(repo=self.repo, url=self.urls[2], latency=0.1)
+        self.assertEqual(list(order_mirrors_by_speed(self.repo.mirror_set.all())), [fast, slow, unknown])
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class RefreshSchedulingTests(TestCase):
+    """Tests for mirror change stats and adaptive repo refresh scheduling."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.machine_arch = MachineArchitecture.objects.create(name='x86_64')
+        self.now = timezone.now()
+
+    def create_repo(self, name, change_interval=None, last_refresh=None, download_bytes=0, security=False):
+        repo = Repository.objects.create(name=name, arch=self.machine_arch, repotype=Repository.RPM,
+                                         security=security, last_refresh=last_refresh)
+        Mirror.objects.create(repo=repo, url=f'http://example.com/{name}', change_interval=change_interval,
+                              download_bytes=download_bytes)
+        return repo
+
+    def test_changes_are_recorded(self):
+        """Test that package changes update the last change time and change interval."""
+        repo = self.create_repo('updates')
+        mirror = repo.mirror_set.get()
+        record_mirror_diff(mirror, [1], [])
+        first_change = mirror.last_change
+        self.assertIsNotNone(first_change)
+        self.assertIsNone(mirror.change_interval)
+        mirror.last_change = first_change - timedelta(hours=10)
+        record_mirror_diff(mirror, [], [1])
+        mirror.refresh_from_db()
+        self.assertAlmostEqual(mirror.change_interval, 10 * 3600, delta=60)
+        record_mirror_diff(mirror, [], [])
+        mirror.refresh_from_db()
+        self.assertAlmostEqual(mirror.change_interval, 10 * 3600, delta=60)
+
+    def test_refresh_interval(self):
+        """Test that repos are refreshed twice as often as they change, within the limits."""
+        self.assertEqual(get_repo_refresh_interval(self.create_repo('new')), timedelta(hours=24))
+        self.assertEqual(get_repo_refresh_interval(self.create_repo('daily', 86400)), timedelta(hours=12))
+        self.assertEqual(get_repo_refresh_interval(self.create_repo('fast', 600)), timedelta(hours=1))
+        self.assertEqual(get_repo_refresh_interval(self.create_repo('slow', 86400 * 60)), timedelta(hours=168))
+        self.assertEqual(get_repo_refresh_interval(self.create_repo('security', 86400 * 60, security=True)),
+                         timedelta(hours=24))
+
+    def test_only_due_repos_are_scheduled(self):
+        """Test that repos are scheduled when their refresh interval has passed, most overdue first."""
+        self.create_repo('fresh', 86400, last_refresh=self.now - timedelta(hours=1))
+        self.create_repo('due', 86400, last_refresh=self.now - timedelta(hours=13))
+        self.create_repo('overdue', 86400, last_refresh=self.now - timedelta(hours=48))
+        self.create_repo('never')
+        repos = get_repos_due_for_refresh(Repository.objects.all(), self.now)
+        self.assertEqual([r.name for r in repos], ['never', 'overdue', 'due'])
+
+    @override_settings(REPO_REFRESH_MAX_REPOS=2, REPO_REFRESH_BANDWIDTH=10)
+    def test_refresh_budget(self):
+        """Test that the scheduled repos are limited by count and bandwidth."""
+        mb = 1024 * 1024
+        self.create_repo('a', 86400, last_refresh=self.now - timedelta(hours=48), download_bytes=8 * mb)
+        self.create_repo('b', 86400, last_refresh=self.now - timedelta(hours=36), download_bytes=8 * mb)
+        self.create_repo('c', 86400, last_refresh=self.now - timedelta(hours=24), download_bytes=1 * mb)
+        self.create_repo('d', 86400, last_refresh=self.now - timedelta(hours=13), download_bytes=1 * mb)
+        repos = get_repos_due_for_refresh(Repository.objects.all(), self.now)
+        self.assertEqual([r.name for r in repos], ['a', 'c'])
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class MoveMirrorsTests(TestCase):
+    """Tests for moving mirrors between repos."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.machine_arch = MachineArchitecture.objects.create(name='x86_64')
+        self.repos = [
+            Repository.objects.create(name=f'repo-{i}', arch=self.machine_arch, repotype=Repository.RPM)
+            for i in range(3)
+        ]
+        self.mirrors = [
+            Mirror.objects.create(repo=repo, url=f'http://example.com/{repo.name}') for repo in self.repos[:2]
+        ]
+        domain = Domain.objects.create(name='example.com')
+        osrelease = OSRelease.objects.create(name='Rocky Linux 9')
+        osvariant = OSVariant.objects.create(name='Rocky Linux 9.4', osrelease=osrelease)
+        self.hosts = [
+            Host.objects.create(hostname=f'host{i}.example.com', ipaddress=f'192.168.1.{i}', osvariant=osvariant,
+                                arch=self.machine_arch, domain=domain, lastreport=timezone.now())
+            for i in range(2)
+        ]
+
+    def test_mirrors_and_host_repos_are_moved(self):
+        """Test that mirrors and host repos are moved and emptied repos are deleted."""
+        HostRepo.objects.create(host=self.hosts[0], repo=self.repos[0])
+        HostRepo.objects.create(host=self.hosts[0], repo=self.repos[1])
+        HostRepo.objects.create(host=self.hosts[1], repo=self.repos[1])
+        HostRepo.objects.create(host=self.hosts[1], repo=self.repos[2])
+        move_mirrors([m.id for m in self.mirrors], self.repos[2])
+        self.assertEqual(set(Mirror.objects.values_list('repo_id', flat=True)), {self.repos[2].id})
+        self.assertEqual(list(Repository.objects.values_list('id', flat=True)), [self.repos[2].id])
+        self.assertEqual(
+            sorted(HostRepo.objects.values_list('host_id', 'repo_id')),
+            [(self.hosts[0].id, self.repos[2].id), (self.hosts[1].id, self.repos[2].id)],
+        )
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class RepositoryCountsTests(TestCase):
+    """Tests for the cached repository and package counts."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.machine_arch = MachineArchitecture.objects.create(name='x86_64')
+        self.repos = [
+            Repository.objects.create(name=f'repo-{i}', arch=self.machine_arch, repotype=Repository.RPM)
+            for i in range(2)
+        ]
+        self.mirrors = [
+            Mirror.objects.create(repo=repo, url=f'http://example.com/{repo.name}') for repo in self.repos
+        ]
+        self.packages = {
+            PackageString(name=name, epoch='', version='1.0', release='1', arch='x86_64', packagetype='R')
+            for name in ['curl', 'openssl']
+        }
+
+    def get_package(self, name):
+        return Package.objects.get(name__name=name)
+
+    def test_counts_are_updated_by_mirror_sync(self):
+        """Test that a mirror sync updates repo and package counts."""
+        update_mirror_packages(self.mirrors[0], self.packages)
+        update_mirror_packages(self.mirrors[1], {p for p in self.packages if p.name == 'curl'})
+        self.assertEqual(self.get_package('curl').repos_count, 2)
+        self.assertEqual(self.get_package('openssl').repos_count, 1)
+        repo = Repository.objects.get(id=self.repos[0].id)
+        self.assertEqual(repo.packages_count, 2)
+        self.assertIsNotNone(repo.last_change)
+
+    def test_security_packages_are_counted(self):
+        """Test that packages that fix security errata are counted."""
+        update_mirror_packages(self.mirrors[0], self.packages)
+        erratum = Erratum.objects.create(name='RLSA-2024:1', e_type='security', synopsis='curl',
+                                         issue_date=timezone.now())
+        erratum.fixed_packages.add(self.get_package('curl'))
+        update_mirror_packages(self.mirrors[0], {p for p in self.packages if p.name == 'curl'})
+        repo = Repository.objects.get(id=self.repos[0].id)
+        self.assertEqual(repo.packages_count, 1)
+        self.assertEqual(repo.security_packages_count, 1)
+
+    def test_counts_are_updated_by_mirror_delete(self):
+        """Test that deleting mirrors updates repo and package counts."""
+        update_mirror_packages(self.mirrors[0], self.packages)
+        update_mirror_packages(self.mirrors[1], self.packages)
+        delete_mirrors([self.mirrors[1].id])
+        self.assertEqual(self.get_package('curl').repos_count, 1)
+        self.assertEqual(Repository.objects.get(id=self.repos[1].id).packages_count, 0)
+
+    def test_counts_are_updated_once_per_mirror_sync(self):
+        """Test that a mirror sync recounts only the repo of the mirror, once."""
+        with patch('repos.utils.update_repo_counts') as update_repo_counts:
+            update_mirror_packages(self.mirrors[0], self.packages)
+        update_repo_counts.assert_called_once()
+        self.assertEqual(update_repo_counts.call_args.args[0], [self.repos[0].id])
+
+    def test_security_counts_are_updated_after_errata(self):
+        """Test that only the repos whose security package count changed are updated."""
+        update_mirror_packages(self.mirrors[0], self.packages)
+        update_mirror_packages(self.mirrors[1], {p for p in self.packages if p.name == 'openssl'})
+        erratum = Erratum.objects.create(name='RLSA-2024:1', e_type='security', synopsis='curl',
+                                         issue_date=timezone.now())
+        erratum.fixed_packages.add(self.get_package('curl'))
+        update_repo_security_counts()
+        self.assertEqual(
+            list(Repository.objects.order_by('name').values_list('security_packages_count', flat=True)),
+            [1, 0],
+        )
@@ -14,11 +14,14 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
+from unittest.mock import patch
+
 from django.test import TestCase, override_settings
 
 from arch.models import MachineArchitecture, PackageArchitecture
-from packages.models import Package, PackageName
+from packages.models import Package, PackageName, PackageString
 from repos.models import Mirror, MirrorPackage, Repository
+from repos.utils import update_mirror_packages
 
 
 @override_settings(
@@ -191,3 +194,83 @@ class MirrorPackageMethodTests(TestCase):
             package=self.package,
         )
         self.assertEqual(self.package.repo_count(), 1)
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class RepositoryRefreshSummaryTests(TestCase):
+    """Tests for refresh summaries and dry runs."""
+
+    def setUp(self):
+        """Set up a deb repo with one package on its mirror."""
+        arch = MachineArchitecture.objects.create(name='amd64')
+        self.repo = Repository.objects.create(name='trixie-main', arch=arch, repotype=Repository.DEB)
+        self.mirror = Mirror.objects.create(repo=self.repo, url='http://deb.example.com/debian/dists/trixie/main')
+        self.bash = PackageString(name='bash', epoch='', version='5.2.37', release='2', arch='amd64',
+                                  packagetype='D')
+        self.curl = PackageString(name='curl', epoch='', version='8.14.1', release='2', arch='amd64',
+                                  packagetype='D')
+        update_mirror_packages(self.mirror, {self.bash})
+
+    def fake_refresh(self, repo, dry_run=False, full_diff=False):
+        return {mirror.id: update_mirror_packages(mirror, {self.curl}, dry_run, full_diff)
+                for mirror in repo.mirror_set.all()}
+
+    @patch('repos.models.refresh_deb_repo')
+    def test_refresh_returns_and_stores_diff(self, mock_refresh):
+        """Test that a refresh returns the changes and stores them on the mirror."""
+        mock_refresh.side_effect = self.fake_refresh
+        summary = self.repo.refresh(full_diff=True)
+        self.assertFalse(summary['dry_run'])
+        self.assertEqual((summary['added'], summary['removed']), (1, 1))
+        mirror_summary = summary['mirrors'][0]
+        self.assertEqual(mirror_summary['added_packages'], ['curl_8.14.1-2_amd64.deb'])
+        self.assertEqual(mirror_summary['removed_packages'], ['bash_5.2.37-2_amd64.deb'])
+        self.mirror.refresh_from_db()
+        self.assertEqual(self.mirror.last_diff['added'], 1)
+        self.assertNotIn('added_ids', self.mirror.last_diff)
+        self.assertEqual([p.name.name for p in self.mirror.packages.all()], ['curl'])
+
+    @patch('repos.models.refresh_deb_repo')
+    def test_dry_run_does_not_write(self, mock_refresh):
+        """Test that a dry run computes the changes without saving them."""
+        mock_refresh.side_effect = self.fake_refresh
+        summary = self.repo.refresh(dry_run=True)
+        self.assertTrue(summary['dry_run'])
+        self.assertEqual((summary['added'], summary['removed']), (1, 1))
+        self.assertNotIn('added_packages', summary['mirrors'][0])
+        self.assertEqual(mock_refresh.call_args.args, (self.repo, True, False))
+        self.assertEqual([p.name.name for p in self.mirror.packages.all()], ['bash'])
+        self.assertFalse(PackageName.objects.filter(name='curl').exists())
+        self.mirror.refresh_from_db()
+        self.assertEqual(self.mirror.last_diff['removed'], 0)
+        self.assertIsNone(self.repo.last_refresh)
+
+    @patch('repos.models.refresh_deb_repo')
+    def test_dry_run_full_diff(self, mock_refresh):
+        """Test that a dry run lists packages that do not exist yet."""
+        mock_refresh.side_effect = self.fake_refresh
+        summary = self.repo.refresh(dry_run=True, full_diff=True)
+        mirror_summary = summary['mirrors'][0]
+        self.assertEqual(mirror_summary['added_packages'], ['curl_8.14.1-2_amd64.deb'])
+        self.assertEqual(mirror_summary['removed_packages'], ['bash_5.2.37-2_amd64.deb'])
+        self.assertEqual(mirror_summary['packages'], 1)
+        mock_refresh.assert_called_once_with(self.repo, True, True)
+
+    @patch('repos.models.refresh_deb_repo')
+    def test_unchanged_mirrors_are_not_summarised(self, mock_refresh):
+        """Test that mirrors without changes in this refresh are left out."""
+        mock_refresh.return_value = {}
+        summary = self.repo.refresh()
+        self.assertEqual(summary['mirrors'], [])
+
+    def test_package_ids_are_only_returned_for_diffs(self):
+        """Test that package ids are only collected for dry runs or full diffs."""
+        diff = update_mirror_packages(self.mirror, {self.curl})
+        self.assertEqual((diff['added'], diff['removed']), (1, 1))
+        self.assertNotIn('added_ids', diff)
+        diff = update_mirror_packages(self.mirror, {self.bash}, full_diff=True)
+        self.assertEqual(len(diff['added_ids']), 1)
+        self.assertEqual(len(diff['removed_ids']), 1)
@@ -0,0 +1,514 @@
+# Copyright 2026 Marcus Furlong <furlongm@gmail.com>
+#
+# This file is part of Patchman.
+#
+# Patchman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 only.
+#
+# Patchman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchman. If not, see <http://www.gnu.org/licenses/>
+
+import gzip
+import hashlib
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+from debian.deb822 import Release
+from django.test import TestCase, override_settings
+
+from arch.models import MachineArchitecture
+from repos.models import Mirror, Repository
+from repos.repo_types.arch import extract_arch_packages, iter_arch_packages
+from repos.repo_types.deb import (
+    extract_deb_packages, extract_deb_packages_chunk, find_deb_packages_index,
+    get_deb_packages_checksum, get_deb_release_location, split_deb_stanzas,
+)
+from repos.repo_types.gentoo import (
+    GENTOO_MANIFESTS_CACHE_TIMEOUT, extract_gentoo_overlay_packages,
+    extract_gentoo_snapshot_packages, get_gentoo_ebuild_keywords,
+    get_gentoo_overlay_head,
+)
+from repos.repo_types.yast import (
+    extract_yast_packages, get_yast_packages_checksum, refresh_yast_repo,
+)
+from repos.repo_types.yum import (
+    extract_module_metadata, extract_yum_packages, extract_yum_packages_chunk,
+    split_yum_packages,
+)
+from util import SpooledContent
+
+DEB_RELEASE = '''Origin: Debian
+Suite: stable
+Codename: trixie
+SHA256:
+ 1111111111111111111111111111111111111111111111111111111111111111 45000000 main/binary-amd64/Packages
+ 2222222222222222222222222222222222222222222222222222222222222222  9000000 main/binary-amd64/Packages.gz
+ 3333333333333333333333333333333333333333333333333333333333333333  7000000 main/binary-amd64/Packages.xz
+ 4444444444444444444444444444444444444444444444444444444444444444      113 main/binary-amd64/Release
+ 5555555555555555555555555555555555555555555555555555555555555555  8000000 contrib/binary-amd64/Packages.gz
+'''
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class DebReleaseTests(TestCase):
+    """Tests for deb repo Release file handling."""
+
+    def test_release_location_dist_repo(self):
+        """Test splitting a dists mirror url into Release url and index path."""
+        url = 'http://deb.debian.org/debian/dists/trixie/main/binary-amd64'
+        release_url, index_path = get_deb_release_location(url)
+        self.assertEqual(release_url, 'http://deb.debian.org/debian/dists/trixie')
+        self.assertEqual(index_path, 'main/binary-amd64')
+
+    def test_release_location_strips_packages_file(self):
+        """Test that a stored Packages file suffix is ignored."""
+        url = 'http://deb.debian.org/debian/dists/trixie/main/binary-amd64/Packages.gz'
+        release_url, index_path = get_deb_release_location(url)
+        self.assertEqual(release_url, 'http://deb.debian.org/debian/dists/trixie')
+        self.assertEqual(index_path, 'main/binary-amd64')
+
+    def test_release_location_flat_repo(self):
+        """Test that flat repos have the Release file next to Packages."""
+        url = 'http://repo.example.com/flat/'
+        release_url, index_path = get_deb_release_location(url)
+        self.assertEqual(release_url, 'http://repo.example.com/flat')
+        self.assertEqual(index_path, '')
+
+    def test_find_index_prefers_best_compression(self):
+        """Test that xz is chosen and the uncompressed checksum is used to detect changes."""
+        index = find_deb_packages_index(Release(DEB_RELEASE), 'main/binary-amd64')
+        self.assertEqual(index['path'], 'main/binary-amd64/Packages.xz')
+        self.assertEqual(index['sha256'], '3' * 64)
+        self.assertEqual(index['size'], 7000000)
+        self.assertEqual(index['checksum'], '1' * 64)
+
+    def test_find_index_without_uncompressed_entry(self):
+        """Test that the compressed checksum is used if Packages is not listed."""
+        index = find_deb_packages_index(Release(DEB_RELEASE), 'contrib/binary-amd64')
+        self.assertEqual(index['path'], 'contrib/binary-amd64/Packages.gz')
+        self.assertEqual(index['checksum'], '5' * 64)
+
+    def test_find_index_missing_component(self):
+        """Test that None is returned if the index is not listed."""
+        index = find_deb_packages_index(Release(DEB_RELEASE), 'non-free/binary-amd64')
+        self.assertIsNone(index)
+
+    def test_probed_index_checksum(self):
+        """Test that probed indexes are checksummed like the Packages files listed in a Release."""
+        data = b'Package: bash\nVersion: 5.2.37-2\nArchitecture: amd64\n'
+        checksum = hashlib.sha256(data).hexdigest()
+        self.assertEqual(get_deb_packages_checksum(gzip.compress(data), 'Packages.gz'), checksum)
+        self.assertEqual(get_deb_packages_checksum(data, 'Packages'), checksum)
+
+
+DEB_PACKAGES = '''Package: bash
+Version: 5.2.37-2
+Architecture: amd64
+
+Package: libc6
+Version: 1:2.41-12
+Architecture: amd64
+
+Package: tzdata
+Version: 2025b
+Architecture: all
+'''
+
+YUM_PRIMARY = b'''<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="3">
+<package type="rpm"><name>bash</name><arch>x86_64</arch>
+<version epoch="0" ver="5.1.8" rel="9.el9"/></package>
+<package type="rpm"><name>NetworkManager</name><arch>x86_64</arch>
+<version epoch="1" ver="1.48.10" rel="2.el9"/></package>
+<package type="rpm"><name>tzdata</name><arch>noarch</arch>
+<version epoch="0" ver="2025b" rel="1.el9"/></package>
+</metadata>
+'''
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class ChunkedParsingTests(TestCase):
+    """Tests for splitting repo metadata into independently parsed chunks."""
+
+    def test_split_deb_stanzas(self):
+        """Test that deb chunks only split between stanzas."""
+        chunks = list(split_deb_stanzas(BytesIO(DEB_PACKAGES.encode()), chunk_size=10))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunks), DEB_PACKAGES)
+        packages = []
+        for chunk in chunks:
+            packages += extract_deb_packages_chunk(chunk)
+        self.assertIn(('libc6', '1', '2.41', '12', 'amd64'), packages)
+        self.assertIn(('tzdata', '', '2025b', '', 'all'), packages)
+
+    def test_split_yum_packages(self):
+        """Test that yum chunks are well-formed and cover all packages."""
+        chunks, plen = split_yum_packages(BytesIO(YUM_PRIMARY), chunk_size=10)
+        chunks = list(chunks)
+        self.assertEqual(plen, 3)
+        self.assertEqual(len(chunks), 3)
+        packages = []
+        for chunk in chunks:
+            packages += extract_yum_packages_chunk(chunk)
+        self.assertEqual(len(packages), 3)
+        self.assertIn(('bash', '', '5.1.8', '9.el9', 'x86_64'), packages)
+        self.assertIn(('networkmanager', '1', '1.48.10', '2.el9', 'x86_64'), packages)
+
+    @override_settings(CONCURRENT_PROCESSING=False)
+    def test_extract_yum_packages(self):
+        """Test extracting PackageStrings from a whole primary.xml."""
+        packages = extract_yum_packages(YUM_PRIMARY, 'primary.xml')
+        self.assertEqual(len(packages), 3)
+        self.assertEqual({p.name for p in packages}, {'bash', 'networkmanager', 'tzdata'})
+
+    def test_chunks_are_split_while_reading(self):
+        """Test that chunks are yielded before the whole file has been read."""
+        reader = BytesIO(YUM_PRIMARY)
+        with patch('repos.repo_types.yum.PARSE_READ_SIZE', 7):
+            chunks, plen = split_yum_packages(reader, chunk_size=10)
+            self.assertIn(b'<name>bash</name>', next(chunks))
+            self.assertLess(reader.tell(), len(YUM_PRIMARY))
+            self.assertEqual(len(list(chunks)), 2)
+        reader = BytesIO(DEB_PACKAGES.encode())
+        with patch('repos.repo_types.deb.PARSE_READ_SIZE', 7):
+            chunks = split_deb_stanzas(reader, chunk_size=10)
+            self.assertTrue(next(chunks).startswith('Package: bash'))
+            self.assertLess(reader.tell(), len(DEB_PACKAGES))
+            self.assertEqual(''.join(chunks), DEB_PACKAGES[DEB_PACKAGES.find('Package: libc6'):])
+
+    @override_settings(CONCURRENT_PROCESSING=False)
+    def test_extract_deb_packages(self):
+        """Test extracting PackageStrings from a compressed Packages file."""
+        packages = extract_deb_packages(gzip.compress(DEB_PACKAGES.encode()), 'Packages.gz')
+        self.assertEqual({p.name for p in packages}, {'bash', 'libc6', 'tzdata'})
+        self.assertIsNone(extract_deb_packages(b'Package: \xff\n', 'Packages'))
+
+
+def make_arch_db(descs):
+    """Build a gzipped arch linux repo db from a dict of path: desc."""
+    bio = BytesIO()
+    with tarfile.open(fileobj=bio, mode='w:gz') as tf:
+        for path, desc in descs.items():
+            tarinfo = tarfile.TarInfo(path)
+            tarinfo.size = len(desc)
+            tf.addfile(tarinfo, BytesIO(desc))
+    return bio.getvalue()
+
+
+ARCH_DB = {
+    'bash-5.2.037-5/desc': b'%FILENAME%\nbash-5.2.037-5-x86_64.pkg.tar.zst\n\n%NAME%\nbash\n\n'
+                           b'%BASE%\nbash\n\n%VERSION%\n5.2.037-5\n\n%ARCH%\nx86_64\n',
+    'Python-1:3.13.1-1/desc': b'%NAME%\nPython\n\n%VERSION%\n1:3.13.1-1\n\n%ARCH%\nx86_64\n',
+    'broken-1.0-1/desc': b'%NAME%\nbroken\n',
+}
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class ArchDbTests(TestCase):
+    """Tests for reading arch linux repo db files."""
+
+    def test_iter_arch_packages(self):
+        """Test that name, version and arch are read from each desc file."""
+        packages = list(iter_arch_packages(make_arch_db(ARCH_DB)))
+        self.assertEqual(packages, [
+            ('bash', '', '5.2.037', '5', 'x86_64'),
+            ('Python', '1', '3.13.1', '1', 'x86_64'),
+        ])
+
+    def test_extract_arch_packages(self):
+        """Test extracting PackageStrings from an arch linux repo db."""
+        packages = extract_arch_packages(make_arch_db(ARCH_DB))
+        self.assertEqual({p.name for p in packages}, {'bash', 'python'})
+
+    def test_iter_spooled_arch_packages(self):
+        """Test that spooled arch linux repo dbs are streamed from the mmap."""
+        data = make_arch_db(ARCH_DB)
+        spooled = SpooledContent(-1, len(data))
+        spooled.write(data)
+        packages = list(iter_arch_packages(spooled))
+        self.assertEqual([p[0] for p in packages], ['bash', 'Python'])
+
+    def test_extract_invalid_arch_db(self):
+        """Test that invalid data returns no packages."""
+        self.assertEqual(extract_arch_packages(b'not a tarfile'), set())
+
+
+def make_gentoo_snapshot(files):
+    """Build an xz compressed Gentoo snapshot from a dict of path: content."""
+    bio = BytesIO()
+    with tarfile.open(fileobj=bio, mode='w:xz') as tf:
+        for path, content in files.items():
+            tarinfo = tarfile.TarInfo(f'gentoo-20260101/{path}')
+            tarinfo.size = len(content)
+            tf.addfile(tarinfo, BytesIO(content))
+    return bio.getvalue()
+
+
+GENTOO_SNAPSHOT = {
+    'app-shells/Manifest.gz': b'app-shells manifest',
+    'app-shells/bash/bash-5.2_p37.ebuild': b'EAPI=8\nKEYWORDS="amd64 ~arm64 x86"\n',
+    'dev-lang/Manifest.gz': b'dev-lang manifest',
+    'dev-lang/python/python-3.13.1-r1.ebuild': b'EAPI=8\nKEYWORDS="amd64"\n',
+    'skel.ebuild': b'KEYWORDS="alpha"\n',
+}
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class GentooTests(TestCase):
+    """Tests for Gentoo repo refreshes."""
+
+    def setUp(self):
+        """Set up test data."""
+        from django.core.cache import cache
+        cache.clear()
+        machine_arch = MachineArchitecture.objects.create(name='amd64')
+        repo = Repository.objects.create(name='gentoo', arch=machine_arch, repotype=Repository.GENTOO)
+        self.mirror = Mirror.objects.create(repo=repo, url='http://mirror.example.com/gentoo-latest.tar.xz')
+
+    def snapshot_response(self, data):
+        response = MagicMock()
+        response.raw = BytesIO(data)
+        return response
+
+    def test_ebuild_keywords(self):
+        """Test that unstable and removed keywords are ignored."""
+        self.assertEqual(get_gentoo_ebuild_keywords(b'KEYWORDS="amd64 ~arm64 -x86"\n'), {'amd64'})
+
+    def test_extract_snapshot_packages(self):
+        """Test that packages are extracted from a streamed snapshot."""
+        data = make_gentoo_snapshot(GENTOO_SNAPSHOT)
+        checksum = hashlib.md5(data).hexdigest()
+        packages, manifests = extract_gentoo_snapshot_packages(self.mirror, self.snapshot_response(data), checksum)
+        self.assertEqual(
+            {(p.category, p.name, p.version, p.release, p.arch) for p in packages},
+            {('app-shells', 'bash', '5.2_p37', '', 'amd64'),
+             ('app-shells', 'bash', '5.2_p37', '', 'x86'),
+             ('dev-lang', 'python', '3.13.1', 'r1', 'amd64')},
+        )
+        self.assertEqual(set(manifests), {'app-shells', 'dev-lang'})
+
+    def test_extract_snapshot_invalid_checksum(self):
+        """Test that a snapshot with an invalid checksum is rejected."""
+        data = make_gentoo_snapshot(GENTOO_SNAPSHOT)
+        self.assertIsNone(extract_gentoo_snapshot_packages(self.mirror, self.snapshot_response(data), 'invalid'))
+
+    def test_unchanged_categories_are_skipped(self):
+        """Test that categories with an unchanged Manifest reuse existing packages."""
+        from django.core.cache import cache
+
+        from repos.utils import update_mirror_packages
+        data = make_gentoo_snapshot(GENTOO_SNAPSHOT)
+        checksum = hashlib.md5(data).hexdigest()
+        packages, manifests = extract_gentoo_snapshot_packages(self.mirror, self.snapshot_response(data), checksum)
+        update_mirror_packages(self.mirror, packages)
+        self.mirror.packages_checksum = checksum
+        self.mirror.save()
+        cache.set(f'gentoo_manifests_{self.mirror.id}', {'checksum': checksum, 'manifests': manifests},
+                  GENTOO_MANIFESTS_CACHE_TIMEOUT)
+
+        snapshot = dict(GENTOO_SNAPSHOT)
+        snapshot['app-shells/bash/bash-5.2_p37.ebuild'] = b'KEYWORDS="arm64"\n'
+        data = make_gentoo_snapshot(snapshot)
+        checksum = hashlib.md5(data).hexdigest()
+        packages, _ = extract_gentoo_snapshot_packages(self.mirror, self.snapshot_response(data), checksum)
+        arches = {p.arch for p in packages if p.name == 'bash'}
+        self.assertEqual(arches, {'amd64', 'x86'})
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class GentooOverlayTests(TestCase):
+    """Tests for incremental Gentoo overlay refreshes."""
+
+    def setUp(self):
+        """Set up a local overlay git repo and a metadata cache."""
+        self.overlay = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.overlay)
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.git('init', '-q')
+        self.commit('app-misc/foo/foo-1.0.ebuild', b'KEYWORDS="amd64"\n')
+        machine_arch = MachineArchitecture.objects.create(name='amd64')
+        repo = Repository.objects.create(
+            name='overlay', arch=machine_arch, repotype=Repository.GENTOO, repo_id='overlay')
+        self.mirror = Mirror.objects.create(repo=repo, url=self.overlay)
+
+    def git(self, *args):
+        env = dict(os.environ, GIT_AUTHOR_NAME='test', GIT_AUTHOR_EMAIL='test@example.com',
+                   GIT_COMMITTER_NAME='test', GIT_COMMITTER_EMAIL='test@example.com')
+        subprocess.run(['git', *args], cwd=self.overlay, env=env, check=True, capture_output=True)
+
+    def commit(self, path, content):
+        os.makedirs(os.path.join(self.overlay, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(self.overlay, path), 'wb') as f:
+            f.write(content)
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', path)
+
+    def test_incremental_refresh(self):
+        """Test that only changed ebuilds are parsed after the first refresh."""
+        from repos.utils import update_mirror_packages
+        with self.settings(METADATA_CACHE_DIR=self.cache_dir):
+            head = get_gentoo_overlay_head(self.overlay)
+            packages = extract_gentoo_overlay_packages(self.mirror, head)
+            update_mirror_packages(self.mirror, packages)
+            self.mirror.packages_checksum = head
+            self.mirror.save()
+
+            self.commit('app-misc/foo/foo-2.0.ebuild', b'KEYWORDS="amd64"\n')
+            os.remove(os.path.join(self.overlay, 'app-misc/foo/foo-1.0.ebuild'))
+            self.git('commit', '-q', '-a', '-m', 'remove foo-1.0')
+            head = get_gentoo_overlay_head(self.overlay)
+            packages = extract_gentoo_overlay_packages(self.mirror, head)
+        self.assertEqual({p.version for p in packages}, {'2.0'})
+
+    @patch('repos.repo_types.gentoo.update_gentoo_overlay_packages')
+    def test_full_refresh_without_metadata_cache(self, update_gentoo_overlay_packages):
+        """Test that overlays are cloned and fully parsed if the metadata cache is disabled."""
+        self.mirror.packages_checksum = get_gentoo_overlay_head(self.overlay)
+        with self.settings(METADATA_CACHE_DIR=''):
+            packages = extract_gentoo_overlay_packages(self.mirror, self.mirror.packages_checksum)
+        self.assertEqual({p.version for p in packages}, {'1.0'})
+        update_gentoo_overlay_packages.assert_not_called()
+
+
+MODULES_YAML = b'''---
+document: modulemd
+version: 2
+data:
+  name: nodejs
+  stream: "18"
+  version: 9040020240703
+  context: rhel9
+  arch: x86_64
+  artifacts:
+    rpms:
+    - nodejs-1:18.20.2-2.module+el9.4.0+21731+46b5c412.x86_64
+    - npm-1:10.5.0-1.18.20.2.2.module+el9.4.0+21731+46b5c412.x86_64
+...
+---
+document: modulemd-defaults
+version: 1
+data:
+  module: nodejs
+  stream: "18"
+...
+'''
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class ModuleMetadataTests(TestCase):
+    """Tests for yum modules.yaml extraction."""
+
+    def setUp(self):
+        """Set up test data."""
+        machine_arch = MachineArchitecture.objects.create(name='x86_64')
+        self.repo = Repository.objects.create(name='appstream', arch=machine_arch, repotype=Repository.RPM)
+
+    def test_extract_module_metadata(self):
+        """Test that modules are created with their packages."""
+        modules = extract_module_metadata(MODULES_YAML, 'modules.yaml', self.repo)
+        self.assertEqual(len(modules), 1)
+        module = modules.pop()
+        self.assertEqual((module.name, module.stream), ('nodejs', '18'))
+        self.assertEqual({p.name.name for p in module.packages.all()}, {'nodejs', 'npm'})
+
+    def test_module_packages_are_updated(self):
+        """Test that removed artifacts are removed from an existing module."""
+        extract_module_metadata(MODULES_YAML, 'modules.yaml', self.repo)
+        data = MODULES_YAML.replace(b'    - npm-1:10.5.0-1.18.20.2.2.module+el9.4.0+21731+46b5c412.x86_64\n', b'')
+        module = extract_module_metadata(data, 'modules.yaml', self.repo).pop()
+        self.assertEqual([p.name.name for p in module.packages.all()], ['nodejs'])
+
+
+YAST_PACKAGES = b'''=Ver: 2.0
+##----------------------------------------
+=Pkg: zypper 1.14.68 150500.1.1 x86_64
+=Cks: SHA256 aaaa
+=Grp: System/Packages
+##----------------------------------------
+=Pkg: Bash 4.4 150400.27.3.2 x86_64
+=Cks: SHA256 bbbb
+'''
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class YastTests(TestCase):
+    """Tests for yast repo refreshes."""
+
+    def setUp(self):
+        """Set up test data."""
+        machine_arch = MachineArchitecture.objects.create(name='x86_64')
+        self.repo = Repository.objects.create(name='suse', arch=machine_arch, repotype=Repository.RPM)
+        self.mirror = Mirror.objects.create(repo=self.repo, url='http://example.com/suse')
+        self.package_data = gzip.compress(YAST_PACKAGES)
+        self.checksum = hashlib.sha256(self.package_data).hexdigest()
+        self.content = f'DESCRDIR suse/setup/descr\nMETA SHA256 {self.checksum} packages.gz\n'.encode()
+
+    def test_extract_yast_packages(self):
+        """Test that packages are read from the yast packages file."""
+        packages = extract_yast_packages(self.package_data)
+        self.assertEqual({(p.name, p.version, p.release) for p in packages}, {
+            ('zypper', '1.14.68', '150500.1.1'),
+            ('bash', '4.4', '150400.27.3.2'),
+        })
+
+    def test_get_yast_packages_checksum(self):
+        """Test that the packages checksum is read from the content file."""
+        self.assertEqual(get_yast_packages_checksum(self.content), (self.checksum, 'sha256'))
+        self.assertEqual(get_yast_packages_checksum(b'DESCRDIR suse/setup/descr\n'), (None, None))
+
+    def test_unchanged_mirror_is_skipped(self):
+        """Test that the packages file is not fetched if its checksum has not changed."""
+        self.mirror.packages_checksum = self.checksum
+        self.mirror.save()
+        with patch('repos.repo_types.yast.fetch_mirror_data') as fetch_mirror_data:
+            refresh_yast_repo(self.mirror, self.content)
+        fetch_mirror_data.assert_not_called()
+
+    def test_checksum_is_computed_without_content_checksum(self):
+        """Test that the packages file checksum is computed if the content file has none."""
+        with patch('repos.repo_types.yast.fetch_mirror_data', return_value=self.package_data):
+            refresh_yast_repo(self.mirror, b'DESCRDIR suse/setup/descr\n')
+        self.mirror.refresh_from_db()
+        self.assertEqual(self.mirror.packages_checksum, self.checksum)
+        self.assertEqual(self.mirror.packages.count(), 2)
+
+    def test_checksum_is_not_stored_without_packages(self):
+        """Test that a packages file without packages fails the mirror and is retried."""
+        with patch('repos.repo_types.yast.fetch_mirror_data', return_value=gzip.compress(b'=Ver: 2.0\n')):
+            refresh_yast_repo(self.mirror, self.content)
+        self.mirror.refresh_from_db()
+        self.assertIsNone(self.mirror.packages_checksum)
+        self.assertEqual(self.mirror.fail_count, 1)
@@ -4,6 +4,7 @@ from django.urls import reverse
 
 from arch.models import MachineArchitecture
 from repos.models import Mirror, Repository
+from repos.utils import get_bulk_progress, set_bulk_progress
 
 
 @override_settings(
@@ -66,6 +67,39 @@ class RepoBulkActionTests(TestCase):
             r.enabled for r in Repository.objects.all()
         ))
 
+    def test_bulk_disable_cascades_to_mirrors(self):
+        """Test that bulk disabling repos also disables their mirrors."""
+        for i, repo in enumerate(self.repos):
+            Mirror.objects.create(repo=repo, url=f'http://mirror{i}.example.com/repo')
+        self.client.post(reverse('repos:repo_bulk_action'), {
+            'action': 'disable',
+            'selected_ids': [str(self.repos[0].id)],
+        })
+        mirror = Mirror.objects.get(repo=self.repos[0])
+        self.assertFalse(mirror.enabled)
+        self.assertFalse(mirror.refresh)
+        self.assertEqual(Mirror.objects.filter(enabled=True, refresh=True).count(), 2)
+
+    def test_bulk_progress_is_shown(self):
+        """Test that running background bulk operations are shown."""
+        set_bulk_progress('abc', 'Deleting 10 Repositories', 4, 10)
+        resp = self.client.get(reverse('repos:repo_list'))
+        self.assertContains(resp, 'Deleting 10 Repositories (4 / 10)')
+        set_bulk_progress('abc', 'Deleting 10 Repositories', 10, 10)
+        resp = self.client.get(reverse('repos:repo_list'))
+        self.assertNotContains(resp, 'Deleting 10 Repositories')
+
+    def test_bulk_progress_of_concurrent_operations(self):
+        """Test that concurrent background bulk operations keep their own progress."""
+        set_bulk_progress('abc', 'Deleting 10 Repositories', 0, 10)
+        set_bulk_progress('def', 'Deleting 5 Mirrors', 0, 5)
+        set_bulk_progress('abc', 'Deleting 10 Repositories', 4, 10)
+        set_bulk_progress('def', 'Deleting 5 Mirrors', 2, 5)
+        self.assertEqual([(p['text'], p['done']) for p in get_bulk_progress()],
+                         [('Deleting 10 Repositories', 4), ('Deleting 5 Mirrors', 2)])
+        set_bulk_progress('abc', 'Deleting 10 Repositories', 10, 10)
+        self.assertEqual([p['text'] for p in get_bulk_progress()], ['Deleting 5 Mirrors'])
+
 
 @override_settings(
     CELERY_TASK_ALWAYS_EAGER=True,
@@ -112,3 +146,33 @@ class MirrorBulkActionTests(TestCase):
         })
         self.assertEqual(resp.status_code, 302)
         self.assertEqual(Mirror.objects.count(), 1)
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class MirrorDetailTests(TestCase):
+    """Tests for mirror_detail view."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser', password='testpass'
+        )
+        self.client.login(username='testuser', password='testpass')
+        arch = MachineArchitecture.objects.create(name='x86_64')
+        repo = Repository.objects.create(name='repo-0', arch=arch, repotype='D')
+        self.mirror = Mirror.objects.create(
+            repo=repo,
+            url='http://mirror.example.com/repo',
+            change_interval=2 * 86400,
+            download_bytes=3 * 1024 * 1024,
+            download_duration=1.5,
+        )
+
+    def test_mirror_stats_are_shown(self):
+        """Test that the mirror change and download stats are shown."""
+        resp = self.client.get(reverse('repos:mirror_detail', args=[self.mirror.id]))
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, '2 days')
+        self.assertContains(resp, '3.0\xa0MB in 1.5s')
@@ -15,12 +15,19 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
+import os
 import re
-from io import BytesIO
+from datetime import timedelta
+from itertools import chain, islice
+from time import time
 
+import requests
 from defusedxml import ElementTree
-from django.db import IntegrityError
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from tenacity import RetryError
 
 from packages.models import Package
@@ -29,13 +36,30 @@ from packages.utils import (
 )
 from patchman.signals import pbar_start, pbar_update
 from util import (
-    Checksum, extract, fetch_content, get_checksum, get_setting_of_type,
-    get_url, response_is_valid,
+    Checksum, fetch_concurrently, fetch_content, get_checksum,
+    get_datetime_now, get_setting_of_type, get_url, open_extracted, proxies,
+    response_is_valid, run_concurrently,
 )
+from util.cache import get_cached_content, is_offline
 from util.logging import (
     debug_message, error_message, info_message, warning_message,
 )
 
+# size of the chunks that large metadata files are split into for parsing
+PARSE_CHUNK_SIZE = 8 * 1024 * 1024
+
+# size of the reads from decompressed metadata files while they are split
+PARSE_READ_SIZE = 1024 * 1024
+
+# cache key prefix for the progress of background bulk operations, each
+# operation has its own key, and is registered in a numbered slot so that
+# running operations can be listed without a shared read-modify-write
+BULK_PROGRESS_KEY = 'repos_bulk_progress'
+BULK_PROGRESS_COUNT_KEY = 'repos_bulk_progress_count'
+BULK_PROGRESS_TIMEOUT = 60 * 60 * 24
+# number of the most recently started operations that are listed
+BULK_PROGRESS_MAX_LISTED = 100
+
 
 def get_or_create_repo(r_name, r_arch, r_type, r_id=None):
     """ Get or create a Repository object and returns the object.
@@ -53,40 +77,128 @@ def get_or_create_repo(r_name, r_arch, r_type, r_id=None):
         return repository
 
 
-def update_mirror_packages(mirror, packages):
+def update_mirror_packages(mirror, packages, dry_run=False, full_diff=False):
     """ Updates the packages contained on a mirror, and
-        removes obsolete packages.
+        removes obsolete packages. Returns the changes, see record_mirror_diff.
+        If dry_run is set, the changes are computed but not written.
     """
     from repos.models import MirrorPackage  # noqa
 
-    old = set()
+    old = {}
     mirror_packages = mirror.packages.all()
     plen = mirror_packages.count()
     pbar_start.send(sender=None, ptext=f'Fetching {plen} existing Packages', plen=plen)
     for i, package in enumerate(mirror_packages):
         pbar_update.send(sender=None, index=i + 1)
         strpackage = convert_package_to_packagestring(package)
-        old.add(strpackage)
+        old[strpackage] = package.id
+
+    removals = set(old).difference(packages)
+    removed_ids = [old[strpackage] for strpackage in removals]
+    new = packages.difference(old)
+    if dry_run:
+        return record_mirror_diff(mirror, [], removed_ids, dry_run, full_diff, added_packages=new)
 
-    removals = old.difference(packages)
-    rlen = len(removals)
+    rlen = len(removed_ids)
     pbar_start.send(sender=None, ptext=f'Removing {rlen} obsolete Packages', plen=rlen)
-    for i, strpackage in enumerate(removals):
-        pbar_update.send(sender=None, index=i + 1)
-        package = convert_packagestring_to_package(strpackage)
-        MirrorPackage.objects.filter(mirror=mirror, package=package).delete()
+    for i in range(0, rlen, 1000):
+        MirrorPackage.objects.filter(mirror=mirror, package_id__in=removed_ids[i:i + 1000]).delete()
+        pbar_update.send(sender=None, index=min(i + 1000, rlen))
 
-    new = packages.difference(old)
     nlen = len(new)
+    added_ids = []
     pbar_start.send(sender=None, ptext=f'Adding {nlen} new Packages', plen=nlen)
     for i, strpackage in enumerate(new):
         pbar_update.send(sender=None, index=i + 1)
         try:
             package = convert_packagestring_to_package(strpackage)
             mirror_package, c = MirrorPackage.objects.get_or_create(mirror=mirror, package=package)
+            added_ids.append(package.id)
         except Package.MultipleObjectsReturned:
             error_message(text=f'Duplicate Package found in {mirror}: {strpackage}')
 
+    return record_mirror_diff(mirror, added_ids, removed_ids, full_diff=full_diff)
+
+
+def record_mirror_diff(mirror, added_ids, removed_ids, dry_run=False, full_diff=False, added_packages=()):
+    """ Record the packages added to and removed from a mirror by a refresh.
+        The counts are stored in Mirror.last_diff, along with the updated
+        cached packages count, unless dry_run is set.
+        Returns the diff counts. If dry_run or full_diff is set, the diff also
+        includes the ids of the added and removed packages, and for dry runs
+        the new packages that do not exist yet.
+    """
+    now = timezone.now()
+    removed = len(removed_ids)
+    added = len(added_ids) + len(added_packages)
+    diff = {
+        'timestamp': now.isoformat(),
+        'added': added,
+        'removed': removed,
+        'packages': mirror.packages_count + added - removed if dry_run else mirror.packages.count(),
+    }
+    if not dry_run:
+        # MirrorPackage rows are changed directly, so the m2m_changed signal
+        # that maintains packages_count is not sent
+        mirror.packages_count = diff['packages']
+        if added_ids or removed_ids:
+            record_mirror_change(mirror, now)
+            update_package_repos_counts(list(added_ids) + list(removed_ids))
+            update_repo_counts([mirror.repo_id], now)
+        mirror.last_diff = diff
+        mirror.save(update_fields=['packages_count', 'last_diff', 'last_change', 'change_interval'])
+    if dry_run or full_diff:
+        diff = {
+            **diff,
+            'added_ids': list(added_ids),
+            'removed_ids': list(removed_ids),
+            'added_packages': sorted(str(p) for p in added_packages),
+        }
+    return diff
+
+
+def copy_mirror_packages(mirror, checksum, dry_run=False, full_diff=False):
+    """ If a mirror of another repo with the same packages checksum has
+        already been refreshed, copy its packages to this mirror instead of
+        fetching and parsing the same metadata again.
+        Returns the changes if the packages were copied, or would have been
+        copied if dry_run is set, see record_mirror_diff. Otherwise returns None.
+    """
+    from repos.models import Mirror, MirrorPackage  # noqa
+
+    if not checksum or mirror.packages_checksum == checksum:
+        return
+    source = Mirror.objects.filter(
+        packages_checksum=checksum,
+        packages_count__gt=0,
+        repo__repotype=mirror.repo.repotype,
+    ).exclude(id=mirror.id).order_by('-timestamp').first()
+    if not source:
+        return
+
+    info_message(text=f'Mirror {source} has the same checksum, copying {source.packages_count} Packages')
+    source_packages = MirrorPackage.objects.filter(mirror=source).values('package_id')
+    old_ids = set(MirrorPackage.objects.filter(mirror=mirror).values_list('package_id', flat=True))
+    new_ids = set(source_packages.values_list('package_id', flat=True))
+    if dry_run:
+        return record_mirror_diff(mirror, new_ids - old_ids, old_ids - new_ids, dry_run, full_diff)
+    table = MirrorPackage._meta.db_table
+    with transaction.atomic():
+        MirrorPackage.objects.filter(mirror=mirror).exclude(package_id__in=source_packages).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (mirror_id, package_id, enabled) '
+                f'SELECT %s, package_id, %s FROM {table} WHERE mirror_id = %s '
+                f'AND package_id NOT IN (SELECT package_id FROM {table} WHERE mirror_id = %s)',
+                [mirror.id, True, source.id, mirror.id],
+            )
+        diff = record_mirror_diff(mirror, new_ids - old_ids, old_ids - new_ids, full_diff=full_diff)
+        mirror.packages_checksum = checksum
+        mirror.last_access_ok = True
+        mirror.timestamp = get_datetime_now()
+        mirror.save()
+    return diff
+
 
 def find_mirror_url(stored_mirror_url, formats):
     """ Find the actual URL of the mirror by trying predefined paths
@@ -112,11 +224,11 @@ def is_metalink(url):
     return 'metalink?' in url.lower()
 
 
-def get_metalink_urls(url):
+def get_metalink_urls(url, session=None):
     """  Parses a metalink and returns a list of mirrors
     """
     try:
-        res = get_url(url)
+        res = get_url(url, session=session)
     except RetryError:
         return
     if not response_is_valid(res):
@@ -125,10 +237,9 @@ def get_metalink_urls(url):
         return
     metalink_urls = []
     data = fetch_content(res, 'Fetching metalink data')
-    extracted = extract(data, url)
     ns = 'http://www.metalinker.org/'
     try:
-        tree = ElementTree.parse(BytesIO(extracted))
+        tree = ElementTree.parse(open_extracted(data, url))
         root = tree.getroot()
         for child in root:
             if child.tag == f'{{{ns}}}files':
@@ -145,12 +256,12 @@ def get_metalink_urls(url):
     return metalink_urls
 
 
-def get_mirrorlist_urls(url):
+def get_mirrorlist_urls(url, session=None):
     """ Checks if a given url returns a mirrorlist by checking if it contains
         a list of urls. Returns a list of mirrors if it is a mirrorlist.
     """
     try:
-        res = get_url(url)
+        res = get_url(url, session=session)
     except RetryError:
         return
     if response_is_valid(res):
@@ -168,91 +279,340 @@ def get_mirrorlist_urls(url):
             error_message(text=f'Error attempting to parse a mirrorlist: {e} {url}')
 
 
-def add_mirrors_from_urls(repo, mirror_urls):
+def probe_mirror(url, session=None):
+    """ Time a HEAD request for url. Returns a tuple of (url, latency) where
+        latency is in seconds, or None if the url is not usable
+    """
+    requester = session or requests
+    try:
+        start = time()
+        res = requester.head(url, allow_redirects=True, proxies=proxies, timeout=10)
+        if res.status_code in [405, 501]:
+            # some servers do not support HEAD requests
+            start = time()
+            res = requester.get(url, stream=True, proxies=proxies, timeout=10)
+            res.close()
+        latency = time() - start
+    except requests.exceptions.RequestException as e:
+        debug_message(text=f'Error probing {url}: {e}')
+        return url, None
+    if not res.ok:
+        debug_message(text=f'{res.status_code} probing {url}')
+        return url, None
+    return url, latency
+
+
+def probe_mirror_urls(urls):
+    """ Probe urls concurrently. Returns a dict mapping each url to its
+        latency, or None if the url is not usable
+    """
+    if is_offline():
+        return {url: None for url in urls}
+    return dict(fetch_mirrors_concurrently(probe_mirror, urls))
+
+
+def fetch_mirrors_concurrently(func, items):
+    """ Run func(item, session) across items using threads, yielding results
+        as they complete. Runs serially if CONCURRENT_PROCESSING is disabled.
+    """
+    concurrent = get_setting_of_type(
+        setting_name='CONCURRENT_PROCESSING',
+        setting_type=bool,
+        default=True,
+    )
+    max_workers = get_setting_of_type(
+        setting_name='CONCURRENT_WORKERS',
+        setting_type=int,
+        default=25,
+    )
+    if concurrent and len(items) > 1:
+        yield from fetch_concurrently(func, items, max_workers)
+    else:
+        for item in items:
+            yield func(item, None)
+
+
+def add_mirrors_from_urls(repo, mirror_urls, probe_path=None):
     """ Creates mirrors from a list of mirror urls
+        If probe_path is not None, probe_path is requested on each mirror
+        concurrently and the fastest healthy mirrors are preferred. Mirrors
+        from the list that are slower or not responding are demoted by
+        disabling refresh on them, and re-enabled once they are among the
+        fastest again. Otherwise mirrors are added in list order.
     """
-    max_mirrors = get_max_mirrors()
+    from repos.models import Mirror
+
+    urls = []
     for mirror_url in mirror_urls:
         mirror_url = mirror_url.replace('$ARCH', repo.arch.name)
         mirror_url = mirror_url.replace('$basearch', repo.arch.name)
-        mirror_url = mirror_url.rstrip('/')
-        q = Q(mirrorlist=False, refresh=True, enabled=True)
-        existing = repo.mirror_set.filter(q).count()
-        if existing >= max_mirrors:
-            text = f'{existing} Mirrors already exist (max={max_mirrors}), not adding more'
-            warning_message(text=text)
-            break
-        from repos.models import Mirror
-
         # FIXME: maybe we should store the mirrorlist url with full path to repomd.xml?
         # that is what metalink urls return now
-        m, c = Mirror.objects.get_or_create(repo=repo, url=mirror_url.rstrip('/').replace('repodata/repomd.xml', ''))
-        if c:
-            text = f'Added Mirror - {mirror_url}'
-            info_message(text=text)
+        mirror_url = mirror_url.rstrip('/').replace('repodata/repomd.xml', '')
+        if mirror_url not in urls:
+            urls.append(mirror_url)
+
+    max_mirrors = get_max_mirrors()
+    q = Q(mirrorlist=False, refresh=True, enabled=True)
+    existing = {m.url: m for m in repo.mirror_set.filter(url__in=urls)}
+    other_mirrors = repo.mirror_set.filter(q).exclude(url__in=urls).count()
+    slots = max(max_mirrors - other_mirrors, 0)
+
+    latencies = {}
+    if probe_path is not None:
+        probe_urls = {f"{url.rstrip('/')}/{probe_path}".rstrip('/'): url for url in urls}
+        for probe_url, latency in probe_mirror_urls(list(probe_urls)).items():
+            latencies[probe_urls[probe_url]] = latency
+        for url, mirror in existing.items():
+            mirror.latency = latencies.get(url)
+            mirror.save(update_fields=['latency'])
+
+    if any(latency is not None for latency in latencies.values()):
+        candidates = sorted([u for u in urls if latencies.get(u) is not None], key=lambda u: latencies.get(u))
+        candidates = [u for u in candidates if u not in existing or existing[u].enabled]
+        selected = candidates[:slots]
+        for url, mirror in existing.items():
+            if url in selected or not mirror.refresh or mirror.mirrorlist:
+                continue
+            mirror.refresh = False
+            mirror.save(update_fields=['refresh'])
+            if latencies.get(url) is None:
+                info_message(text=f'Demoted Mirror (not responding) - {url}')
+            else:
+                info_message(text=f'Demoted Mirror (slower than {len(selected)} others) - {url}')
+    else:
+        selected = urls
+
+    added = 0
+    for url in selected:
+        if added >= slots:
+            text = f'{max_mirrors} Mirrors already exist (max={max_mirrors}), not adding more'
+            warning_message(text=text)
+            break
+        mirror = existing.get(url)
+        if mirror is None:
+            mirror = Mirror.objects.create(repo=repo, url=url, latency=latencies.get(url))
+            info_message(text=f'Added Mirror - {url}')
+        elif not mirror.enabled or mirror.mirrorlist:
+            continue
+        elif not mirror.refresh and latencies.get(url) is not None:
+            mirror.refresh = True
+            mirror.fail_count = 0
+            mirror.save(update_fields=['refresh', 'fail_count'])
+            info_message(text=f'Promoted Mirror - {url}')
+        elif not mirror.refresh:
+            continue
+        added += 1
 
 
 def check_for_mirrorlists(repo):
     """ Check if any of the mirrors are actually mirrorlists.
         Creates MAX_MIRRORS mirrors from list if so.
     """
-    for mirror in repo.mirror_set.all():
-        mirror_urls = get_mirrorlist_urls(mirror.url)
+    mirrors = list(repo.mirror_set.all())
+    results = fetch_mirrors_concurrently(check_mirrorlist_worker, mirrors)
+    for mirror, mirror_urls in results:
         if mirror_urls:
             mirror.mirrorlist = True
             mirror.last_access_ok = True
             mirror.save()
             info_message(text=f'Found mirrorlist - {mirror.url}')
-            add_mirrors_from_urls(repo, mirror_urls)
+            add_mirrors_from_urls(repo, mirror_urls, probe_path='repodata/repomd.xml')
+
+
+def check_mirrorlist_worker(mirror, session):
+    return mirror, get_mirrorlist_urls(mirror.url, session)
 
 
 def check_for_metalinks(repo):
     """ Checks a set of mirrors for metalinks and creates
         MAX_MIRRORS mirrors if so.
     """
-    for mirror in repo.mirror_set.all():
-        if is_metalink(mirror.url):
-            mirror_urls = get_metalink_urls(mirror.url)
-        else:
-            continue
+    mirrors = [m for m in repo.mirror_set.all() if is_metalink(m.url)]
+    results = fetch_mirrors_concurrently(check_metalink_worker, mirrors)
+    for mirror, mirror_urls in results:
         if mirror_urls:
             mirror.mirrorlist = True
             mirror.last_access_ok = True
             mirror.save()
             info_message(text=f'Found metalink - {mirror.url}')
-            add_mirrors_from_urls(repo, mirror_urls)
+            add_mirrors_from_urls(repo, mirror_urls, probe_path='repodata/repomd.xml')
+
+
+def check_metalink_worker(mirror, session):
+    return mirror, get_metalink_urls(mirror.url, session)
 
 
-def fetch_mirror_data(mirror, url, text, checksum=None, checksum_type=None, metadata_type=None):
+def order_mirrors_by_speed(mirrors):
+    """ Order a Mirror queryset so that the mirrors with the lowest latency
+        and highest throughput are refreshed first
+    """
+    return mirrors.order_by(
+        F('latency').asc(nulls_last=True),
+        F('throughput').desc(nulls_last=True),
+        'url',
+    )
+
+
+def fetch_mirror_data(mirror, url, text, checksum=None, checksum_type=None, metadata_type=None, dry_run=False):
+    """ Fetch metadata from a mirror, recording failures and download stats
+        on the mirror unless dry_run is set
+    """
     if not url:
-        mirror.fail()
+        fail_mirror(mirror, dry_run)
         return
 
+    if checksum_type == 'sha256':
+        data = get_cached_content(checksum)
+        if data is not None:
+            debug_message(text=f'Using cached content for {url}')
+            mirror.last_access_ok = True
+            if not dry_run:
+                mirror.save()
+            return data
+
     try:
         res = get_url(url)
     except RetryError:
-        mirror.fail()
+        fail_mirror(mirror, dry_run)
         return
 
     if not response_is_valid(res):
-        mirror.fail()
+        fail_mirror(mirror, dry_run)
         return
     mirror.last_access_ok = True
-    mirror.save()
+    if not dry_run:
+        mirror.save()
 
+    start = time()
     data = fetch_content(res, text)
     if not data:
         return
+    elapsed = time() - start
+    if not dry_run:
+        record_mirror_download(mirror, len(data), elapsed)
+        record_mirror_throughput(mirror, len(data), elapsed)
 
     if checksum and checksum_type and metadata_type:
         computed_checksum = get_checksum(data, Checksum[checksum_type])
-        if not mirror_checksum_is_valid(computed_checksum, checksum, mirror, metadata_type):
-            mirror.fail()
+        if not mirror_checksum_is_valid(computed_checksum, checksum, mirror, metadata_type, dry_run):
+            fail_mirror(mirror, dry_run)
             return
     return data
 
 
-def mirror_checksum_is_valid(computed, provided, mirror, metadata_type):
+def fail_mirror(mirror, dry_run=False):
+    """ Record that a mirror has failed, or only report it for dry runs
+    """
+    if dry_run:
+        mirror.last_access_ok = False
+        error_message(text=f'No usable mirror found at {mirror.url}')
+    else:
+        mirror.fail()
+
+
+def record_mirror_download(mirror, size, elapsed):
+    """ Add a download to the bytes downloaded and time spent downloading by
+        the current refresh of a mirror
+    """
+    mirror.download_bytes += size
+    mirror.download_duration += elapsed
+    mirror.save(update_fields=['download_bytes', 'download_duration'])
+
+
+def update_package_repos_counts(package_ids, batch_size=1000):
+    """ Update the cached number of repos that each package is available from
+    """
+    from repos.models import MirrorPackage  # noqa
+
+    repos_count = MirrorPackage.objects.filter(package=OuterRef('pk')).order_by().values(
+        'package').annotate(count=Count('mirror__repo', distinct=True)).values('count')
+    package_ids = list(package_ids)
+    for i in range(0, len(package_ids), batch_size):
+        Package.objects.filter(id__in=package_ids[i:i + batch_size]).update(
+            repos_count=Coalesce(Subquery(repos_count), 0))
+
+
+def update_repo_counts(repo_ids, changed=None):
+    """ Update the cached number of distinct packages and security packages
+        in repos. changed can be set to the time that the packages changed.
+    """
+    from repos.models import Repository  # noqa
+
+    for repo_id in repo_ids:
+        packages = Package.objects.filter(mirror__repo=repo_id)
+        fields = {
+            'packages_count': packages.distinct().count(),
+            'security_packages_count': packages.filter(
+                provides_fix_in_erratum__e_type='security').distinct().count(),
+        }
+        if changed:
+            fields['last_change'] = changed
+        Repository.objects.filter(id=repo_id).update(**fields)
+
+
+def update_repo_security_counts():
+    """ Update the cached number of security packages in repos with a single
+        grouped query, only writing the repos whose count has changed
+    """
+    from repos.models import Repository  # noqa
+
+    counts = dict(Package.objects.filter(
+        provides_fix_in_erratum__e_type='security',
+        mirror__repo__isnull=False,
+    ).order_by().values('mirror__repo').annotate(
+        count=Count('id', distinct=True)).values_list('mirror__repo', 'count'))
+    for repo_id, security_packages_count in Repository.objects.values_list('id', 'security_packages_count'):
+        count = counts.get(repo_id, 0)
+        if count != security_packages_count:
+            Repository.objects.filter(id=repo_id).update(security_packages_count=count)
+
+
+def update_mirror_counts(mirror_ids, repo_ids=(), task_id=None, text='Updating Package counts', batch_size=50):
+    """ Update the cached counts of the packages on mirrors, and of the repos
+        that the mirrors are in, after the mirrors have been moved
+    """
+    from repos.models import Mirror, MirrorPackage  # noqa
+
+    mirror_ids = list(mirror_ids)
+    repo_ids = set(repo_ids)
+    total = len(mirror_ids)
+    for i in range(0, total, batch_size):
+        batch = mirror_ids[i:i + batch_size]
+        package_ids = MirrorPackage.objects.filter(mirror_id__in=batch).values_list('package_id', flat=True)
+        update_package_repos_counts(set(package_ids))
+        repo_ids.update(Mirror.objects.filter(id__in=batch).values_list('repo_id', flat=True))
+        if task_id:
+            set_bulk_progress(task_id, text, i + len(batch), total + 1)
+    update_repo_counts(repo_ids, timezone.now())
+    if task_id:
+        set_bulk_progress(task_id, text, 1, 1)
+
+
+def record_mirror_change(mirror, now):
+    """ Record that the packages on a mirror changed, and update the
+        moving average of the time between changes
+    """
+    if mirror.last_change:
+        interval = (now - mirror.last_change).total_seconds()
+        if mirror.change_interval is None:
+            mirror.change_interval = interval
+        else:
+            mirror.change_interval = 0.7 * mirror.change_interval + 0.3 * interval
+    mirror.last_change = now
+
+
+def record_mirror_throughput(mirror, size, elapsed):
+    """ Record the download throughput of a mirror in bytes per second
+        Small downloads are ignored as they mostly measure latency
+    """
+    if size < 65536 or elapsed <= 0:
+        return
+    mirror.throughput = size / elapsed
+    mirror.save(update_fields=['throughput'])
+
+
+def mirror_checksum_is_valid(computed, provided, mirror, metadata_type, dry_run=False):
     """ Compares the computed checksum and the provided checksum.
         Returns True if both match.
     """
@@ -262,7 +622,7 @@ def mirror_checksum_is_valid(computed, provided, mirror, metadata_type):
         text = f'Found checksum:    {computed}\nExpected checksum: {provided}'
         error_message(text=text)
         mirror.last_access_ok = False
-        mirror.fail()
+        fail_mirror(mirror, dry_run)
         return False
     else:
         return True
@@ -288,6 +648,35 @@ def find_best_repo(package, hostrepos):
     return best_repo
 
 
+def parse_concurrently(func, chunks):
+    """ Parse independent chunks of repo metadata across CPU cores,
+        yielding the result of func for each chunk as it completes.
+        chunks can be a generator, so that only the chunks being parsed
+        are held in memory. Parses serially if CONCURRENT_PROCESSING is
+        disabled or if there is only one chunk.
+    """
+    concurrent = get_setting_of_type(
+        setting_name='CONCURRENT_PROCESSING',
+        setting_type=bool,
+        default=True,
+    )
+    max_workers = get_setting_of_type(
+        setting_name='CONCURRENT_WORKERS',
+        setting_type=int,
+        default=25,
+    )
+    max_workers = min(max_workers, os.cpu_count() or 1)
+    # worker processes cannot be forked inside a transaction
+    chunks = iter(chunks)
+    first_chunks = list(islice(chunks, 2))
+    chunks = chain(first_chunks, chunks)
+    if concurrent and max_workers > 1 and len(first_chunks) > 1 and not connection.in_atomic_block:
+        yield from run_concurrently(func, chunks, max_workers)
+    else:
+        for chunk in chunks:
+            yield func(chunk)
+
+
 def get_max_mirrors():
     """ Find the max number of mirrors for refresh
     """
@@ -299,6 +688,187 @@ def get_max_mirrors():
     return max_mirrors
 
 
+def get_repo_refresh_interval(repo):
+    """ Returns how often a repo should be refreshed, based on how often its
+        mirrors change. Repos are refreshed twice as often as they change,
+        within REPO_REFRESH_MIN_INTERVAL and REPO_REFRESH_MAX_INTERVAL hours.
+        Security repos are refreshed at least daily, and repos that have not
+        changed yet are refreshed daily.
+    """
+    min_hours = get_setting_of_type(
+        setting_name='REPO_REFRESH_MIN_INTERVAL',
+        setting_type=int,
+        default=1,
+    )
+    max_hours = get_setting_of_type(
+        setting_name='REPO_REFRESH_MAX_INTERVAL',
+        setting_type=int,
+        default=168,
+    )
+    if repo.security:
+        max_hours = min(max_hours, 24)
+    intervals = [m.change_interval for m in repo.mirror_set.all() if m.change_interval]
+    if intervals:
+        hours = min(intervals) / 2 / 3600
+    else:
+        hours = 24
+    return timedelta(hours=max(min_hours, min(hours, max_hours)))
+
+
+def get_repo_refresh_size(repo):
+    """ Returns the number of bytes downloaded by the last refresh of a repo
+    """
+    return sum(m.download_bytes for m in repo.mirror_set.all())
+
+
+def get_repos_due_for_refresh(repos, now=None):
+    """ Returns the repos that are due for a refresh, most overdue first.
+        At most REPO_REFRESH_MAX_REPOS repos are returned, and the repos are
+        limited to REPO_REFRESH_BANDWIDTH megabytes based on the size of their
+        last refresh. Either limit can be set to 0 to disable it.
+    """
+    if now is None:
+        now = timezone.now()
+    max_repos = get_setting_of_type(
+        setting_name='REPO_REFRESH_MAX_REPOS',
+        setting_type=int,
+        default=0,
+    )
+    bandwidth = get_setting_of_type(
+        setting_name='REPO_REFRESH_BANDWIDTH',
+        setting_type=int,
+        default=0,
+    ) * 1024 * 1024
+
+    due = []
+    for repo in repos.prefetch_related('mirror_set'):
+        interval = get_repo_refresh_interval(repo)
+        if repo.last_refresh is None:
+            overdue = float('inf')
+        else:
+            overdue = (now - repo.last_refresh) / interval
+        if overdue >= 1:
+            due.append((overdue, repo))
+    due.sort(key=lambda x: x[0], reverse=True)
+
+    scheduled = []
+    total_size = 0
+    for _, repo in due:
+        if max_repos and len(scheduled) >= max_repos:
+            break
+        size = get_repo_refresh_size(repo)
+        if bandwidth and scheduled and total_size + size > bandwidth:
+            continue
+        total_size += size
+        scheduled.append(repo)
+    return scheduled
+
+
+def set_bulk_progress(task_id, text, done, total):
+    """ Record the progress of a background bulk operation so that it can be
+        shown in the UI. The progress is removed when the operation is done.
+    """
+    key = f'{BULK_PROGRESS_KEY}_{task_id}'
+    if done >= total:
+        cache.delete(key)
+        return
+    progress = {
+        'text': text,
+        'done': done,
+        'total': total,
+        'percent': int(100 * done / total),
+    }
+    if cache.add(key, progress, BULK_PROGRESS_TIMEOUT):
+        cache.add(BULK_PROGRESS_COUNT_KEY, 0, None)
+        slot = cache.incr(BULK_PROGRESS_COUNT_KEY)
+        cache.set(f'{BULK_PROGRESS_KEY}_slot_{slot}', task_id, BULK_PROGRESS_TIMEOUT)
+    else:
+        cache.set(key, progress, BULK_PROGRESS_TIMEOUT)
+
+
+def get_bulk_progress():
+    """ Returns the progress of the running background bulk operations
+    """
+    count = cache.get(BULK_PROGRESS_COUNT_KEY) or 0
+    slots = [f'{BULK_PROGRESS_KEY}_slot_{i}' for i in range(max(count - BULK_PROGRESS_MAX_LISTED, 0) + 1, count + 1)]
+    # a task id is registered again if its progress is set after it was removed
+    keys = list(dict.fromkeys(f'{BULK_PROGRESS_KEY}_{task_id}' for task_id in cache.get_many(slots).values()))
+    progress = cache.get_many(keys)
+    return [progress[key] for key in keys if key in progress]
+
+
+def set_repos_enabled(repo_ids, enabled):
+    """ Enable or disable repos, and enable or disable the mirrors of those
+        repos and their refresh, using one UPDATE for each table
+    """
+    from repos.models import Mirror, Repository  # noqa
+
+    Repository.objects.filter(id__in=repo_ids).update(enabled=enabled)
+    Mirror.objects.filter(repo_id__in=repo_ids).update(enabled=enabled, refresh=enabled)
+
+
+def move_mirrors(mirror_ids, repo):
+    """ Move mirrors to a repo. The host repos of the repos that the mirrors
+        were in are moved too, and those repos are deleted if they have no
+        mirrors left. Returns the ids of the repos that the mirrors were in.
+        The cached package counts are not updated, see update_mirror_counts().
+    """
+    from hosts.models import HostRepo
+    from repos.models import Mirror, Repository  # noqa
+
+    old_repo_ids = set(Mirror.objects.filter(id__in=mirror_ids).exclude(
+        repo=repo).values_list('repo_id', flat=True))
+    if not old_repo_ids:
+        return old_repo_ids
+    with transaction.atomic():
+        Mirror.objects.filter(id__in=mirror_ids).update(repo=repo)
+        hostrepos = HostRepo.objects.filter(repo_id__in=old_repo_ids)
+        # a host can only be linked to a repo once, so drop any host repos
+        # that would become duplicates
+        hostrepos.filter(host_id__in=HostRepo.objects.filter(repo=repo).values('host_id')).delete()
+        keep_ids = hostrepos.values('host_id').annotate(keep_id=Min('id')).values_list('keep_id', flat=True)
+        hostrepos.exclude(id__in=list(keep_ids)).delete()
+        hostrepos.update(repo=repo)
+        Repository.objects.filter(id__in=old_repo_ids).exclude(
+            id__in=Mirror.objects.values('repo_id')).delete()
+    return old_repo_ids
+
+
+def delete_mirrors(mirror_ids, task_id=None, text='Deleting Mirrors', batch_size=50):
+    """ Delete mirrors in batches, removing their packages first so that
+        each DELETE only touches the packages of a few mirrors, then update
+        the cached package counts
+    """
+    from repos.models import Mirror, MirrorPackage  # noqa
+
+    mirror_ids = list(mirror_ids)
+    total = len(mirror_ids)
+    repo_ids = set()
+    for i in range(0, total, batch_size):
+        batch = mirror_ids[i:i + batch_size]
+        mirror_packages = MirrorPackage.objects.filter(mirror_id__in=batch)
+        package_ids = set(mirror_packages.values_list('package_id', flat=True))
+        repo_ids.update(Mirror.objects.filter(id__in=batch).values_list('repo_id', flat=True))
+        mirror_packages.delete()
+        Mirror.objects.filter(id__in=batch).delete()
+        update_package_repos_counts(package_ids)
+        if task_id:
+            set_bulk_progress(task_id, text, i + len(batch), total + 1)
+    update_repo_counts(repo_ids, timezone.now())
+    if task_id:
+        set_bulk_progress(task_id, text, 1, 1)
+
+
+def delete_repos(repo_ids, task_id=None, text='Deleting Repositories'):
+    """ Delete repos, deleting their mirrors in batches first
+    """
+    from repos.models import Mirror, Repository  # noqa
+
+    mirror_ids = Mirror.objects.filter(repo_id__in=repo_ids).values_list('id', flat=True)
+    delete_mirrors(mirror_ids, task_id, text)
+    Repository.objects.filter(id__in=repo_ids).delete()
+
+
 def clean_repos():
     """ Remove repositories that contain no mirrors
     """
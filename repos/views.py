@@ -16,10 +16,10 @@
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
 from urllib.parse import parse_qs
+from uuid import uuid4
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db import IntegrityError
 from django.db.models import Q
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
@@ -28,7 +28,6 @@ from django_tables2 import RequestConfig
 from rest_framework import viewsets
 
 from arch.models import MachineArchitecture
-from hosts.models import HostRepo
 from operatingsystems.models import OSRelease
 from repos.forms import (
     CreateRepoForm, EditMirrorForm, EditRepoForm, LinkRepoForm,
@@ -38,7 +37,14 @@ from repos.serializers import (
     MirrorPackageSerializer, MirrorSerializer, RepositorySerializer,
 )
 from repos.tables import MirrorTable, RepositoryTable
-from repos.tasks import refresh_repo
+from repos.tasks import (
+    bulk_delete_mirrors, bulk_delete_repos, refresh_repo,
+    update_moved_mirror_counts,
+)
+from repos.utils import (
+    delete_mirrors, delete_repos, get_bulk_progress, move_mirrors,
+    set_bulk_progress, set_repos_enabled,
+)
 from util import sanitize_filter_params
 from util.filterspecs import Filter, FilterBar
 
@@ -111,7 +117,20 @@ def repo_list(request):
                    'terms': terms,
                    'total_count': repos.count(),
                    'filter_params': filter_params,
-                   'bulk_actions': bulk_actions})
+                   'bulk_actions': bulk_actions,
+                   'bulk_progress': get_bulk_progress()})
+
+
+def move_mirrors_and_update_counts(mirrors, repo):
+    """ Move mirrors to a repo, and update the cached package counts in the
+        background
+    """
+    mirror_ids = list(mirrors.values_list('id', flat=True))
+    old_repo_ids = move_mirrors(mirror_ids, repo)
+    if old_repo_ids:
+        task_id = uuid4().hex
+        set_bulk_progress(task_id, f'Updating Package counts for {len(mirror_ids)} Mirrors', 0, len(mirror_ids))
+        update_moved_mirror_counts.delay(mirror_ids, list(old_repo_ids), task_id)
 
 
 @login_required
@@ -138,20 +157,6 @@ def mirror_list(request):
                               {'table': table, 'checksum': checksum})
         return True
 
-    def move_mirrors(repo):
-        for mirror in mirrors:
-            oldrepo = mirror.repo
-            for hostrepo in HostRepo.objects.filter(repo=oldrepo):
-                try:
-                    hostrepo.repo = repo
-                    hostrepo.save()
-                except IntegrityError:
-                    hostrepo.delete()
-            mirror.repo = repo
-            mirror.save()
-            if not oldrepo.mirror_set.exists():
-                oldrepo.delete()
-
     # Use cached packages_count instead of expensive annotation
     mirrors = Mirror.objects.select_related('repo').order_by('packages_checksum')
 
@@ -194,7 +199,7 @@ def mirror_list(request):
             repo.enabled = enabled
             repo.security = security
             repo.save()
-            move_mirrors(repo)
+            move_mirrors_and_update_counts(mirrors, repo)
             text = f'Mirrors linked to new Repository {repo}'
             messages.info(request, text)
             return redirect(repo.get_absolute_url())
@@ -202,7 +207,7 @@ def mirror_list(request):
         link_form = LinkRepoForm(request.POST, prefix='link')
         if link_form.is_valid():
             repo = link_form.cleaned_data['name']
-            move_mirrors(repo)
+            move_mirrors_and_update_counts(mirrors, repo)
             text = f'Mirrors linked to Repository {repo}'
             messages.info(request, text)
             return redirect(repo.get_absolute_url())
@@ -244,7 +249,8 @@ def mirror_list(request):
                    'terms': terms,
                    'total_count': mirrors.count(),
                    'filter_params': filter_params,
-                   'bulk_actions': bulk_actions})
+                   'bulk_actions': bulk_actions,
+                   'bulk_progress': get_bulk_progress()})
 
 
 @login_required
@@ -261,7 +267,7 @@ def mirror_delete(request, mirror_id):
 
     if request.method == 'POST':
         if 'delete' in request.POST:
-            mirror.delete()
+            delete_mirrors([mirror.id])
             text = f'Mirror {mirror} has been deleted'
             messages.info(request, text)
             return redirect(reverse('repos:mirror_list'))
@@ -321,7 +327,11 @@ def repo_edit(request, repo_id):
                 repo = edit_form.save()
                 repo.save()
                 mirrors = edit_form.cleaned_data['mirrors']
+                old_repo_ids = set(mirrors.exclude(repo=repo).values_list('repo_id', flat=True))
                 mirrors.update(repo=repo)
+                if old_repo_ids:
+                    mirror_ids = list(mirrors.values_list('id', flat=True))
+                    update_moved_mirror_counts.delay(mirror_ids, list(old_repo_ids))
                 if repo.enabled:
                     repo.enable()
                 else:
@@ -349,9 +359,7 @@ def repo_delete(request, repo_id):
 
     if request.method == 'POST':
         if 'delete' in request.POST:
-            for mirror in repo.mirror_set.all():
-                mirror.delete()
-            repo.delete()
+            delete_repos([repo.id])
             text = f'Repository {repo} has been deleted'
             messages.info(request, text)
             return redirect(reverse('repos:repo_list'))
@@ -474,25 +482,32 @@ def repo_bulk_action(request):
     count = repos.count()
     name = Repository._meta.verbose_name if count == 1 else Repository._meta.verbose_name_plural
 
+    repo_ids = list(repos.values_list('id', flat=True))
+
     if action == 'enable':
-        repos.update(enabled=True)
+        set_repos_enabled(repo_ids, True)
         messages.success(request, f'Enabled {count} {name}')
     elif action == 'disable':
-        repos.update(enabled=False)
+        set_repos_enabled(repo_ids, False)
         messages.success(request, f'Disabled {count} {name}')
     elif action == 'mark_security':
-        repos.update(security=True)
+        Repository.objects.filter(id__in=repo_ids).update(security=True)
         messages.success(request, f'Marked {count} {name} as security')
     elif action == 'mark_non_security':
-        repos.update(security=False)
+        Repository.objects.filter(id__in=repo_ids).update(security=False)
         messages.success(request, f'Marked {count} {name} as non-security')
     elif action == 'refresh':
-        for repo in repos:
-            refresh_repo.delay(repo.id)
+        for repo_id in repo_ids:
+            refresh_repo.delay(repo_id)
         messages.success(request, f'Queued {count} {name} for refresh')
     elif action == 'delete':
-        Repository.objects.filter(pk__in=repos.values_list('pk', flat=True)).delete()
-        messages.success(request, f'Deleted {count} {name}')
+        # disable the repos straight away, the packages of their mirrors
+        # are removed in the background
+        set_repos_enabled(repo_ids, False)
+        task_id = uuid4().hex
+        set_bulk_progress(task_id, f'Deleting {count} {name}', 0, count)
+        bulk_delete_repos.delay(repo_ids, task_id)
+        messages.success(request, f'Queued {count} {name} for deletion')
     else:
         messages.warning(request, 'Invalid action')
 
@@ -550,8 +565,10 @@ def mirror_bulk_action(request):
             return redirect('repos:mirror_list')
         mirrors = Mirror.objects.filter(id__in=selected_ids)
 
-    count = mirrors.count()
+    mirror_ids = list(mirrors.values_list('id', flat=True))
+    count = len(mirror_ids)
     name = Mirror._meta.verbose_name if count == 1 else Mirror._meta.verbose_name_plural
+    mirrors = Mirror.objects.filter(id__in=mirror_ids)
 
     if action == 'edit':
         if count != 1:
@@ -574,8 +591,11 @@ def mirror_bulk_action(request):
         mirrors.update(refresh=False)
         messages.success(request, f'Disabled refresh for {count} {name}')
     elif action == 'delete':
-        Mirror.objects.filter(pk__in=mirrors.values_list('pk', flat=True)).delete()
-        messages.success(request, f'Deleted {count} {name}')
+        mirrors.update(enabled=False, refresh=False)
+        task_id = uuid4().hex
+        set_bulk_progress(task_id, f'Deleting {count} {name}', 0, count)
+        bulk_delete_mirrors.delay(mirror_ids, task_id)
+        messages.success(request, f'Queued {count} {name} for deletion')
     else:
         messages.warning(request, 'Invalid action')
 
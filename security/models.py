@@ -14,7 +14,6 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
-import json
 import re
 from time import sleep
 
@@ -23,7 +22,9 @@ from django.db import models
 from django.urls import reverse
 
 from security.managers import CVEManager
-from util import error_message, fetch_content, get_url, tz_aware_datetime
+from util import (
+    error_message, fetch_content, get_url, load_json, tz_aware_datetime,
+)
 
 
 class Reference(models.Model):
@@ -63,7 +64,7 @@ class CWE(models.Model):
         mitre_cwe_url = f'https://cwe-api.mitre.org/api/v1/cwe/{int_id}'
         res = get_url(mitre_cwe_url)
         data = fetch_content(res, f'Fetching {self.cwe_id} data')
-        cwe_json = json.loads(data)
+        cwe_json = load_json(data)
         if cwe_json == 'at least one CWE not found':
             return
         cwe = cwe_json[0]
@@ -71,7 +72,7 @@ class CWE(models.Model):
             weakness_url = f'https://cwe-api.mitre.org/api/v1/cwe/weakness/{int_id}'
             res = get_url(weakness_url)
             data = fetch_content(res, f'Fetching {self.cwe_id} weakness data')
-            weakness_json = json.loads(data)
+            weakness_json = load_json(data)
             for weakness in weakness_json.get('Weaknesses'):
                 if int(weakness.get('ID')) == int_id:
                     self.name = weakness.get('Name')
@@ -161,7 +162,7 @@ class CVE(models.Model):
             error_message(text=f'404 - Skipping {self.cve_id} - {mitre_cve_url}')
             return
         data = fetch_content(res, f'Fetching {self.cve_id} MITRE data')
-        cve_json = json.loads(data)
+        cve_json = load_json(data)
         self.parse_mitre_cve_data(cve_json)
 
     def fetch_osv_dev_cve_data(self):
@@ -171,7 +172,7 @@ class CVE(models.Model):
             error_message(text=f'404 - Skipping {self.cve_id} - {osv_dev_cve_url}')
             return
         data = fetch_content(res, f'Fetching {self.cve_id} OSV data')
-        cve_json = json.loads(data)
+        cve_json = load_json(data)
         self.parse_osv_dev_cve_data(cve_json)
 
     def parse_osv_dev_cve_data(self, cve_json):
@@ -195,7 +196,7 @@ class CVE(models.Model):
         data = fetch_content(res, f'Fetching {self.cve_id} NIST data')
         if res.status_code == 404:
             error_message(text=f'404 - Skipping {self.cve_id} - {nist_cve_url}')
-        cve_json = json.loads(data)
+        cve_json = load_json(data)
         self.parse_nist_cve_data(cve_json)
 
     def parse_nist_cve_data(self, cve_json):
@@ -34,6 +34,22 @@ def get_or_create_cve(cve_id):
     return cve
 
 
+def get_or_create_cves(cve_ids):
+    """ Given a list of CVE IDs, get or create CVE objects in bulk.
+        Returns a dict mapping each CVE ID to the CVE object id.
+    """
+    cve_ids = list(set(cve_ids))
+    ids = {}
+    for i in range(0, len(cve_ids), 1000):
+        ids.update(CVE.objects.filter(cve_id__in=cve_ids[i:i + 1000]).values_list('cve_id', 'id'))
+    missing = [cve_id for cve_id in cve_ids if cve_id not in ids]
+    if missing:
+        CVE.objects.bulk_create([CVE(cve_id=cve_id) for cve_id in missing], ignore_conflicts=True, batch_size=1000)
+        for i in range(0, len(missing), 1000):
+            ids.update(CVE.objects.filter(cve_id__in=missing[i:i + 1000]).values_list('cve_id', 'id'))
+    return ids
+
+
 def update_cves(cve_id=None, fetch_nist_data=False):
     """ Fetch the latest CVE data from the CVE API.
         e.g. https://cveawg.mitre.org/api/cve/CVE-2024-1234
@@ -168,3 +184,34 @@ def get_or_create_reference(ref_type, url, update_ref_type=False):
                 url=reference.get('url'),
             )
         return ref
+
+
+def get_or_create_references(references):
+    """ Get or create Reference objects in bulk from (ref_type, url) tuples.
+        As with get_or_create_reference, urls are normalized first and an
+        existing Reference with the same url is reused regardless of type.
+        Returns a dict mapping each (ref_type, url) tuple to the Reference id.
+    """
+    fixed_refs = {}
+    for ref_type, url in set(references):
+        reference = fixup_reference({'ref_type': ref_type, 'url': url})
+        if reference:
+            fixed_refs[(ref_type, url)] = (reference.get('ref_type'), reference.get('url'))
+    urls = list({url for _, url in fixed_refs.values()})
+    url_ids = {}
+    for i in range(0, len(urls), 1000):
+        refs = Reference.objects.filter(url__in=urls[i:i + 1000]).order_by('id').values_list('url', 'id')
+        for url, ref_id in refs:
+            url_ids.setdefault(url, ref_id)
+    missing = {}
+    for ref_type, url in fixed_refs.values():
+        if url not in url_ids:
+            missing.setdefault(url, Reference(ref_type=ref_type, url=url))
+    if missing:
+        Reference.objects.bulk_create(missing.values(), ignore_conflicts=True, batch_size=1000)
+        missing_urls = list(missing)
+        for i in range(0, len(missing_urls), 1000):
+            refs = Reference.objects.filter(url__in=missing_urls[i:i + 1000]).order_by('id').values_list('url', 'id')
+            for url, ref_id in refs:
+                url_ids.setdefault(url, ref_id)
+    return {ref: url_ids[url] for ref, (_, url) in fixed_refs.items() if url in url_ids}
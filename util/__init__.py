@@ -16,11 +16,15 @@
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
 import bz2
+import codecs
+import gzip
+import json
 import lzma
+import mmap
 import os
+import tempfile
 import zlib
 
-import magic
 import requests
 
 try:
@@ -32,6 +36,7 @@ except ImportError:
 from datetime import datetime, timezone
 from enum import Enum
 from hashlib import md5, sha1, sha256, sha512
+from io import BytesIO
 from time import time
 from urllib.parse import parse_qs, urlencode
 
@@ -43,6 +48,10 @@ from tenacity import (
     retry, retry_if_exception_type, stop_after_attempt, wait_exponential,
 )
 
+from util.cache import (
+    CachedResponse, SpooledContent, get_cache_entry, get_cache_key,
+    get_cached_response, get_conditional_headers, is_offline, store_content,
+)
 from util.logging import (
     create_pbar, debug_message, error_message, info_message, quiet_mode,
     update_pbar,
@@ -68,31 +77,64 @@ def sanitize_filter_params(filter_params):
     return urlencode(parsed, doseq=True)
 
 
+def get_spool_threshold():
+    """ Returns the size in bytes above which fetched content is spooled to disk
+    """
+    threshold_mb = get_setting_of_type(
+        setting_name='FETCH_SPOOL_THRESHOLD',
+        setting_type=int,
+        default=64,
+    )
+    return threshold_mb * 1024 * 1024
+
+
 def fetch_content(response, text='', ljust=35):
-    """ Display a progress bar to fetch the request content if verbose is
-        True. Otherwise, just return the request content
+    """ Fetch the request content, displaying a progress bar if verbose is
+        True. The content is collected in chunks and joined once, or spooled
+        to a temporary file and returned as SpooledContent if it is larger
+        than FETCH_SPOOL_THRESHOLD MB.
+        Content fetched from a cacheable response is stored in the metadata
+        cache, content from a cached response is returned directly.
     """
     if not response:
         return
-    if verbose:
-        content_length = response.headers.get('content-length')
-        if content_length:
-            clen = int(content_length)
-            create_pbar(text, clen, ljust)
-            chunk_size = 16384
-            i = 0
-            data = b''
-            for chunk in response.iter_content(chunk_size=chunk_size, decode_unicode=False):
-                i += len(chunk)
-                if i > clen:
-                    update_pbar(clen)
-                else:
-                    update_pbar(i)
-                data += chunk
-            return data
+    if isinstance(response, CachedResponse):
+        return response.content
+    content_length = response.headers.get('content-length')
+    clen = int(content_length) if content_length else 0
+    show_pbar = verbose and clen > 0
+    if show_pbar:
+        create_pbar(text, clen, ljust)
+    elif verbose:
+        info_message(text=text)
+
+    threshold = get_spool_threshold()
+    chunks = []
+    size = 0
+    spool = None
+    for chunk in response.iter_content(chunk_size=65536, decode_unicode=False):
+        size += len(chunk)
+        if spool is None and size > threshold:
+            spool = tempfile.TemporaryFile()
+            spool.writelines(chunks)
+            chunks = []
+        if spool is None:
+            chunks.append(chunk)
         else:
-            info_message(text=text)
-    return response.content
+            spool.write(chunk)
+        if show_pbar:
+            update_pbar(min(size, clen))
+    if spool is None:
+        data = b''.join(chunks)
+    else:
+        spool.flush()
+        data = SpooledContent(spool.fileno(), 0, access=mmap.ACCESS_READ)
+        spool.close()
+
+    cache_key = getattr(response, 'cache_key', None)
+    if cache_key and response.status_code == 200:
+        store_content(cache_key, response.url, data, response.headers)
+    return data
 
 
 @retry(
@@ -103,20 +145,45 @@ def fetch_content(response, text='', ljust=35):
 )
 def get_url(url, headers=None, params=None, session=None):
     """ Perform a http GET on a URL. Return None on error.
+        If the metadata cache is enabled, cached content is revalidated using
+        its ETag/Last-Modified and served from the cache if it has not changed.
+        If the caller sets its own If-None-Match/If-Modified-Since headers,
+        they are sent instead and a 304 response is returned to the caller.
+        In offline mode, only cached content is returned.
     """
     response = None
     if not headers:
         headers = {}
     if not params:
         params = {}
+    cache_key = get_cache_key(url, params)
+    if is_offline():
+        response = get_cached_response(url, cache_key)
+        if not response:
+            error_message(text=f'Offline mode - {url} is not cached')
+        return response
+    request_headers = dict(headers)
+    cache_entry = None
+    if not {h.lower() for h in headers} & {'if-none-match', 'if-modified-since'}:
+        cache_entry = get_cache_entry(cache_key)
+        if cache_entry:
+            request_headers.update(get_conditional_headers(cache_entry))
     requester = session or requests
     try:
-        debug_message(text=f'Trying {url} headers:{headers} params:{params}')
-        response = requester.get(url, headers=headers, params=params, stream=True, proxies=proxies, timeout=30)
+        debug_message(text=f'Trying {url} headers:{request_headers} params:{params}')
+        response = requester.get(url, headers=request_headers, params=params, stream=True, proxies=proxies, timeout=30)
         debug_message(text=f'{response.status_code}: {response.headers}')
+        # a 304 without a cache entry was requested by the caller's own conditional headers
+        if response.status_code == 304 and cache_entry:
+            cached_response = get_cached_response(url, cache_key)
+            if cached_response:
+                return cached_response
+            # cached content was evicted since it was revalidated
+            response = requester.get(url, headers=headers, params=params, stream=True, proxies=proxies, timeout=30)
         if response.status_code in [403, 404]:
             return response
         response.raise_for_status()
+        response.cache_key = cache_key
     except requests.exceptions.TooManyRedirects:
         error_message(text=f'Too many redirects - {url}')
     except ConnectionError:
@@ -200,27 +267,197 @@ def unzstd(contents):
         error_message(text=f'zstd: {e}')
 
 
+# magic bytes that identify each supported compression format
+COMPRESSION_MAGIC = [
+    (b'\x1f\x8b', 'gz'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zst'),
+]
+
+
+def get_compression(head, fmt=''):
+    """ Returns the compression format of data from its first few bytes,
+        falling back to the file ending. Returns None for uncompressed data.
+    """
+    for magic_bytes, compression in COMPRESSION_MAGIC:
+        if head.startswith(magic_bytes):
+            return compression
+    for _, compression in COMPRESSION_MAGIC:
+        if fmt.endswith(compression):
+            return compression
+
+
+class ExtractedReader:
+    """ A file-like object that decompresses a source while it is read.
+        The checksums of the compressed source are computed as it is read.
+    """
+
+    def __init__(self, source, fmt='', checksum_types=()):
+        if isinstance(source, mmap.mmap):
+            source.seek(0)
+            fileobj = source
+        elif hasattr(source, 'read'):
+            fileobj = source
+        else:
+            fileobj = BytesIO(source)
+        self.source = ChecksumReader(fileobj, *checksum_types)
+        self.compression = get_compression(self.source.peek(8), fmt)
+        if self.compression == 'gz':
+            self.fileobj = gzip.GzipFile(fileobj=self.source, mode='rb')
+        elif self.compression == 'bz2':
+            self.fileobj = bz2.BZ2File(self.source, mode='rb')
+        elif self.compression == 'xz':
+            self.fileobj = lzma.LZMAFile(self.source, mode='rb')
+        elif self.compression == 'zst':
+            if hasattr(zstd, 'ZstdFile'):
+                self.fileobj = zstd.ZstdFile(self.source, mode='rb')
+            else:
+                self.fileobj = zstd.ZstdDecompressor().stream_reader(self.source, read_across_frames=True)
+        else:
+            self.fileobj = self.source
+        self.error = None
+
+    def read(self, size=-1):
+        if self.error:
+            return b''
+        try:
+            return self.fileobj.read(size)
+        except (OSError, EOFError, ValueError, lzma.LZMAError, zlib.error, zstd.ZstdError) as e:
+            self.error = e
+            error_message(text=f'{self.compression}: {e}')
+            return b''
+
+    def __iter__(self):
+        """ Iterate over the lines of the extracted contents
+        """
+        pending = b''
+        while True:
+            chunk = self.read(65536)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if pending:
+            yield pending
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.fileobj is not self.source:
+            self.fileobj.close()
+
+    def hexdigest(self, checksum_type=None):
+        """ Read any remaining data and return a checksum of the compressed
+            source
+        """
+        while self.read(65536):
+            pass
+        return self.source.hexdigest(checksum_type)
+
+
+def open_extracted(source, fmt='', checksum_types=()):
+    """ Returns a file-like object that streams the decompressed contents of
+        source, which can be bytes or a file-like object. The compression
+        format is detected from the first few bytes, or from the file ending
+        in fmt. Any checksum_types are computed over the compressed data as it
+        is read, see ExtractedReader.hexdigest().
+    """
+    return ExtractedReader(source, fmt, checksum_types)
+
+
+def load_json(data):
+    """ Parse JSON from fetched content, which can be bytes, str or
+        SpooledContent. SpooledContent is parsed as a stream, as json.loads
+        only accepts str, bytes or bytearray.
+    """
+    if isinstance(data, mmap.mmap):
+        data.seek(0)
+        return json.load(data)
+    return json.loads(data)
+
+
+def iter_json_object_items(reader, chunk_size=1048576):
+    """ Incrementally parse a JSON object from a binary file-like object,
+        yielding its (key, value) pairs one at a time, so that only one value
+        is held in memory at once rather than the whole object.
+    """
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def read_more():
+        nonlocal buf, pos, eof
+        chunk = reader.read(chunk_size)
+        eof = not chunk
+        buf = buf[pos:] + utf8_decoder.decode(chunk, final=eof)
+        pos = 0
+
+    def next_char():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\n\r':
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf[pos:pos + 1]
+            read_more()
+
+    def decode_value():
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # a value at the end of the buffer may be incomplete, e.g. a number
+                if end < len(buf) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            read_more()
+
+    def expect(chars):
+        nonlocal pos
+        char = next_char()
+        if not char or char not in chars:
+            raise json.JSONDecodeError(f'Expecting one of {chars!r}', buf, pos)
+        pos += 1
+        return char
+
+    expect('{')
+    if next_char() == '}':
+        return
+    while True:
+        next_char()
+        key = decode_value()
+        expect(':')
+        next_char()
+        yield key, decode_value()
+        if expect(',}') == '}':
+            return
+
+
 def extract(data, fmt):
-    """ Extract the contents based on mimetype or file ending. Return the
-        unmodified data if neither mimetype nor file ending matches, otherwise
-        return the extracted contents.
+    """ Extract the contents based on the compression format or file ending.
+        Return the unmodified data if neither matches, otherwise return the
+        extracted contents, or None if the data could not be extracted.
     """
-    try:
-        mime = magic.from_buffer(data, mime=True)
-    except AttributeError:
-        # old python-magic API
-        m = magic.open(magic.MAGIC_MIME)
-        m.load()
-        mime = m.buffer(data).split(';')[0]
-    if mime == 'application/zstd' or fmt.endswith('zst'):
-        return unzstd(data)
-    if mime == 'application/x-xz' or fmt.endswith('xz'):
-        return unxz(data)
-    elif mime == 'application/x-bzip2' or fmt.endswith('bz2'):
-        return bunzip2(data)
-    elif mime == 'application/gzip' or fmt.endswith('gz'):
-        return gunzip(data)
-    return data
+    reader = open_extracted(data, fmt)
+    if reader.compression is None:
+        return data
+    with reader:
+        extracted = reader.read()
+    if reader.error:
+        return
+    return extracted
 
 
 def get_checksum(data, checksum_type):
@@ -264,6 +501,60 @@ def get_md5(data):
     return md5(data).hexdigest()
 
 
+class ChecksumReader:
+    """ Wraps a file-like object and computes the checksums of all data read
+        through it, so that streamed content can be verified without
+        holding it in memory
+    """
+
+    hashers = {
+        Checksum.md5: md5,
+        Checksum.sha: sha1,
+        Checksum.sha1: sha1,
+        Checksum.sha256: sha256,
+        Checksum.sha512: sha512,
+    }
+
+    def __init__(self, fileobj, *checksum_types):
+        self.fileobj = fileobj
+        self.hashers = {checksum_type: self.hashers[checksum_type]() for checksum_type in checksum_types}
+        self.buffer = b''
+
+    def _read(self, size):
+        data = self.fileobj.read(size) or b''
+        for hasher in self.hashers.values():
+            hasher.update(data)
+        return data
+
+    def peek(self, size):
+        """ Return up to size bytes without consuming them
+        """
+        if len(self.buffer) < size:
+            self.buffer += self._read(size - len(self.buffer))
+        return self.buffer[:size]
+
+    def read(self, size=-1):
+        if not self.buffer:
+            return self._read(size)
+        if size is None or size < 0:
+            data = self.buffer + self._read(-1)
+            self.buffer = b''
+        else:
+            data = self.buffer[:size]
+            self.buffer = self.buffer[size:]
+        return data
+
+    def hexdigest(self, checksum_type=None):
+        """ Read any remaining data and return the checksum. Returns the first
+            checksum if no checksum_type is given.
+        """
+        while self.read(65536):
+            pass
+        if checksum_type is None:
+            checksum_type = next(iter(self.hashers))
+        return self.hashers[checksum_type].hexdigest()
+
+
 def is_epoch_time(timestamp):
     """ Checks if an integer is likely a valid epoch timestamp.
         Returns True if the integer is likely a valid epoch timestamp, False otherwise.
@@ -321,24 +612,49 @@ def fetch_concurrently(func, items, max_workers=25):
             yield future.result()
 
 
-def run_concurrently(func, items, max_workers=25):
+def run_concurrently(func, items, max_workers=25, queue_size=None):
     """ Run func across items using multiprocessing, yielding results as
-        they complete. Uses multiprocessing.Pool on Python < 3.12 to avoid
+        they complete. At most queue_size items (default: twice max_workers)
+        are queued or being processed at once, so that when the caller is
+        slower than the workers, e.g. because it writes the results to the
+        database, the workers wait for it rather than piling up results.
+        Uses multiprocessing.Pool on Python < 3.12 to avoid
         ProcessPoolExecutor deadlock (CPython #105829).
     """
     import concurrent.futures
+    import itertools
     import multiprocessing
+    import queue
     import sys
 
     from django.db import connections
     connections.close_all()
-    items = list(items)
+    items = iter(items)
+    queue_size = queue_size or max_workers * 2
+    completed = queue.Queue()
+
     if sys.version_info >= (3, 12):
-        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(func, item) for item in items]
-            for future in concurrent.futures.as_completed(futures):
-                yield future.result()
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+
+        def submit(item):
+            pool.submit(func, item).add_done_callback(completed.put)
     else:
-        with multiprocessing.Pool(processes=max_workers) as pool:
-            for result in pool.imap_unordered(func, items, chunksize=1):
-                yield result
+        pool = multiprocessing.Pool(processes=max_workers)
+
+        def submit(item):
+            future = concurrent.futures.Future()
+            future.add_done_callback(completed.put)
+            pool.apply_async(func, (item,), callback=future.set_result, error_callback=future.set_exception)
+
+    with pool:
+        pending = 0
+        for item in itertools.islice(items, queue_size):
+            submit(item)
+            pending += 1
+        while pending:
+            future = completed.get()
+            pending -= 1
+            for item in itertools.islice(items, 1):
+                submit(item)
+                pending += 1
+            yield future.result()
@@ -0,0 +1,315 @@
+# Copyright 2026 Marcus Furlong <furlongm@gmail.com>
+#
+# This file is part of Patchman.
+#
+# Patchman is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 only.
+#
+# Patchman is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchman. If not, see <http://www.gnu.org/licenses/>
+
+import json
+import mmap
+import os
+import tempfile
+from hashlib import sha256
+from io import BytesIO
+from urllib.parse import urlencode
+
+from requests.structures import CaseInsensitiveDict
+
+from util.logging import debug_message, warning_message
+
+# response headers that are stored alongside cached content
+CACHED_HEADERS = ['content-type', 'etag', 'last-modified']
+
+offline_mode = None
+
+
+class SpooledContent(mmap.mmap):
+    """ A read-only memory map of content that was spooled to a temporary
+        file. It can be used in place of bytes by extract and the checksum
+        helpers, without holding the content in memory.
+    """
+
+    def decode(self, *args, **kwargs):
+        return self[:].decode(*args, **kwargs)
+
+
+class CachedResponse:
+    """ A minimal stand-in for a requests.Response whose content is served
+        from the local metadata cache
+    """
+
+    status_code = 200
+    ok = True
+
+    def __init__(self, url, content, headers=None):
+        self.url = url
+        self.content = content
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.headers['content-length'] = str(len(content))
+
+    def __bool__(self):
+        return True
+
+    @property
+    def raw(self):
+        if isinstance(self.content, SpooledContent):
+            self.content.seek(0)
+            return self.content
+        return BytesIO(self.content)
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+
+def get_cache_dir():
+    """ Returns the metadata cache directory, or None if caching is disabled
+    """
+    from util import get_setting_of_type
+    return get_setting_of_type(
+        setting_name='METADATA_CACHE_DIR',
+        setting_type=str,
+        default=None,
+    )
+
+
+def get_cache_max_size():
+    """ Returns the maximum size of the metadata cache in bytes
+    """
+    from util import get_setting_of_type
+    max_size_mb = get_setting_of_type(
+        setting_name='METADATA_CACHE_MAX_SIZE',
+        setting_type=int,
+        default=2048,
+    )
+    return max_size_mb * 1024 * 1024
+
+
+def set_offline_mode(value):
+    """ Set the global offline_mode, overriding METADATA_CACHE_OFFLINE
+    """
+    global offline_mode
+    offline_mode = value
+
+
+def is_offline():
+    """ Returns True if metadata should only be served from the cache
+    """
+    if offline_mode is not None:
+        return offline_mode
+    from util import get_setting_of_type
+    return get_setting_of_type(
+        setting_name='METADATA_CACHE_OFFLINE',
+        setting_type=bool,
+        default=False,
+    )
+
+
+def get_cache_key(url, params=None):
+    """ Returns the cache key for a url and its query parameters
+    """
+    if params:
+        url = f'{url}?{urlencode(sorted(params.items()))}'
+    return sha256(url.encode()).hexdigest()
+
+
+def _index_path(cache_dir, key):
+    return os.path.join(cache_dir, 'index', key[:2], f'{key}.json')
+
+
+def _object_path(cache_dir, checksum):
+    return os.path.join(cache_dir, 'objects', checksum[:2], checksum)
+
+
+def _size_path(cache_dir):
+    return os.path.join(cache_dir, 'index', 'size')
+
+
+def _write_atomically(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+
+
+def get_cache_entry(key):
+    """ Returns the cache index entry for a key, or None if the content
+        is not cached
+    """
+    cache_dir = get_cache_dir()
+    if not cache_dir:
+        return
+    try:
+        with open(_index_path(cache_dir, key), 'r') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return
+    if not os.path.exists(_object_path(cache_dir, entry.get('sha256'))):
+        return
+    return entry
+
+
+def get_cached_content(checksum):
+    """ Returns cached content with the given sha256 checksum, or None if it
+        is not cached. Marks the content as recently used.
+        Content larger than FETCH_SPOOL_THRESHOLD MB is returned as a memory
+        mapped SpooledContent instead of being read into memory.
+    """
+    from util import get_spool_threshold
+    cache_dir = get_cache_dir()
+    if not cache_dir or not checksum:
+        return
+    path = _object_path(cache_dir, checksum)
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > get_spool_threshold():
+                content = SpooledContent(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                content = f.read()
+        os.utime(path)
+    except OSError:
+        return
+    return content
+
+
+def get_cached_response(url, key):
+    """ Returns a CachedResponse for a cache key, or None if it is not cached
+    """
+    entry = get_cache_entry(key)
+    if not entry:
+        return
+    content = get_cached_content(entry.get('sha256'))
+    if content is None:
+        return
+    debug_message(text=f'Using cached content for {url}')
+    return CachedResponse(url, content, entry.get('headers'))
+
+
+def get_conditional_headers(entry):
+    """ Returns the http headers to revalidate a cache entry
+    """
+    headers = {}
+    cached_headers = entry.get('headers', {})
+    if cached_headers.get('etag'):
+        headers['If-None-Match'] = cached_headers.get('etag')
+    if cached_headers.get('last-modified'):
+        headers['If-Modified-Since'] = cached_headers.get('last-modified')
+    return headers
+
+
+def store_content(key, url, content, headers=None):
+    """ Store content in the cache under its sha256 checksum and point the
+        cache key at it, then evict old content if the cache is too large
+    """
+    cache_dir = get_cache_dir()
+    if not cache_dir or content is None:
+        return
+    checksum = sha256(content).hexdigest()
+    entry = {
+        'url': url,
+        'sha256': checksum,
+        'headers': {},
+    }
+    if headers:
+        for header in CACHED_HEADERS:
+            if headers.get(header):
+                entry['headers'][header] = headers.get(header)
+    try:
+        path = _object_path(cache_dir, checksum)
+        if os.path.exists(path):
+            os.utime(path)
+            cache_size = None
+        else:
+            cache_size = get_cache_size(cache_dir) + len(content)
+            _write_atomically(path, content)
+        _write_atomically(_index_path(cache_dir, key), json.dumps(entry).encode())
+    except OSError as e:
+        warning_message(text=f'Unable to cache content for {url}: {e}')
+        return
+    if cache_size is None:
+        return
+    if cache_size > get_cache_max_size():
+        evict_cache_content()
+    else:
+        set_cache_size(cache_dir, cache_size)
+
+
+def get_cache_size(cache_dir):
+    """ Returns the total size of the cached content as tracked in the index,
+        counting the content if the size is not tracked yet
+    """
+    try:
+        with open(_size_path(cache_dir), 'r') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        pass
+    cache_size = sum(size for _, size, _ in _get_cached_objects(cache_dir))
+    set_cache_size(cache_dir, cache_size)
+    return cache_size
+
+
+def set_cache_size(cache_dir, cache_size):
+    """ Track the total size of the cached content in the index
+    """
+    try:
+        _write_atomically(_size_path(cache_dir), str(cache_size).encode())
+    except OSError as e:
+        warning_message(text=f'Unable to track metadata cache size: {e}')
+
+
+def _get_cached_objects(cache_dir):
+    objects = []
+    for root, _, files in os.walk(os.path.join(cache_dir, 'objects')):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            objects.append((stat.st_mtime, stat.st_size, path))
+    return objects
+
+
+def evict_cache_content():
+    """ Remove the least recently used content until the cache is within
+        METADATA_CACHE_MAX_SIZE. The cached content is only listed when the
+        tracked size exceeds the limit, and the tracked size is corrected.
+    """
+    cache_dir = get_cache_dir()
+    if not cache_dir:
+        return
+    max_size = get_cache_max_size()
+    objects = _get_cached_objects(cache_dir)
+    total_size = sum(size for _, size, _ in objects)
+    if total_size > max_size:
+        for _, size, path in sorted(objects):
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            debug_message(text=f'Evicted {path} from metadata cache')
+            total_size -= size
+            if total_size <= max_size:
+                break
+    set_cache_size(cache_dir, total_size)
@@ -24,7 +24,7 @@ from django.template.loader import get_template
 from django.utils import timezone
 from django.utils.html import format_html
 from django_tables2 import RequestConfig
-from humanize import naturaltime
+from humanize import naturaldelta, naturaltime
 
 from util import get_setting_of_type
 
@@ -136,6 +136,13 @@ def reports_timedelta():
     return naturaltime(timezone.now() - timedelta(days=days))
 
 
+@register.filter
+def duration(seconds):
+    if seconds is None:
+        return ''
+    return naturaldelta(timedelta(seconds=seconds))
+
+
 @register.simple_tag
 def host_count(osrelease):
     return osrelease.osvariant_set.aggregate(total=Sum('hosts_count'))['total'] or 0
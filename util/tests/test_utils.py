@@ -14,18 +14,31 @@
 # You should have received a copy of the GNU General Public License
 # along with Patchman. If not, see <http://www.gnu.org/licenses/>
 
+import bz2
 import gzip
 import hashlib
+import itertools
+import json
+import lzma
+import os
+import shutil
+import tempfile
 from io import BytesIO
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from django.test import TestCase, override_settings
 
 from util import (
-    Checksum, bunzip2, extract, get_checksum, get_md5, get_sha1, get_sha256,
-    get_sha512, gunzip, has_setting_of_type, is_epoch_time, response_is_valid,
+    Checksum, SpooledContent, bunzip2, extract, fetch_content, get_checksum,
+    get_md5, get_sha1, get_sha256, get_sha512, get_url, gunzip,
+    has_setting_of_type, is_epoch_time, iter_json_object_items, load_json,
+    open_extracted, response_is_valid, run_concurrently,
     sanitize_filter_params, tz_aware_datetime,
 )
+from util.cache import (
+    CachedResponse, get_cache_key, get_cache_size, get_cached_content,
+    set_offline_mode, store_content,
+)
 
 
 @override_settings(
@@ -144,6 +157,40 @@ class CompressionTests(TestCase):
         result = extract(data, 'unknown')
         self.assertEqual(result, data)
 
+    def test_open_extracted_detects_format_from_magic_bytes(self):
+        """Test open_extracted detects the compression format regardless of file ending."""
+        original = b'test content\n' * 1000
+        for compressed, compression in [
+            (gzip.compress(original), 'gz'),
+            (bz2.compress(original), 'bz2'),
+            (lzma.compress(original), 'xz'),
+        ]:
+            with open_extracted(compressed, 'repodata.xml') as reader:
+                self.assertEqual(reader.compression, compression)
+                self.assertEqual(reader.read(), original)
+
+    def test_open_extracted_computes_checksums(self):
+        """Test open_extracted computes checksums of the compressed data while reading."""
+        original = b'test content\n' * 1000
+        compressed = gzip.compress(original)
+        reader = open_extracted(BytesIO(compressed), checksum_types=[Checksum.sha1, Checksum.sha256])
+        self.assertEqual(b''.join(reader), original)
+        self.assertEqual(reader.hexdigest(Checksum.sha1), hashlib.sha1(compressed).hexdigest())
+        self.assertEqual(reader.hexdigest(Checksum.sha256), hashlib.sha256(compressed).hexdigest())
+
+    def test_open_extracted_uncompressed(self):
+        """Test open_extracted passes uncompressed data through."""
+        data = b'unchanged data'
+        reader = open_extracted(data, checksum_types=[Checksum.md5])
+        self.assertIsNone(reader.compression)
+        self.assertEqual(reader.read(4), b'unch')
+        self.assertEqual(reader.read(), b'anged data')
+        self.assertEqual(reader.hexdigest(), hashlib.md5(data).hexdigest())
+
+    def test_extract_invalid_data(self):
+        """Test extract with invalid compressed data returns None."""
+        self.assertIsNone(extract(b'\x1f\x8bnot really gzipped', 'gz'))
+
 
 @override_settings(
     CELERY_TASK_ALWAYS_EAGER=True,
@@ -259,3 +306,202 @@ class SettingsTests(TestCase):
         """Test has_setting_of_type with bool setting."""
         result = has_setting_of_type('TEST_BOOL_SETTING', bool)
         self.assertTrue(result)
+
+
+def mock_http_response(url, status_code=200, content=b'', headers=None):
+    response = MagicMock()
+    response.url = url
+    response.status_code = status_code
+    response.ok = status_code < 400
+    response.content = content
+    response.headers = headers or {}
+    response.iter_content.return_value = [content]
+    return response
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class MetadataCacheTests(TestCase):
+    """Tests for the on-disk metadata cache."""
+
+    url = 'http://mirror.example.com/repodata/repomd.xml'
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        cache_settings = override_settings(METADATA_CACHE_DIR=self.cache_dir)
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.addCleanup(set_offline_mode, None)
+
+    @patch('util.requests.get')
+    def test_fetched_content_is_revalidated(self, mock_get):
+        """Test that cached content is served when the server returns 304."""
+        mock_get.return_value = mock_http_response(self.url, content=b'repomd', headers={'etag': '"abc"'})
+        self.assertEqual(fetch_content(get_url(self.url)), b'repomd')
+
+        mock_get.return_value = mock_http_response(self.url, status_code=304)
+        response = get_url(self.url)
+        self.assertIsInstance(response, CachedResponse)
+        self.assertEqual(fetch_content(response), b'repomd')
+        self.assertEqual(mock_get.call_args.kwargs['headers'].get('If-None-Match'), '"abc"')
+
+    @patch('util.requests.get')
+    def test_caller_conditional_headers_are_respected(self, mock_get):
+        """Test that the caller's own validators are sent and a 304 is returned to it."""
+        mock_get.return_value = mock_http_response(self.url, content=b'repomd', headers={'etag': '"abc"'})
+        self.assertEqual(fetch_content(get_url(self.url)), b'repomd')
+
+        mock_get.return_value = mock_http_response(self.url, status_code=304)
+        response = get_url(self.url, headers={'If-None-Match': '"def"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIsInstance(response, CachedResponse)
+        self.assertEqual(mock_get.call_args.kwargs['headers'].get('If-None-Match'), '"def"')
+
+    @patch('util.requests.get')
+    def test_offline_mode(self, mock_get):
+        """Test that offline mode only serves cached content."""
+        store_content(get_cache_key(self.url), self.url, b'repomd')
+        set_offline_mode(True)
+        self.assertEqual(fetch_content(get_url(self.url)), b'repomd')
+        self.assertIsNone(get_url('http://mirror.example.com/other.xml'))
+        mock_get.assert_not_called()
+
+    def test_content_is_stored_once(self):
+        """Test that identical content from different urls is stored once."""
+        store_content(get_cache_key(self.url), self.url, b'primary')
+        other_url = 'http://other.example.com/repodata/repomd.xml'
+        store_content(get_cache_key(other_url), other_url, b'primary')
+        objects = [f for _, _, files in os.walk(os.path.join(self.cache_dir, 'objects')) for f in files]
+        self.assertEqual(objects, [hashlib.sha256(b'primary').hexdigest()])
+        self.assertEqual(get_cached_content(objects[0]), b'primary')
+
+    @override_settings(METADATA_CACHE_MAX_SIZE=1)
+    def test_least_recently_used_content_is_evicted(self):
+        """Test that the oldest content is evicted when the cache is full."""
+        old = b'a' * 600 * 1024
+        new = b'b' * 600 * 1024
+        store_content(get_cache_key('http://a'), 'http://a', old)
+        old_checksum = hashlib.sha256(old).hexdigest()
+        old_path = os.path.join(self.cache_dir, 'objects', old_checksum[:2], old_checksum)
+        os.utime(old_path, (0, 0))
+        store_content(get_cache_key('http://b'), 'http://b', new)
+        self.assertIsNone(get_cached_content(old_checksum))
+        self.assertEqual(get_cached_content(hashlib.sha256(new).hexdigest()), new)
+
+    def test_cache_size_is_tracked(self):
+        """Test that the cache size is tracked without listing the cached content."""
+        store_content(get_cache_key('http://a'), 'http://a', b'a' * 100)
+        with patch('util.cache.os.walk') as walk:
+            store_content(get_cache_key('http://b'), 'http://b', b'b' * 50)
+            store_content(get_cache_key('http://c'), 'http://c', b'b' * 50)
+        walk.assert_not_called()
+        self.assertEqual(get_cache_size(self.cache_dir), 150)
+
+    @override_settings(FETCH_SPOOL_THRESHOLD=0)
+    def test_large_cached_content_is_memory_mapped(self):
+        """Test that large cached content is not read into memory."""
+        store_content(get_cache_key(self.url), self.url, b'primary')
+        content = get_cached_content(hashlib.sha256(b'primary').hexdigest())
+        self.assertIsInstance(content, SpooledContent)
+        self.assertEqual(content[:], b'primary')
+        set_offline_mode(True)
+        self.assertEqual(get_url(self.url).raw.read(), b'primary')
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class FetchContentTests(TestCase):
+    """Tests for fetch_content."""
+
+    def chunked_response(self, data, chunk_size=1000):
+        response = mock_http_response('http://example.com/primary.xml.gz', content=data,
+                                      headers={'content-length': str(len(data))})
+        response.iter_content.return_value = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+        return response
+
+    def test_chunks_are_joined(self):
+        """Test that content below the spool threshold is returned as bytes."""
+        data = b'x' * 10000
+        content = fetch_content(self.chunked_response(data))
+        self.assertIsInstance(content, bytes)
+        self.assertEqual(content, data)
+
+    @override_settings(FETCH_SPOOL_THRESHOLD=0)
+    def test_large_content_is_spooled(self):
+        """Test that spooled content can be extracted, checksummed and decoded."""
+        data = gzip.compress(b'<metadata packages="0"/>' * 1000)
+        content = fetch_content(self.chunked_response(data))
+        self.assertIsInstance(content, SpooledContent)
+        self.assertEqual(len(content), len(data))
+        self.assertEqual(get_checksum(content, Checksum.sha256), hashlib.sha256(data).hexdigest())
+        self.assertEqual(extract(content, 'primary.xml.gz'), b'<metadata packages="0"/>' * 1000)
+        self.assertEqual(fetch_content(self.chunked_response(b'plain')).decode(), 'plain')
+
+    @override_settings(FETCH_SPOOL_THRESHOLD=0)
+    def test_spooled_json_is_parsed(self):
+        """Test that JSON content spooled to disk can be parsed."""
+        data = json.dumps({'data': [{'id': i} for i in range(1000)]}).encode()
+        content = fetch_content(self.chunked_response(data))
+        self.assertIsInstance(content, SpooledContent)
+        self.assertEqual(load_json(content), json.loads(data))
+        self.assertEqual(load_json(content), json.loads(data))
+        self.assertEqual(load_json(data), json.loads(data))
+
+
+def square(x):
+    if x < 0:
+        raise ValueError(x)
+    return x * x
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class RunConcurrentlyTests(TestCase):
+    """Tests for run_concurrently."""
+
+    def test_all_results_are_yielded(self):
+        """Test that every item is processed once."""
+        results = run_concurrently(square, range(20), max_workers=2, queue_size=3)
+        self.assertEqual(sorted(results), [x * x for x in range(20)])
+
+    def test_items_are_consumed_lazily(self):
+        """Test that only queue_size items are taken from the iterable ahead of the caller."""
+        items = itertools.count()
+        results = run_concurrently(square, items, max_workers=2, queue_size=4)
+        self.assertEqual(len(list(itertools.islice(results, 3))), 3)
+        results.close()
+        self.assertLessEqual(next(items), 7)
+
+    def test_worker_exceptions_are_raised(self):
+        """Test that an exception in a worker is raised in the caller."""
+        with self.assertRaises(ValueError):
+            list(run_concurrently(square, [1, -1, 2], max_workers=2))
+
+
+class JSONStreamTests(TestCase):
+    """Tests for iter_json_object_items."""
+
+    def test_items_are_yielded_across_chunks(self):
+        """Test that values split across read chunks are parsed correctly."""
+        data = {'1': {'title': 'caf\u00e9', 'releases': [1, 2]}, '2': 12345, '3': None, '4': 'x'}
+        content = json.dumps(data, indent=1, ensure_ascii=False).encode()
+        for chunk_size in (1, 3, 1024):
+            items = iter_json_object_items(BytesIO(content), chunk_size=chunk_size)
+            self.assertEqual(list(items), list(data.items()))
+
+    def test_empty_object(self):
+        """Test that an empty object yields nothing."""
+        self.assertEqual(list(iter_json_object_items(BytesIO(b' {} '))), [])
+
+    def test_invalid_json_raises(self):
+        """Test that truncated or non-object JSON raises a JSONDecodeError."""
+        for content in [b'{"a": 1', b'[1, 2]', b'{"a" 1}']:
+            with self.assertRaises(json.JSONDecodeError):
+                list(iter_json_object_items(BytesIO(content), chunk_size=2))